@@ -0,0 +1,101 @@
+import sys
+from argparse import ArgumentParser
+
+from helpers import benchmark
+
+argparser = ArgumentParser()
+
+argparser.add_argument(
+    "datasets",
+    nargs="*",
+    help="Directories with the CTI feeds, the bundled datasets by default",
+)
+argparser.add_argument(
+    "--stages",
+    action="store",
+    dest="stages",
+    nargs="+",
+    default=benchmark.STAGES,
+    choices=benchmark.STAGES,
+    help="Stages to measure",
+)
+argparser.add_argument(
+    "--repeat",
+    action="store",
+    dest="repeat",
+    default=3,
+    type=int,
+    help="Runs of every stage, the median wall time is reported",
+)
+argparser.add_argument(
+    "--queries",
+    action="store",
+    dest="queries",
+    default=benchmark.QUERIES_COUNT,
+    type=int,
+    help="Number of IoCs scored by the point queries stage",
+)
+argparser.add_argument(
+    "--output",
+    action="store",
+    dest="output",
+    default=None,
+    help="Write the results as JSON to the file",
+)
+argparser.add_argument(
+    "--baseline",
+    action="store",
+    dest="baseline",
+    default=None,
+    help="Results file to compare with, exits with 1 on regressions",
+)
+argparser.add_argument(
+    "--time-threshold",
+    action="store",
+    dest="time_threshold",
+    default=benchmark.TIME_THRESHOLD,
+    type=float,
+    help="Allowed wall time increase over the baseline, share",
+)
+argparser.add_argument(
+    "--memory-threshold",
+    action="store",
+    dest="memory_threshold",
+    default=benchmark.MEMORY_THRESHOLD,
+    type=float,
+    help="Allowed peak memory increase over the baseline, share",
+)
+argparser.add_argument(
+    "--min-time",
+    action="store",
+    dest="min_time",
+    default=benchmark.MIN_TIME,
+    type=float,
+    help="Wall time of faster stages is not compared, seconds",
+)
+
+
+args = argparser.parse_args()
+
+results = benchmark.run_benchmarks(
+    args.datasets or None, args.stages, args.repeat, args.queries
+)
+if args.output:
+    benchmark.write_results(args.output, results)
+
+if args.baseline:
+    regressions = benchmark.compare(
+        results,
+        benchmark.load_results(args.baseline),
+        args.time_threshold,
+        args.memory_threshold,
+        args.min_time,
+    )
+    for regression in regressions:
+        print(
+            "[BENCHMARK] Regression {dataset} {stage} {metric}: "
+            "{baseline:.4g} -> {current:.4g} (x{ratio:.2f})".format(**regression)
+        )
+    if regressions:
+        sys.exit(1)
+    print("[BENCHMARK] No regressions")
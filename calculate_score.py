@@ -1,7 +1,9 @@
 import os
+import sys
 import json
 from argparse import ArgumentParser
 import scoring_engine as engine
+from helpers import output, profiler
 
 argparser = ArgumentParser()
 
@@ -16,20 +18,206 @@ argparser.add_argument(
     default=None,
     help="Dump output to the file",
 )
+argparser.add_argument(
+    "--output",
+    action="store",
+    dest="output",
+    default=None,
+    help="Path of the output file, gzip-compressed if ends with .gz",
+)
+argparser.add_argument(
+    "--format",
+    action="store",
+    dest="format",
+    default="json",
+    choices=["json", *output.OUTPUT_FORMATS],
+    help="Output format: the whole result as one JSON document, "
+    "or one record per line as soon as it is scored (ndjson, csv)",
+)
+argparser.add_argument(
+    "--gzip",
+    action="store_true",
+    dest="gzip",
+    default=False,
+    help="Compress the output file with gzip",
+)
+argparser.add_argument(
+    "--unique",
+    action="store_true",
+    dest="unique",
+    default=False,
+    help="One record per distinct IoC with the feeds it is mentioned in "
+    "instead of one record per feed row",
+)
+argparser.add_argument(
+    "--hashed-keys",
+    action="store_true",
+    dest="hashed_keys",
+    default=False,
+    help="Group and join IoCs by 64-bit keys of the values",
+)
+argparser.add_argument(
+    "--incremental",
+    action="store_true",
+    dest="incremental",
+    default=False,
+    help="Keep the scoring state next to the feeds (.scores.npz), read only "
+    "the changed feeds and re-score only IoCs affected by the changes "
+    "since the previous run",
+)
+argparser.add_argument(
+    "--quiet",
+    action="store_true",
+    dest="quiet",
+    default=False,
+    help="Don't dump the result to stdout",
+)
+argparser.add_argument(
+    "--workers",
+    action="store",
+    dest="workers",
+    default=None,
+    type=int,
+    help="Number of workers reading the feeds concurrently",
+)
+argparser.add_argument(
+    "--processes",
+    action="store",
+    dest="processes",
+    default=None,
+    type=int,
+    help="Number of processes calculating the aggregates of the changed feeds "
+    "(one feed per task, the feeds are read in this process)",
+)
+argparser.add_argument(
+    "--min-score",
+    action="store",
+    dest="min_score",
+    default=None,
+    type=int,
+    help="Output only IoCs with score greater or equal to this one",
+)
+argparser.add_argument(
+    "--top-k",
+    action="store",
+    dest="top_k",
+    default=None,
+    type=int,
+    help="Output at most this many IoCs with the highest scores per feed",
+)
+argparser.add_argument(
+    "--stream",
+    action="store_true",
+    dest="stream",
+    default=False,
+    help="Score feeds by chunks with bounded memory, for feeds larger than RAM",
+)
+argparser.add_argument(
+    "--memory-budget",
+    action="store",
+    dest="memory_budget",
+    default=engine.streaming.MEMORY_BUDGET // 2 ** 20,
+    type=int,
+    help="Memory for the buffered feeds rows in streaming mode, MiB",
+)
+argparser.add_argument(
+    "--profile",
+    action="store",
+    dest="profile",
+    default=None,
+    type=str,
+    help="Write the spans statistics (calls, total time, percentiles) to this JSON file",
+)
+argparser.add_argument(
+    "--trace",
+    action="store",
+    dest="trace",
+    default=None,
+    type=str,
+    help="Write the spans as Chrome trace events to this JSON file",
+)
 
 
 args = argparser.parse_args()
 FEED_PATH: str = os.path.abspath(os.path.join(os.getcwd(), args.path))
 
-print("Calculate iocs score for", FEED_PATH)
-result = engine.calculate_iocs_score(FEED_PATH)
-print("\n", result, "\n")
-
-if args.file:
-    workdir: str = os.path.abspath(os.getcwd())
-    filename: str = os.path.basename(FEED_PATH) + ".json"
-    with open(
-        os.path.join(workdir, filename),
-        "w",
-    ) as file:
-        file.write(json.dumps(result))
+if args.unique and args.stream:
+    argparser.error("--unique is not supported in streaming mode")
+if args.top_k is not None and args.stream:
+    # Top rows of a feed are known only after all its partitions are scored
+    argparser.error("--top-k is not supported in streaming mode")
+
+engine.HASHED_IOC_KEYS = args.hashed_keys
+engine.INCREMENTAL_SCORES = args.incremental
+engine.PROCESSES = args.processes
+if args.profile or args.trace:
+    profiler.enable(trace=bool(args.trace))
+
+print("Calculate iocs score for", FEED_PATH, file=sys.stderr)
+
+# Streaming mode produces rows, so it is written one record per line
+output_format: str = "ndjson" if args.stream and args.format == "json" else args.format
+output_path = args.output
+if output_path is None and args.file:
+    extension = "json" if output_format == "json" else output_format
+    output_path = os.path.join(
+        os.path.abspath(os.getcwd()),
+        os.path.basename(FEED_PATH) + "." + extension + (".gz" if args.gzip else ""),
+    )
+
+if output_format == "json":
+    if args.unique:
+        result = list(
+            engine.iter_unique_iocs_score(
+                FEED_PATH,
+                min_score=args.min_score,
+                top_k=args.top_k,
+                workers=args.workers,
+            )
+        )
+    elif args.min_score is not None or args.top_k is not None:
+        # Records are built only for the selected rows
+        result = engine.select_iocs_score(
+            FEED_PATH, min_score=args.min_score, top_k=args.top_k, workers=args.workers
+        )
+    else:
+        result = engine.calculate_iocs_score(FEED_PATH, workers=args.workers)
+
+    if not args.quiet:
+        print("\n", result, "\n")
+
+    if output_path:
+        with output.open_output(output_path, args.gzip) as file:
+            json.dump(result, file)
+else:
+    # Rows are written as soon as they are scored, one record per line
+    if args.stream:
+        rows = engine.calculate_iocs_score_stream(
+            FEED_PATH,
+            memory_budget=args.memory_budget * 2 ** 20,
+            min_score=args.min_score,
+        )
+    elif args.unique:
+        rows = engine.iter_unique_iocs_score(
+            FEED_PATH, min_score=args.min_score, top_k=args.top_k, workers=args.workers
+        )
+    else:
+        rows = engine.iter_iocs_score_rows(
+            FEED_PATH, min_score=args.min_score, top_k=args.top_k, workers=args.workers
+        )
+    columns = output.UNIQUE_CSV_COLUMNS if args.unique else output.CSV_COLUMNS
+
+    if output_path:
+        with output.open_output(output_path, args.gzip) as file:
+            count = output.write_rows(rows, file, output_format, columns)
+    elif not args.quiet:
+        count = output.write_rows(rows, sys.stdout, output_format, columns)
+    else:
+        count = sum(1 for _ in rows)
+
+    print("Scored rows:", count, file=sys.stderr)
+
+if args.profile:
+    profiler.write_json(args.profile)
+if args.trace:
+    profiler.write_chrome_trace(args.trace)
@@ -1,47 +1,40 @@
 import os
-import random
 import argparse
-from typing import Any, Dict, List
+from datetime import date, datetime
+from typing import Dict
 
-import pandas as pd
+import numpy as np
 
-from generators import FakeGenerators
+from generators import (
+    DEFAULT_TYPE_MIX,
+    SIZE_DISTRIBUTIONS,
+    FakeGenerators,
+    write_feed_csv,
+)
 
-fake = FakeGenerators()
-feed = pd.DataFrame()
 argparser = argparse.ArgumentParser()
 
 FEED_PATH: str = os.path.join(os.getcwd(), "data/dataset_04_large")
 
 
-def generate_random_feed(ioc_quatity: int) -> pd.DataFrame:
-    # TODO: add feed uniqueness %
-    ioc: Dict[str, Any] = {}
-    feed: List[Dict[str, Any]] = []
-
-    for _ in range(ioc_quatity):
-        first_seen = fake.generate_date_between_dates()
-        last_seen = fake.generate_last_seen_date(first_seen)
-        ioc = {
-            "id": fake.generate_uuid4(),
-            "value": fake.generate_random_value(),
-            "first_seen": first_seen,
-            "last_seen": last_seen,
-            "relationship_count": fake.generate_random_int(),
-            "detections_count": fake.generate_random_int(0, 5),
-        }
-        feed.append(ioc.copy())
-
-    return pd.DataFrame(feed)
+def parse_type_mix(type_mix: str) -> Dict[str, float]:
+    """`md5=1,ipv4=2` to {"md5": 1.0, "ipv4": 2.0}"""
+    weights: Dict[str, float] = {}
+    for item in type_mix.split(","):
+        ioc_type, _, weight = item.partition("=")
+        weights[ioc_type.strip()] = float(weight or 1)
+    return weights
 
 
-def write_feed(filename: str, data: pd.DataFrame) -> None:
-    filepath: str = os.path.join(FEED_PATH, os.path.basename(filename) + ".csv")
+def write_feed(
+    filename: str, data: Dict[str, np.ndarray], path: str = FEED_PATH
+) -> None:
+    filepath: str = os.path.join(path, os.path.basename(filename) + ".csv")
 
-    if not os.path.exists(FEED_PATH):
-        os.makedirs(FEED_PATH)
+    if not os.path.exists(path):
+        os.makedirs(path)
 
-    data.to_csv(filepath)
+    write_feed_csv(filepath, data)
     print(f"[INFO] Wrote feed at: {filepath}")
 
 
@@ -54,10 +47,92 @@ argparser.add_argument(
     required=True,
     help="Number of feeds have to be generated",
 )
+argparser.add_argument(
+    "--output",
+    action="store",
+    dest="output",
+    default=FEED_PATH,
+    type=str,
+    help="Directory the feeds are written to",
+)
+argparser.add_argument(
+    "--seed",
+    action="store",
+    dest="seed",
+    default=None,
+    type=int,
+    help="Seed of the generator, the same seed gives the same feeds",
+)
+argparser.add_argument(
+    "--min-size",
+    action="store",
+    dest="min_size",
+    default=5,
+    type=int,
+    help="Minimal number of IoCs in a feed",
+)
+argparser.add_argument(
+    "--max-size",
+    action="store",
+    dest="max_size",
+    default=10,
+    type=int,
+    help="Maximal number of IoCs in a feed",
+)
+argparser.add_argument(
+    "--size-distribution",
+    action="store",
+    dest="size_distribution",
+    default="uniform",
+    choices=SIZE_DISTRIBUTIONS,
+    help="Distribution of the feed sizes between the minimal and maximal ones",
+)
+argparser.add_argument(
+    "--overlap",
+    action="store",
+    dest="overlap",
+    default=0.0,
+    type=float,
+    help="Share of every feed IoCs drawn from the pool shared by all the feeds",
+)
+argparser.add_argument(
+    "--date-from",
+    action="store",
+    dest="date_from",
+    default=date(2020, 12, 1),
+    type=date.fromisoformat,
+    help="First seen dates start at the date, YYYY-MM-DD",
+)
+argparser.add_argument(
+    "--date-to",
+    action="store",
+    dest="date_to",
+    default=datetime.now().date(),
+    type=date.fromisoformat,
+    help="First and last seen dates end before the date, YYYY-MM-DD",
+)
+argparser.add_argument(
+    "--type-mix",
+    action="store",
+    dest="type_mix",
+    default=None,
+    type=parse_type_mix,
+    help="Weights of the IoC types, e.g. md5=1,sha1=1,sha256=1,ipv4=3,ipv6=3 "
+    "(default: thirds of hashes, IPv4 and IPv6 addresses, "
+    f"of the types {','.join(DEFAULT_TYPE_MIX)})",
+)
 args = argparser.parse_args()
 
 if args.feeds_count:
-    for item in range(args.feeds_count):
-        filename: str = f"feed_{item}"
-        feed: pd.DataFrame = generate_random_feed(random.randint(5, 10))
-        write_feed(filename=filename, data=feed)
+    feeds = FakeGenerators(args.seed).generate_feeds(
+        args.feeds_count,
+        min_size=args.min_size,
+        max_size=args.max_size,
+        distribution=args.size_distribution,
+        overlap=args.overlap,
+        type_mix=args.type_mix,
+        start_date=args.date_from,
+        end_date=args.date_to,
+    )
+    for filename, feed in feeds:
+        write_feed(filename=filename, data=feed, path=args.output)
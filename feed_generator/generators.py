@@ -2,17 +2,117 @@ from datetime import date, datetime, timedelta
 import time
 import random
 from uuid import uuid4
-from typing import Optional, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
 
 digits = "0123456789"
 hexdigits_lower = digits + "abcdef"
 
+# Share of every IoC type among the generated values, the same
+# as `FakeGenerators.generate_random_value` picks them
+DEFAULT_TYPE_MIX: Dict[str, float] = {
+    "md5": 1 / 9,
+    "sha1": 1 / 9,
+    "sha256": 1 / 9,
+    "ipv4": 1 / 3,
+    "ipv6": 1 / 3,
+}
+# Longest value of every IoC type
+VALUE_LENGTHS: Dict[str, int] = {
+    "md5": 32,
+    "sha1": 40,
+    "sha256": 64,
+    "ipv4": 15,
+    "ipv6": 39,
+}
+SIZE_DISTRIBUTIONS: Tuple[str, ...] = ("uniform", "lognormal")
+FEED_COLUMNS: List[str] = [
+    "id",
+    "value",
+    "first_seen",
+    "last_seen",
+    "relationship_count",
+    "detections_count",
+]
+# Rows of the feed written to the CSV file at once
+CSV_CHUNK_ROWS: int = 2 ** 18
+
+HEX_CHARS = np.frombuffer(hexdigits_lower.encode(), dtype=np.uint8)
+OCTETS = np.array([str(i).encode() for i in range(256)], dtype="S3")
+HEXTETS = np.array(["{:x}".format(i).encode() for i in range(2 ** 16)], dtype="S4")
+
+
+def byte_matrix(strings: np.ndarray) -> np.ndarray:
+    """Bytes of the fixed width strings (`S` array), one row per string"""
+    strings = np.ascontiguousarray(strings)
+    return strings.view(np.uint8).reshape(len(strings), strings.dtype.itemsize)
+
+
+def compact(matrix: np.ndarray) -> np.ndarray:
+    """
+    Strings of the byte matrix rows without their NUL bytes, the NULs
+    are moved to the ends of the rows where `S` arrays drop them
+    """
+    order = np.argsort(matrix == 0, axis=1, kind="stable")
+    matrix = np.ascontiguousarray(np.take_along_axis(matrix, order, axis=1))
+    return matrix.view(f"S{matrix.shape[1]}").ravel()
+
+
+def concat_strings(strings: List[np.ndarray]) -> np.ndarray:
+    """Row-wise concatenation of the `S` arrays, like `a + b` of the strings"""
+    return compact(np.hstack([byte_matrix(item) for item in strings]))
+
+
+def format_ints(values: np.ndarray) -> np.ndarray:
+    """Decimal strings of the non-negative integers, as an `S` array"""
+    values = np.asarray(values, dtype=np.int64)
+    width = len(str(values.max())) if len(values) else 1
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+
+    digits_ = (values[:, None] // powers % 10 + ord("0")).astype(np.uint8)
+    # Leading zeros are dropped, the last digit is kept for the zero itself
+    digits_[(values[:, None] < powers) & (powers > 1)] = 0
+    return compact(digits_)
+
+
+def write_feed_csv(filepath: str, columns: Dict[str, np.ndarray]) -> None:
+    """
+    Write the feed columns (see `FakeGenerators.generate_feed_columns`)
+    to the CSV file the way `pd.DataFrame.to_csv` writes the feed frame:
+    the header, then the row number and the values of every row. Rows
+    are joined by NumPy in chunks of `CSV_CHUNK_ROWS`, not one by one
+    """
+    size = len(columns["id"])
+    with open(filepath, "wb") as file:
+        file.write(("," + ",".join(FEED_COLUMNS) + "\n").encode())
+        for start in range(0, size, CSV_CHUNK_ROWS):
+            end = min(start + CSV_CHUNK_ROWS, size)
+            comma = np.full(end - start, b",", dtype="S1")
+
+            fields = [format_ints(np.arange(start, end))]
+            for name in FEED_COLUMNS:
+                column = columns[name][start:end]
+                if column.dtype.kind in "iu":
+                    column = format_ints(column)
+                fields += [comma, column]
+            fields.append(np.full(end - start, b"\n", dtype="S1"))
+
+            matrix = np.hstack([byte_matrix(field) for field in fields])
+            file.write(matrix[matrix != 0].tobytes())
+
 
 class FakeGenerators:
     """
-    Methods for generate some fake data for tests
+    Methods for generate some fake data for tests. Methods with
+    the `_array` suffix generate many values at once with NumPy,
+    from the generator seeded with `seed`
     """
 
+    def __init__(self, seed: Optional[int] = None):
+        self.rng = np.random.default_rng(seed)
+
     def generate_uuid4(self) -> str:
         return str(uuid4())
 
@@ -92,3 +192,189 @@ class FakeGenerators:
 
     def generate_random_int(self, min: int = 0, max: int = 1000) -> int:
         return random.randint(min, max)
+
+    def generate_hex_array(self, count: int, length: int) -> np.ndarray:
+        """Random lowercase hex strings of the length, e.g. hashes"""
+        chars = HEX_CHARS[self.rng.integers(0, 16, (count, length), dtype=np.uint8)]
+        return chars.view(f"S{length}").ravel()
+
+    def generate_uuid4_array(self, count: int) -> np.ndarray:
+        chars = HEX_CHARS[self.rng.integers(0, 16, (count, 32), dtype=np.uint8)]
+        chars[:, 12] = ord("4")
+        chars[:, 16] = HEX_CHARS[self.rng.integers(8, 12, count, dtype=np.uint8)]
+
+        uuids = np.full((count, 36), ord("-"), dtype=np.uint8)
+        for start, end, position in (
+            (0, 8, 0),
+            (8, 12, 9),
+            (12, 16, 14),
+            (16, 20, 19),
+            (20, 32, 24),
+        ):
+            uuids[:, position : position + end - start] = chars[:, start:end]
+        return uuids.view("S36").ravel()
+
+    def generate_ipv4_array(self, count: int) -> np.ndarray:
+        octets = OCTETS[self.rng.integers(0, 256, (4, count))]
+        dot = np.full(count, b".", dtype="S1")
+        return concat_strings(
+            [octets[0], dot, octets[1], dot, octets[2], dot, octets[3]]
+        )
+
+    def generate_ipv6_array(self, count: int) -> np.ndarray:
+        hextets = HEXTETS[self.rng.integers(0, 2 ** 16, (8, count))]
+        colon = np.full(count, b":", dtype="S1")
+        return concat_strings(
+            [hextets[0]] + [item for hextet in hextets[1:] for item in (colon, hextet)]
+        )
+
+    def generate_values_array(
+        self, count: int, type_mix: Optional[Dict[str, float]] = None
+    ) -> np.ndarray:
+        """
+        Random IoC values, types are picked with the probabilities
+        of `type_mix` (weights of `md5`, `sha1`, `sha256`, `ipv4`,
+        `ipv6`), `DEFAULT_TYPE_MIX` by default
+        """
+        type_mix = type_mix or DEFAULT_TYPE_MIX
+        types = list(type_mix)
+        weights = np.array([type_mix[ioc_type] for ioc_type in types], dtype=np.float64)
+        if set(types) - set(VALUE_LENGTHS) or weights.min() < 0 or weights.sum() <= 0:
+            raise ValueError(f"Unsupported IoC type mix: {type_mix}")
+
+        picked = self.rng.choice(len(types), size=count, p=weights / weights.sum())
+        values = np.zeros(
+            count, dtype=f"S{max(VALUE_LENGTHS[ioc_type] for ioc_type in types)}"
+        )
+        for i, ioc_type in enumerate(types):
+            positions = np.flatnonzero(picked == i)
+            if ioc_type == "ipv4":
+                values[positions] = self.generate_ipv4_array(len(positions))
+            elif ioc_type == "ipv6":
+                values[positions] = self.generate_ipv6_array(len(positions))
+            else:
+                values[positions] = self.generate_hex_array(
+                    len(positions), VALUE_LENGTHS[ioc_type]
+                )
+        return values
+
+    def generate_dates_array(
+        self,
+        count: int,
+        start_date: date = date(2020, 12, 1),
+        end_date: date = datetime.now().date(),
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        `first_seen` between the dates (end excluded) and `last_seen`
+        between `first_seen` and the end date, as `%Y-%m-%d` strings
+        """
+        days = max((end_date - start_date).days, 1)
+        first_seen = self.rng.integers(0, days, count)
+        last_seen = first_seen + (self.rng.random(count) * (days - first_seen)).astype(
+            np.int64
+        )
+
+        dates = np.datetime_as_string(
+            np.datetime64(start_date.isoformat(), "D") + np.arange(days), unit="D"
+        ).astype("S10")
+        return dates[first_seen], dates[last_seen]
+
+    def generate_feed_sizes(
+        self,
+        feeds_count: int,
+        min_size: int = 5,
+        max_size: int = 10,
+        distribution: str = "uniform",
+    ) -> np.ndarray:
+        """
+        Rows count of every feed between the sizes: `uniform`, or
+        `lognormal` — most feeds are small and a few are large, like
+        the real feeds are
+        """
+        if distribution == "uniform":
+            return self.rng.integers(min_size, max_size + 1, feeds_count)
+        if distribution == "lognormal":
+            low, high = np.log(max(min_size, 1)), np.log(max(max_size, 1))
+            # Half-normal logarithm of the size, sizes fall off from the minimal
+            sizes = np.exp(
+                low + np.abs(self.rng.normal(0, (high - low) / 3, feeds_count))
+            )
+            return np.clip(np.rint(sizes), min_size, max_size).astype(np.int64)
+        raise ValueError(f"Unknown feed size distribution: {distribution}")
+
+    def generate_feed_columns(
+        self,
+        size: int,
+        shared_values: Optional[np.ndarray] = None,
+        overlap: float = 0.0,
+        type_mix: Optional[Dict[str, float]] = None,
+        start_date: date = date(2020, 12, 1),
+        end_date: date = datetime.now().date(),
+    ) -> Dict[str, np.ndarray]:
+        """
+        Columns of the feed of the size: strings as `S` arrays, counts as
+        integers. `overlap` share of the rows have values drawn from
+        `shared_values`, the rest of the values are new
+        """
+        shared = 0
+        if shared_values is not None and len(shared_values):
+            shared = int(round(size * overlap))
+
+        values = self.generate_values_array(size - shared, type_mix)
+        if shared:
+            drawn = self.rng.choice(
+                len(shared_values), shared, replace=shared > len(shared_values)
+            )
+            values = np.concatenate((values, shared_values[drawn]))
+            values = values[self.rng.permutation(size)]
+
+        first_seen, last_seen = self.generate_dates_array(size, start_date, end_date)
+        return {
+            "id": self.generate_uuid4_array(size),
+            "value": values,
+            "first_seen": first_seen,
+            "last_seen": last_seen,
+            "relationship_count": self.rng.integers(0, 1001, size),
+            "detections_count": self.rng.integers(0, 6, size),
+        }
+
+    def generate_feeds(
+        self,
+        feeds_count: int,
+        min_size: int = 5,
+        max_size: int = 10,
+        distribution: str = "uniform",
+        overlap: float = 0.0,
+        type_mix: Optional[Dict[str, float]] = None,
+        start_date: date = date(2020, 12, 1),
+        end_date: date = datetime.now().date(),
+    ) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+        """
+        Yield (`feed_<i>`, feed columns) for every feed. Feeds overlap
+        through the pool of IoC values shared by all of them, the pool is
+        as big as `overlap` share of the mean feed size
+        """
+        sizes = self.generate_feed_sizes(feeds_count, min_size, max_size, distribution)
+        shared_values = None
+        if overlap > 0 and feeds_count:
+            pool_size = max(1, int(round(sizes.mean() * overlap)))
+            shared_values = self.generate_values_array(pool_size, type_mix)
+
+        for i, size in enumerate(sizes.tolist()):
+            yield f"feed_{i}", self.generate_feed_columns(
+                size, shared_values, overlap, type_mix, start_date, end_date
+            )
+
+    @staticmethod
+    def feed_frame(columns: Dict[str, np.ndarray]) -> pd.DataFrame:
+        """Feed columns as the frame of strings and integers"""
+        return pd.DataFrame(
+            {
+                name: (
+                    columns[name].astype(str).astype(object)
+                    if columns[name].dtype.kind == "S"
+                    else columns[name]
+                )
+                for name in FEED_COLUMNS
+            }
+        )
@@ -0,0 +1,306 @@
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from glob import glob
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import scoring_engine as engine
+from helpers import io, partials
+from helpers.index import IocIndex
+from helpers.query import IocScorer
+
+RESULTS_FORMAT_VERSION: int = 1
+
+DATA_DIR: str = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "feed_generator",
+    "data",
+)
+# Bundled datasets, from the smallest to the largest
+DATASETS: List[str] = [
+    os.path.join(DATA_DIR, "real_data", "max_10_per_feed"),
+    os.path.join(DATA_DIR, "real_data", "max_100_per_feed"),
+    os.path.join(DATA_DIR, "real_data", "max_1k_per_feed"),
+    os.path.join(DATA_DIR, "real_data", "max_10k_per_feed"),
+    os.path.join(DATA_DIR, "synthetic_data", "dataset_01_mid"),
+    os.path.join(DATA_DIR, "synthetic_data", "dataset_02_small"),
+]
+STAGES: List[str] = ["ingestion", "statistics", "scoring", "queries"]
+
+# Stage is a regression if it is slower (takes more memory) than
+# the baseline by more than the threshold share
+TIME_THRESHOLD: float = 0.25
+MEMORY_THRESHOLD: float = 0.25
+# Stages faster than this in both runs are too noisy to compare, seconds
+MIN_TIME: float = 0.05
+# IoCs scored by the point queries stage
+QUERIES_COUNT: int = 1000
+# Scores are calculated as of this date, so that runs are comparable
+DT_NOW: float = time.mktime(datetime(2021, 11, 25).timetuple())
+
+
+def measure(function: Callable[[], Any], repeat: int = 3) -> Dict[str, Any]:
+    """
+    Run the function `repeat` times for the median wall time, then once
+    more under `tracemalloc` for the peak memory it allocates on top of
+    what has been allocated before (numpy buffers included)
+
+        Returns:
+
+            {"wall_time", "wall_times", "peak_memory"} and the result
+            of the last run under "result"
+    """
+    wall_times: List[float] = []
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter()
+        function()
+        wall_times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "wall_time": statistics.median(wall_times),
+        "wall_times": wall_times,
+        "peak_memory": peak - before,
+        "result": result,
+    }
+
+
+def copy_dataset(path: str, tmp_dir: str) -> str:
+    """
+    Copy of the dataset feeds without the stored statistics and
+    scores, so that every run starts cold and the bundled data
+    is not written to
+    """
+    target = os.path.join(tmp_dir, os.path.basename(os.path.normpath(path)))
+    shutil.copytree(path, target, ignore=shutil.ignore_patterns(".*"))
+    return target
+
+
+def benchmark_dataset(
+    path: str,
+    stages: Optional[List[str]] = None,
+    repeat: int = 3,
+    queries: int = QUERIES_COUNT,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """
+    Function runs the stages over a copy of the dataset:
+
+        * ingestion — feeds reading and the IoC-to-feed index
+        * statistics — feeds aggregates and statistics from scratch
+        * scoring — batch scoring of every feed row, output records included
+        * queries — point queries of `queries` random IoCs
+
+    The stages depend on the results of the previous ones, which are
+    calculated once (not measured) when the stage itself is not asked for.
+
+        Returns:
+
+            One result per stage: dataset, stage, number of the
+            processed IoCs (feed rows, queried IoCs for the queries),
+            median wall time of `repeat` runs, IoCs per second, peak
+            memory (bytes), feeds and rows count of the dataset
+    """
+    stages = stages or STAGES
+    name = os.path.basename(os.path.normpath(path))
+    results: List[Dict[str, Any]] = []
+
+    tmp_dir = tempfile.mkdtemp(prefix="iocs-bench-")
+    try:
+        feeds_path = copy_dataset(path, tmp_dir)
+        state: Dict[str, Any] = {}
+
+        def ingestion():
+            cti_feeds = io.load_feeds(feeds_path)
+            return cti_feeds, IocIndex.from_feeds(cti_feeds)
+
+        def recalculate_statistics():
+            statistics_ = partials.update_statistics(
+                feeds_path, state["cti_feeds"], force=True
+            )
+            io.write_statistics(feeds_path, **statistics_)
+            return io.feeds_statistics_frame(io.load_statistics_arrays(feeds_path))
+
+        def scoring():
+            return engine._calculate_iocs_score_batch(
+                state["cti_feeds"],
+                state["feeds_stats"],
+                dt_now=DT_NOW,
+                index=state["index"],
+            )
+
+        def point_queries():
+            scorer = IocScorer.from_statistics(state["index"], state["feeds_stats"])
+            return scorer.query(state["queried"], DT_NOW)
+
+        def run(
+            stage: str, function: Callable[[], Any], iocs: Callable[[Any], int]
+        ) -> Any:
+            if stage not in stages:
+                return function()
+
+            measured = measure(function, repeat)
+            count = iocs(measured["result"])
+            results.append(
+                {
+                    "dataset": name,
+                    "stage": stage,
+                    "iocs": count,
+                    "wall_time": measured["wall_time"],
+                    "iocs_per_sec": (
+                        count / measured["wall_time"] if measured["wall_time"] else 0.0
+                    ),
+                    "peak_memory": measured["peak_memory"],
+                }
+            )
+            return measured["result"]
+
+        state["cti_feeds"], state["index"] = run(
+            "ingestion", ingestion, lambda result: result[1].edges_count
+        )
+        rows = state["index"].edges_count
+
+        state["feeds_stats"] = run("statistics", recalculate_statistics, lambda _: rows)
+        run("scoring", scoring, lambda _: rows)
+
+        rng = np.random.default_rng(seed)
+        values = state["index"].values
+        state["queried"] = (
+            values[rng.integers(0, len(values), queries)].tolist()
+            if len(values)
+            else []
+        )
+        run("queries", point_queries, lambda result: len(result))
+
+        for result in results:
+            result.update(feeds=len(state["cti_feeds"]), rows=rows)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return results
+
+
+def run_benchmarks(
+    datasets: Optional[List[str]] = None,
+    stages: Optional[List[str]] = None,
+    repeat: int = 3,
+    queries: int = QUERIES_COUNT,
+) -> Dict[str, Any]:
+    """
+    Benchmark the datasets, `DATASETS` by default, datasets without
+    feeds are skipped
+
+        Returns:
+
+            Results document: format version, creation time,
+            environment and the results of every dataset and stage
+    """
+    results: List[Dict[str, Any]] = []
+    for path in datasets or DATASETS:
+        if not glob(f"{path}/*.csv"):
+            print(f"[BENCHMARK] Skipped {path}: no feeds")
+            continue
+        for result in benchmark_dataset(path, stages, repeat, queries):
+            print(
+                "[BENCHMARK] {dataset} {stage}: {wall_time:.3f} s, "
+                "{iocs_per_sec:.0f} IoCs/s, {memory:.1f} MiB".format(
+                    memory=result["peak_memory"] / 2 ** 20, **result
+                )
+            )
+            results.append(result)
+
+    return {
+        "format_version": RESULTS_FORMAT_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def compare(
+    results: Dict[str, Any],
+    baseline: Dict[str, Any],
+    time_threshold: float = TIME_THRESHOLD,
+    memory_threshold: float = MEMORY_THRESHOLD,
+    min_time: float = MIN_TIME,
+) -> List[Dict[str, Any]]:
+    """
+    Function compares the results with the baseline stage by stage
+    (dataset and stage present in both), wall time of the stages
+    faster than `min_time` in both runs is not compared
+
+        Returns:
+
+            Regressions: dataset, stage, metric, baseline and current
+            values and their ratio
+    """
+    baseline_stages = {
+        (result["dataset"], result["stage"]): result for result in baseline["results"]
+    }
+    regressions: List[Dict[str, Any]] = []
+
+    for result in results["results"]:
+        previous = baseline_stages.get((result["dataset"], result["stage"]))
+        if previous is None:
+            continue
+
+        checks = [("peak_memory", memory_threshold)]
+        if max(result["wall_time"], previous["wall_time"]) >= min_time:
+            checks.insert(0, ("wall_time", time_threshold))
+
+        for metric, threshold in checks:
+            if previous[metric] <= 0:
+                continue
+            ratio = result[metric] / previous[metric]
+            if ratio > 1 + threshold:
+                regressions.append(
+                    {
+                        "dataset": result["dataset"],
+                        "stage": result["stage"],
+                        "metric": metric,
+                        "baseline": previous[metric],
+                        "current": result[metric],
+                        "ratio": ratio,
+                    }
+                )
+
+    return regressions
+
+
+def write_results(path: str, results: Dict[str, Any]) -> None:
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path) as file:
+        results = json.load(file)
+
+    if results.get("format_version") != RESULTS_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported benchmark results format: {results.get('format_version')}"
+        )
+    return results
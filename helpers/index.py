@@ -0,0 +1,294 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from helpers import keys
+
+
+def factorize_iocs(values) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encode IoC values as dense integer codes in order of first
+    appearance. Unlike `pd.factorize`, missing values are kept
+    as a key of their own, like the dict based lookups do
+    """
+    codes, uniques = pd.factorize(values)
+    uniques = np.asarray(uniques, dtype=object)
+    missing = codes < 0
+
+    if missing.any():
+        codes = codes.copy()
+        codes[missing] = len(uniques)
+        uniques = np.append(uniques, np.nan)
+
+        first_pos = np.full(len(uniques), len(codes))
+        np.minimum.at(first_pos, codes, np.arange(len(codes)))
+        rank = np.argsort(first_pos, kind="stable")
+        remap = np.empty_like(rank)
+        remap[rank] = np.arange(len(rank))
+        codes, uniques = remap[codes], uniques[rank]
+
+    return codes, uniques
+
+
+class IocIndex:
+    """
+    IoC-to-feed incidence index.
+
+    Feed names and IoC values are interned to dense integer ids
+    (feed id — position of the feed in the loaded feed list,
+    IoC id — order of the first appearance of the value).
+    Every mention of an IoC in a feed is an edge, edges are stored
+    in compressed sparse row layout: edges of the IoC `i` are
+    `indptr[i]:indptr[i + 1]`, ordered the same way as the feeds rows.
+
+        Attributes:
+
+            feed_names (numpy.ndarray) — feed name by feed id
+            values (numpy.ndarray) — IoC value by IoC id
+            indptr (numpy.ndarray) — CSR offsets, len(values) + 1
+            feed_ids, first_seen, last_seen (numpy.ndarray) — per edge
+            row_ioc_ids (numpy.ndarray) — IoC id of every feed row
+            (feeds concatenated in the load order)
+            row_edges (numpy.ndarray) — edge position of every feed row
+            keys (numpy.ndarray) — 64-bit key of every IoC if the index
+            is built with hashed keys (see `helpers.keys`), IoCs are
+            then grouped and looked up by the keys instead of the values
+    """
+
+    def __init__(
+        self,
+        feed_names: np.ndarray,
+        values: np.ndarray,
+        indptr: np.ndarray,
+        feed_ids: np.ndarray,
+        first_seen: np.ndarray,
+        last_seen: np.ndarray,
+        row_ioc_ids: Optional[np.ndarray] = None,
+        row_edges: Optional[np.ndarray] = None,
+        keys: Optional[np.ndarray] = None,
+        sorted_keys: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ):
+        self.feed_names = feed_names
+        self.values = values
+        self.indptr = indptr
+        self.feed_ids = feed_ids
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.row_ioc_ids = row_ioc_ids
+        self.row_edges = row_edges
+        self.keys = keys
+        self.sorted_keys = sorted_keys
+
+        self._values_index: Optional[pd.Index] = None
+        self._keys_index: Optional[pd.Index] = None
+        self._feeds_index: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def from_feeds(
+        cls, cti_feeds: List[Dict[str, Any]], hashed_keys: bool = False
+    ) -> "IocIndex":
+        """
+        Build the index over the loaded CTI feeds, IoC values are
+        grouped by their 64-bit keys if `hashed_keys` is set. On a key
+        collision the index falls back to grouping by the values
+        """
+        feed_sizes = [len(feed["df"].index) for feed in cti_feeds]
+
+        if hasattr(cti_feeds, "whole") and cti_feeds:
+            # `io.FeedSet` already keeps the concatenated feeds
+            whole_df = cti_feeds.whole
+        elif cti_feeds:
+            whole_df = pd.concat(
+                [
+                    feed["df"][["value", "first_seen", "last_seen"]]
+                    for feed in cti_feeds
+                ],
+                ignore_index=True,
+            )
+        else:
+            whole_df = pd.DataFrame(
+                {
+                    "value": np.array([], dtype=object),
+                    "first_seen": np.array([], dtype=np.int64),
+                    "last_seen": np.array([], dtype=np.int64),
+                }
+            )
+
+        ioc_keys = None
+        if hashed_keys:
+            try:
+                row_ioc_ids, values, ioc_keys = keys.factorize_keys(
+                    whole_df["value"].to_numpy(dtype=object)
+                )
+            except keys.KeyCollisionError as error:
+                print(f"[INDEX] {error}, IoCs are grouped by values")
+                hashed_keys = False
+        if not hashed_keys:
+            row_ioc_ids, values = factorize_iocs(whole_df["value"])
+
+        return cls.from_rows(
+            np.array([feed["name"] for feed in cti_feeds], dtype=object),
+            values,
+            row_ioc_ids,
+            np.repeat(np.arange(len(cti_feeds), dtype=np.int32), feed_sizes),
+            whole_df["first_seen"].to_numpy(dtype=np.int64),
+            whole_df["last_seen"].to_numpy(dtype=np.int64),
+            ioc_keys,
+        )
+
+    @classmethod
+    def from_rows(
+        cls,
+        feed_names: np.ndarray,
+        values: np.ndarray,
+        row_ioc_ids: np.ndarray,
+        row_feed_ids: np.ndarray,
+        first_seen: np.ndarray,
+        last_seen: np.ndarray,
+        ioc_keys: Optional[np.ndarray] = None,
+    ) -> "IocIndex":
+        """
+        Build the index over the feeds rows (feeds concatenated in
+        the `feed_names` order) with the rows IoC ids already assigned,
+        IoC ids must be numbered by the first appearance
+        """
+        order = np.argsort(row_ioc_ids, kind="stable")
+        row_edges = np.empty_like(order)
+        row_edges[order] = np.arange(len(order))
+
+        indptr = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(row_ioc_ids, minlength=len(values)), out=indptr[1:])
+
+        return cls(
+            feed_names=feed_names,
+            values=values,
+            indptr=indptr,
+            feed_ids=row_feed_ids[order],
+            first_seen=first_seen[order],
+            last_seen=last_seen[order],
+            row_ioc_ids=row_ioc_ids,
+            row_edges=row_edges,
+            keys=ioc_keys,
+        )
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @property
+    def edges_count(self) -> int:
+        return len(self.feed_ids)
+
+    @property
+    def mentions(self) -> np.ndarray:
+        """Number of mentions (edges) of every IoC"""
+        return np.diff(self.indptr)
+
+    @property
+    def edge_ioc_ids(self) -> np.ndarray:
+        """IoC id of every edge"""
+        return np.repeat(np.arange(len(self.values)), self.mentions)
+
+    @property
+    def min_first_seen(self) -> np.ndarray:
+        """Min `first_seen` of every IoC across all feeds"""
+        if not len(self.values):
+            return np.array([], dtype=np.int64)
+        return np.minimum.reduceat(self.first_seen, self.indptr[:-1])
+
+    @property
+    def first_rows(self) -> np.ndarray:
+        """Position of the first occurrence of every IoC across feed rows"""
+        rows = np.empty_like(self.row_edges)
+        rows[self.row_edges] = np.arange(len(self.row_edges))
+        return rows[self.indptr[:-1]]
+
+    def feed_id(self, feed_name: str) -> int:
+        if self._feeds_index is None:
+            self._feeds_index = {
+                name: i for i, name in enumerate(self.feed_names.tolist())
+            }
+        return self._feeds_index[feed_name]
+
+    def ioc_id(self, ioc_value: str) -> Optional[int]:
+        """IoC id of the value or None if the index has no such IoC"""
+        if self.keys is not None:
+            try:
+                ioc_id = int(self.ioc_ids([ioc_value])[0])
+            except (TypeError, ValueError):
+                return None
+            return ioc_id if ioc_id >= 0 else None
+
+        if self._values_index is None:
+            self._values_index = pd.Index(self.values)
+        try:
+            return int(self._values_index.get_loc(ioc_value))
+        except (KeyError, TypeError):
+            return None
+
+    def ioc_ids(self, ioc_values) -> np.ndarray:
+        """IoC ids of the values, -1 for unknown values"""
+        if self.keys is not None:
+            return self._ioc_ids_by_keys(ioc_values)
+        if self._values_index is None:
+            self._values_index = pd.Index(self.values)
+        return self._values_index.get_indexer(pd.Index(ioc_values, dtype=object))
+
+    def _ioc_ids_by_keys(self, ioc_values) -> np.ndarray:
+        """
+        IoC ids looked up by the 64-bit keys, a found IoC whose value
+        differs from the queried one is a key collision, not a match
+        """
+        ioc_values = np.asarray(list(ioc_values), dtype=object)
+        query_keys = keys.ioc_keys(ioc_values)
+
+        if self.sorted_keys is not None:
+            ioc_ids = keys.lookup_sorted_keys(*self.sorted_keys, query_keys)
+        else:
+            if self._keys_index is None:
+                self._keys_index = pd.Index(self.keys)
+            ioc_ids = self._keys_index.get_indexer(query_keys)
+
+        found = np.flatnonzero(ioc_ids >= 0)
+        values, queried = self.values[ioc_ids[found]], ioc_values[found]
+        # Like the values hash index, the missing IoC is found by NaN only
+        same = (values == queried) | (pd.isna(values) & (queried != queried))
+        ioc_ids[found[~same]] = -1
+
+        return ioc_ids
+
+    def edges(self, ioc_id: int) -> slice:
+        """Slice of the edge arrays with the IoC mentions"""
+        return slice(self.indptr[ioc_id], self.indptr[ioc_id + 1])
+
+    def neighbours(self, ioc_id: int) -> np.ndarray:
+        """
+        Feed ids the IoC has been mentioned in, every feed once
+        in order of the IoC mentions
+        """
+        feed_ids = self.feed_ids[self.edges(ioc_id)]
+        _, first = np.unique(feed_ids, return_index=True)
+        return feed_ids[np.sort(first)]
+
+    def feed_names_of(self, ioc_value: str) -> List[str]:
+        """Feed names the IoC has been mentioned in, every feed once"""
+        ioc_id = self.ioc_id(ioc_value)
+        if ioc_id is None:
+            return []
+        return self.feed_names[self.neighbours(ioc_id)].tolist()
+
+    def mention_feed_names(self, ioc_value: str) -> List[str]:
+        """
+        Feed name of every IoC mention, a feed is repeated as
+        many times as the IoC is in it
+        """
+        ioc_id = self.ioc_id(ioc_value)
+        if ioc_id is None:
+            return []
+        return self.feed_names[self.feed_ids[self.edges(ioc_id)]].tolist()
+
+    def iter_edges(self) -> Iterator[Tuple[int, slice]]:
+        """Iterate over all IoCs as (IoC id, slice of its edges)"""
+        indptr = self.indptr.tolist()
+        for ioc_id in range(len(self.values)):
+            yield ioc_id, slice(indptr[ioc_id], indptr[ioc_id + 1])
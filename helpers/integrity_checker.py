@@ -1,4 +1,8 @@
 import os
+import hashlib
+from glob import glob
+from typing import Dict, List
+
 from dirhash import dirhash
 
 
@@ -24,3 +28,38 @@ def is_modified(cti_feeds_path: str):
     else:
         write_chksum(CHKSUM_FILE, CURR_CHECKSUM)
         return True
+
+
+def feeds_checksums(cti_feeds_path: str) -> Dict[str, str]:
+    """Return md5 checksum of every CTI feed in the directory"""
+    checksums: Dict[str, str] = {}
+
+    for filename in sorted(glob(os.path.join(cti_feeds_path, "*.csv"))):
+        md5 = hashlib.md5()
+        with open(filename, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                md5.update(block)
+        checksums[os.path.basename(filename)] = md5.hexdigest()
+
+    return checksums
+
+
+def get_feeds_changes(
+    previous: Dict[str, str], current: Dict[str, str]
+) -> Dict[str, List[str]]:
+    """
+    Compare two feeds checksums snapshots
+
+        Returns:
+
+            Feed names grouped by change: `added`, `modified` and `removed`
+    """
+    return {
+        "added": [name for name in current if name not in previous],
+        "modified": [
+            name
+            for name in current
+            if name in previous and previous[name] != current[name]
+        ],
+        "removed": [name for name in previous if name not in current],
+    }
@@ -1,31 +1,191 @@
 import os
 import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from glob import glob
-from typing import Any, List, Dict, Optional, Tuple
+from timeit import default_timer as timer
+from typing import Any, Iterator, List, Dict, Optional, Tuple, Union
 
+from helpers import profiler
+from helpers.parse_array import parse_array
 
-def load_single_feed(fullpath: str):
-    df = pd.read_csv(fullpath)
-    df["first_seen"] = (
-        pd.to_datetime(df["first_seen"]).values.astype(np.int64) // 10 ** 9
-    )
-    df["last_seen"] = pd.to_datetime(df["last_seen"]).values.astype(np.int64) // 10 ** 9
+STATISTICS_FILE: str = ".statistics.npz"
+STATISTICS_FORMAT_VERSION: int = 1
+
+
+# Feeds schema, declared up front so pandas doesn't have to infer it
+FEED_DTYPES: Dict[str, Any] = {
+    "id": object,
+    "value": object,
+    "first_seen": object,
+    "last_seen": object,
+    "relationship_count": np.int64,
+    "detections_count": np.int64,
+}
+FEED_DATE_FORMAT: str = "%Y-%m-%d"
+
+
+def to_unixtime(dates: pd.Series, date_format: Optional[str] = None) -> np.ndarray:
+    """
+    Convert dates column to unixtime, with the explicit
+    format if given, falling back to format inference
+    """
+    if date_format:
+        try:
+            return (
+                pd.to_datetime(dates, format=date_format).values.astype(np.int64)
+                // 10 ** 9
+            )
+        except ValueError:
+            pass
+
+    return pd.to_datetime(dates).values.astype(np.int64) // 10 ** 9
+
+
+def load_single_feed(fullpath: str, typed: bool = False):
+    """
+    Read the CTI feed. In typed mode column dtypes and the date format
+    are taken from `FEED_DTYPES` / `FEED_DATE_FORMAT` and the unnamed
+    index column is dropped; files which don't match the schema are
+    read the untyped way
+    """
+    df = None
+    date_format = None
+
+    if typed:
+        try:
+            df = pd.read_csv(fullpath, usecols=list(FEED_DTYPES), dtype=FEED_DTYPES)
+            date_format = FEED_DATE_FORMAT
+        except ValueError:
+            df = None
+
+    if df is None:
+        df = pd.read_csv(fullpath)
+
+    df["first_seen"] = to_unixtime(df["first_seen"], date_format)
+    df["last_seen"] = to_unixtime(df["last_seen"], date_format)
 
     return df
 
 
-def load_feeds(path: str) -> List[Dict[str, Any]]:
+def iter_feed_chunks(
+    fullpath: str, chunksize: int, typed: bool = True
+) -> Iterator[pd.DataFrame]:
+    """
+    Read the CTI feed by chunks of at most `chunksize` rows,
+    each chunk is converted like `load_single_feed` does
+    """
+    reader = None
+    date_format = None
+
+    if typed:
+        try:
+            reader = pd.read_csv(
+                fullpath,
+                usecols=list(FEED_DTYPES),
+                dtype=FEED_DTYPES,
+                chunksize=chunksize,
+            )
+            date_format = FEED_DATE_FORMAT
+        except ValueError:
+            reader = None
+
+    if reader is None:
+        reader = pd.read_csv(fullpath, chunksize=chunksize)
+
+    with reader:
+        for df in reader:
+            df["first_seen"] = to_unixtime(df["first_seen"], date_format)
+            df["last_seen"] = to_unixtime(df["last_seen"], date_format)
+            yield df
+
+
+def _load_feed_timed(fullpath: str, typed: bool) -> Tuple[pd.DataFrame, float]:
+    start = timer()
+    df = load_single_feed(fullpath, typed)
+    return df, timer() - start
+
+
+class FeedSet(list):
+    """
+    Loaded CTI feeds: a list of {"name": ..., "df": ...} dicts,
+    each file parsed exactly once. The concatenated view of all
+    feeds is built lazily on first access and cached
+    """
+
+    def __init__(self, feeds=(), timings: Optional[Dict[str, float]] = None):
+        super().__init__(feeds)
+        self.timings: Dict[str, float] = timings or {}
+        self._whole: Optional[pd.DataFrame] = None
+
+    @property
+    def whole(self) -> pd.DataFrame:
+        """All feeds concatenated in the load order"""
+        if self._whole is None:
+            self._whole = pd.concat(feed["df"] for feed in self)
+        return self._whole
+
+    @property
+    def names(self) -> List[str]:
+        return [feed["name"] for feed in self]
+
+
+def feed_filenames(path: str) -> List[str]:
+    """Feed files of the directory in the order the feeds are loaded"""
+    return glob(f"{path}/*.csv")
+
+
+@profiler.profiled()
+def load_feeds(
+    path: str,
+    workers: Optional[int] = None,
+    typed: bool = True,
+    use_processes: bool = False,
+    names: Optional[List[str]] = None,
+) -> FeedSet:
     """
     Read all feeds from the specified
     directory, you cat get the result
     by using generator expression like
     [x for x in get_feeds()]
+
+        Parameters:
+
+            path (str) — path to the directory with the CTI feeds
+            workers (int) — read feeds concurrently with this many
+            workers, sequentially if not set
+            typed (bool) — use the declared feeds schema, see `load_single_feed`
+            use_processes (bool) — use a process pool instead of threads
+            names (list) — read only the feeds with these file names
+
+        Returns:
+
+            FeedSet with feeds in the directory listing order and
+            per-feed load time (seconds) in `FeedSet.timings`
     """
-    filenames = glob(f"{path}/*.csv")
-    return [
-        {"name": os.path.basename(df), "df": load_single_feed(df)} for df in filenames
-    ]
+    filenames = feed_filenames(path)
+    if names is not None:
+        names_set = set(names)
+        filenames = [
+            filename
+            for filename in filenames
+            if os.path.basename(filename) in names_set
+        ]
+
+    if workers and workers > 1 and len(filenames) > 1:
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with executor_class(max_workers=workers) as executor:
+            loaded = list(
+                executor.map(_load_feed_timed, filenames, [typed] * len(filenames))
+            )
+    else:
+        loaded = [_load_feed_timed(filename, typed) for filename in filenames]
+
+    names = [os.path.basename(filename) for filename in filenames]
+    return FeedSet(
+        ({"name": name, "df": df} for name, (df, _) in zip(names, loaded)),
+        timings={name: load_time for name, (_, load_time) in zip(names, loaded)},
+    )
 
 
 def load_feed_statistics(path: str, name=".feeds-statistics") -> pd.DataFrame:
@@ -44,19 +204,219 @@ def load_iocs_statistics(path: str, name=".iocs-statistics") -> pd.DataFrame:
     return pd.read_csv(IOCS_STATS_FILE, index_col="value")
 
 
-def load_whole_feeds(path: str):
-    return pd.concat(feed["df"] for feed in load_feeds(path))
+def load_whole_feeds(path: Union[str, FeedSet]) -> pd.DataFrame:
+    """
+    Concatenated view of all feeds, pass an already
+    loaded `FeedSet` to avoid reading the files again
+    """
+    feeds = path if isinstance(path, FeedSet) else load_feeds(path)
+    return feeds.whole
 
 
 def write_statistics(
     path: Optional[str], **df: Dict[str, Any]
 ) -> Optional[Tuple[str, str]]:
+    """
+    Write statistics into the binary store at the specified
+    directory. Without path returns them as CSV strings
+    (iocs, feeds), the legacy text format
+    """
+    membership = df.get("membership")
+    if df.get("index") is not None:
+        membership = (df["index"].indptr, df["index"].feed_ids)
+
     if path:
-        IOCS_STATS_FILE: str = os.path.join(path, ".iocs-statistics")
-        FEEDS_STATS_FILE: str = os.path.join(path, ".feeds-statistics")
-        pd.DataFrame(df["iocs"]).to_csv(IOCS_STATS_FILE)
-        pd.DataFrame(df["feeds"]).to_csv(FEEDS_STATS_FILE)
+        write_statistics_arrays(
+            path,
+            statistics_to_arrays(
+                pd.DataFrame(df["iocs"]), pd.DataFrame(df["feeds"]), membership
+            ),
+        )
 
         return None
 
-    return pd.DataFrame(df["iocs"]).to_csv(), pd.DataFrame(df["feeds"]).to_csv()
+    iocs_stats = pd.DataFrame(df["iocs"])
+    feeds_stats = pd.DataFrame(df["feeds"])
+    if "feeds_ioc_mentioned_in" not in iocs_stats.columns:
+        # Only the legacy text format keeps the feed names lists
+        iocs_stats = iocs_stats.assign(
+            feeds_ioc_mentioned_in=membership_lists(
+                feeds_stats["feed_name"].to_numpy(), *membership
+            )
+        )
+
+    return iocs_stats.to_csv(), feeds_stats.to_csv()
+
+
+def membership_lists(
+    feed_names: np.ndarray, offsets: np.ndarray, feeds_ids: np.ndarray
+) -> List[List[str]]:
+    """
+    Feed names the IoC has been mentioned in, for every IoC,
+    from the membership arrays (offsets, feed positions)
+    """
+    names = np.asarray(feed_names, dtype=object)[feeds_ids].tolist()
+    offsets = np.asarray(offsets).tolist()
+    return [names[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def encode_strings(values) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pack strings into one NUL-separated utf-8 buffer,
+    missing values are marked in a separate mask
+    """
+    values = pd.Series(values, dtype=object)
+    missing = values.isna().to_numpy()
+    joined = "\x00".join(values.fillna("").astype(str).tolist())
+    return np.frombuffer(joined.encode("utf-8"), dtype=np.uint8), missing
+
+
+def decode_strings(buffer: np.ndarray, missing: np.ndarray) -> np.ndarray:
+    """Unpack strings packed by `encode_strings`"""
+    if not len(missing):
+        return np.array([], dtype=object)
+
+    values = np.array(buffer.tobytes().decode("utf-8").split("\x00"), dtype=object)
+    values[missing] = np.nan
+    return values
+
+
+def statistics_to_arrays(
+    iocs_stats: pd.DataFrame,
+    feeds_stats: pd.DataFrame,
+    membership: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Convert statistics dataframes to typed arrays of the binary store.
+    Feeds the IoC was mentioned in are stored as positions in
+    `feeds.feed_name` (`iocs.feeds_ids`) sliced by `iocs.feeds_offsets`,
+    taken as is from `membership` (offsets, feed positions) when given
+    """
+    arrays: Dict[str, np.ndarray] = {
+        "format_version": np.array(STATISTICS_FORMAT_VERSION)
+    }
+
+    feeds_stats = feeds_stats.reset_index()
+    for column in feeds_stats.columns:
+        if column == "index":
+            continue
+        if column == "feed_name":
+            arrays["feeds.feed_name"] = feeds_stats[column].to_numpy(dtype=str)
+        else:
+            arrays[f"feeds.{column}"] = feeds_stats[column].to_numpy()
+
+    if membership is not None:
+        arrays["iocs.feeds_offsets"] = np.asarray(membership[0], dtype=np.int64)
+        arrays["iocs.feeds_ids"] = np.asarray(membership[1], dtype=np.int32)
+    else:
+        feed_positions = {name: i for i, name in enumerate(arrays["feeds.feed_name"])}
+        membership = iocs_stats["feeds_ioc_mentioned_in"].tolist()
+        if membership and isinstance(membership[0], str):
+            membership = [parse_array(names) for names in membership]
+
+        feeds_ids = [feed_positions[name] for names in membership for name in names]
+        arrays["iocs.feeds_offsets"] = np.concatenate(
+            ([0], np.cumsum([len(names) for names in membership], dtype=np.int64))
+        ).astype(np.int64)
+        arrays["iocs.feeds_ids"] = np.array(feeds_ids, dtype=np.int32)
+
+    arrays["iocs.value"], arrays["iocs.value_missing"] = encode_strings(
+        iocs_stats["value"]
+    )
+    arrays["iocs.id"], arrays["iocs.id_missing"] = encode_strings(iocs_stats["id"])
+    arrays["iocs.row"] = iocs_stats.index.to_numpy(dtype=np.int64)
+    arrays["iocs.min_first_seen"] = iocs_stats["min_first_seen"].to_numpy(
+        dtype=np.int64
+    )
+    arrays["iocs.mentioned_in_count"] = iocs_stats["mentioned_in_count"].to_numpy(
+        dtype=np.int64
+    )
+
+    return arrays
+
+
+def write_statistics_arrays(path: str, arrays: Dict[str, np.ndarray]) -> None:
+    STATS_FILE: str = os.path.join(path, STATISTICS_FILE)
+    tmp_file: str = STATS_FILE + ".tmp"
+
+    with open(tmp_file, "wb") as file:
+        np.savez(file, **arrays)
+    os.replace(tmp_file, STATS_FILE)
+
+
+def has_statistics_arrays(path: str) -> bool:
+    """Whether the binary store of the current format is next to the feeds"""
+    STATS_FILE: str = os.path.join(path, STATISTICS_FILE)
+
+    if not os.path.isfile(STATS_FILE):
+        return False
+    with np.load(STATS_FILE, allow_pickle=False) as stored:
+        return int(stored["format_version"]) == STATISTICS_FORMAT_VERSION
+
+
+def load_statistics_arrays(path: str) -> Dict[str, np.ndarray]:
+    """
+    Read typed statistics arrays from the binary store. If there is
+    only the legacy `.iocs-statistics` / `.feeds-statistics` pair,
+    read it once and convert it to the binary store
+    """
+    STATS_FILE: str = os.path.join(path, STATISTICS_FILE)
+
+    if os.path.isfile(STATS_FILE):
+        with np.load(STATS_FILE, allow_pickle=False) as stored:
+            arrays = {key: stored[key] for key in stored.files}
+
+        if int(arrays["format_version"]) == STATISTICS_FORMAT_VERSION:
+            return arrays
+
+    print("[STATISTICS] Converting legacy statistics files to the binary store...")
+    iocs_stats = pd.read_csv(os.path.join(path, ".iocs-statistics"), index_col=0)
+    feeds_stats = pd.read_csv(os.path.join(path, ".feeds-statistics"), index_col=0)
+
+    arrays = statistics_to_arrays(iocs_stats, feeds_stats)
+    write_statistics_arrays(path, arrays)
+
+    return arrays
+
+
+def feeds_statistics_frame(arrays: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """Feeds statistics dataframe indexed by `feed_name`"""
+    return pd.DataFrame(
+        {
+            key[len("feeds.") :]: value
+            for key, value in arrays.items()
+            if key.startswith("feeds.")
+        }
+    ).set_index("feed_name")
+
+
+def iocs_statistics_frame(arrays: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """
+    IoCs statistics dataframe indexed by IoC `value`, feeds the
+    IoC was mentioned in stay in `iocs.feeds_offsets` / `iocs.feeds_ids`
+    """
+    return pd.DataFrame(
+        {
+            "id": decode_strings(arrays["iocs.id"], arrays["iocs.id_missing"]),
+            "min_first_seen": arrays["iocs.min_first_seen"],
+            "mentioned_in_count": arrays["iocs.mentioned_in_count"],
+        },
+        index=pd.Index(
+            decode_strings(arrays["iocs.value"], arrays["iocs.value_missing"]),
+            name="value",
+        ),
+    )
+
+
+def load_statistics(path: str) -> Dict[str, Any]:
+    """
+    Read statistics from the binary store as dataframes shaped
+    like `load_iocs_statistics` / `load_feed_statistics` results
+    and the membership arrays (offsets, feed positions)
+    """
+    arrays = load_statistics_arrays(path)
+    return {
+        "iocs": iocs_statistics_frame(arrays),
+        "feeds": feeds_statistics_frame(arrays),
+        "membership": (arrays["iocs.feeds_offsets"], arrays["iocs.feeds_ids"]),
+    }
@@ -0,0 +1,93 @@
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Key of the missing IoC values, all of them are one IoC like
+# `index.factorize_iocs` has it
+MISSING_KEY: np.uint64 = np.uint64(0)
+
+
+class KeyCollisionError(ValueError):
+    """Distinct IoC values have got the same 64-bit key"""
+
+    def __init__(self, values: List):
+        super().__init__(f"64-bit IoC key collision between values: {values[:10]!r}")
+        self.values = values
+
+
+def ioc_keys(values) -> np.ndarray:
+    """
+    Stable 64-bit fingerprints of the IoC values: SipHash-2-4 of
+    the UTF-8 value with the fixed pandas key, so the keys are the
+    same across runs and processes and can be stored along with the
+    data. Missing values get `MISSING_KEY`
+    """
+    values = np.asarray(values, dtype=object)
+    if not len(values):
+        return np.array([], dtype=np.uint64)
+
+    keys = pd.util.hash_array(values, categorize=False)
+    keys[pd.isna(values)] = MISSING_KEY
+    return keys
+
+
+def find_collisions(
+    values: np.ndarray, codes: np.ndarray, unique_values: np.ndarray
+) -> List:
+    """
+    Values which differ from the value their key has been assigned to
+    (the first value with the key), missing values are equal to each other
+    """
+    expected = unique_values[codes]
+    same = values == expected
+    same |= pd.isna(values) & pd.isna(expected)
+    return pd.unique(values[~same]).tolist() if not same.all() else []
+
+
+def factorize_keys(values) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Encode IoC values as dense integer codes in order of first
+    appearance, grouping by the 64-bit keys instead of the strings
+
+        Returns:
+
+            Codes of the values, unique values and their keys
+
+        Raises:
+
+            KeyCollisionError if distinct values have the same key
+    """
+    values = np.asarray(values, dtype=object)
+    keys = ioc_keys(values)
+    codes, unique_keys = pd.factorize(keys)
+
+    # Codes are numbered by the first appearance, so the first value of
+    # a key is where the code exceeds all the codes before it
+    is_first = np.ones(len(codes), dtype=bool)
+    is_first[1:] = codes[1:] > np.maximum.accumulate(codes)[:-1]
+    unique_values = values[is_first]
+    unique_values[unique_keys == MISSING_KEY] = np.nan
+
+    collisions = find_collisions(values, codes, unique_values)
+    if collisions:
+        raise KeyCollisionError(collisions)
+
+    return codes, unique_values, np.asarray(unique_keys, dtype=np.uint64)
+
+
+def lookup_sorted_keys(
+    sorted_keys: np.ndarray, key_order: np.ndarray, query_keys: np.ndarray
+) -> np.ndarray:
+    """
+    Positions of the queried keys by binary search over the sorted
+    unique keys (`key_order` — positions of the keys in sorted order),
+    -1 for unknown keys. Needs no hash table, so it works as is over
+    arrays mapped from a file
+    """
+    if not len(sorted_keys):
+        return np.full(len(query_keys), -1, dtype=np.int64)
+
+    positions = np.minimum(np.searchsorted(sorted_keys, query_keys), len(sorted_keys) - 1)
+    found = sorted_keys[positions] == query_keys
+    return np.where(found, key_order[positions], -1)
@@ -1,10 +1,14 @@
 from typing import List, Optional
 import pandas as pd
+from helpers.index import IocIndex, factorize_iocs
 from helpers.parse_array import parse_array
 
 
 def feeds_ioc_mentioned_in(ioc_value: str, df) -> List[str]:
     """Return feed names where specified IOC was mentioned in"""
+    if isinstance(df, IocIndex):
+        return df.feed_names_of(ioc_value)
+
     feeds: List[str] = []
     for feed in df:
         is_ioc_exist = feed["df"].loc[feed["df"]["value"] == ioc_value]
@@ -15,6 +19,13 @@ def feeds_ioc_mentioned_in(ioc_value: str, df) -> List[str]:
 
 def number_of_feeds_ioc_mentioned_in(ioc_value: str, dataframe) -> int:
     """Return number of feed specified ioc mentioned in"""
+    if isinstance(dataframe, IocIndex):
+        ioc_id = dataframe.ioc_id(ioc_value)
+        if ioc_id is None:
+            return 0
+        edges = dataframe.edges(ioc_id)
+        return int(edges.stop - edges.start)
+
     df = pd.concat(feed["df"] for feed in dataframe)
     mentioned_in = df.loc[df["value"] == ioc_value]
     return len(mentioned_in.index)
@@ -22,18 +33,30 @@ def number_of_feeds_ioc_mentioned_in(ioc_value: str, dataframe) -> int:
 
 def overall_ioc_count(dataframe) -> int:
     """Return total number of iocs across all feeds (non-distinct)"""
+    if isinstance(dataframe, IocIndex):
+        return dataframe.edges_count
+
     return sum(feed["df"].shape[0] for feed in dataframe)
 
 
 def find_feeds_ioc_mentioned_in(ioc_value: str, df) -> int:
+    if isinstance(df, IocIndex):
+        return number_of_feeds_ioc_mentioned_in(ioc_value, df)
+
     result = df.at[ioc_value, "mentioned_in_count"]
     return result
 
 
 def find_feeds_name_ioc_mentioned_in(ioc_value: str, df) -> Optional[List[str]]:
-    result: str = df.at[ioc_value, "feeds_ioc_mentioned_in"]
-    names = parse_array(result)
-    return names
+    if isinstance(df, IocIndex):
+        # Like the statistics lists: one feed name per IoC mention
+        return df.mention_feed_names(ioc_value)
+
+    result = df.at[ioc_value, "feeds_ioc_mentioned_in"]
+    if isinstance(result, str):
+        # Legacy CSV statistics store the list as string
+        return parse_array(result)
+    return result
 
 
 def get_feed_source_confidence(feed_name: str, df):
@@ -41,8 +64,16 @@ def get_feed_source_confidence(feed_name: str, df):
     return source_confidence
 
 
-def find_min_date(ioc_value: str, df) -> str:
-    """Return min `first_seen` for the specified IoC"""
+def find_min_date(ioc_value: str, df) -> Optional[str]:
+    """Return min `first_seen` for the specified IoC, None for unknown IoC"""
+    if isinstance(df, IocIndex):
+        ioc_id = df.ioc_id(ioc_value)
+        if ioc_id is None:
+            return None
+        return str(df.first_seen[df.edges(ioc_id)].min())
+
     df = pd.concat(feed["df"] for feed in df)
     selected = df.loc[df["value"] == ioc_value]
+    if selected.empty:
+        return None
     return str(selected["first_seen"].min())
@@ -0,0 +1,86 @@
+import csv
+import gzip
+import json
+from typing import Any, Dict, Iterable, List, Optional, TextIO
+
+# Row formats written record by record
+OUTPUT_FORMATS: List[str] = ["ndjson", "csv"]
+
+CSV_COLUMNS: List[str] = [
+    "feed_name",
+    "value",
+    "score",
+    "first_seen",
+    "last_seen",
+    "ioc_mentions",
+    "source_confidences",
+    "feeds_scores",
+]
+
+# Columns of the deduplicated output, one row per IoC
+UNIQUE_CSV_COLUMNS: List[str] = [
+    "value",
+    "score",
+    "first_seen",
+    "last_seen",
+    "ioc_mentions",
+    "feeds",
+    "source_confidences",
+    "feeds_scores",
+]
+
+
+def open_output(path: str, compress: bool = False) -> TextIO:
+    """Open the output file for writing, gzip-compressed if asked or `.gz`"""
+    if compress or path.endswith(".gz"):
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def write_rows(
+    rows: Iterable[Dict[str, Any]],
+    file: TextIO,
+    output_format: str = "ndjson",
+    columns: Optional[List[str]] = None,
+) -> int:
+    """
+    Write scored rows one by one as they come: one JSON object per line
+    (`ndjson`) or CSV with list columns JSON-encoded (`csv`)
+
+        Parameters:
+
+            rows — scored rows with `feed_name`, e.g.
+            `engine.iter_iocs_score_rows` result
+            file — text file to write to
+            output_format (str) — one of `OUTPUT_FORMATS`
+            columns — CSV columns, `CSV_COLUMNS` by default
+
+        Returns:
+
+            Number of rows written
+    """
+    count = 0
+    columns = columns or CSV_COLUMNS
+
+    if output_format == "ndjson":
+        for row in rows:
+            file.write(json.dumps(row))
+            file.write("\n")
+            count += 1
+    elif output_format == "csv":
+        writer = csv.writer(file, lineterminator="\n")
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(
+                [
+                    json.dumps(row[column])
+                    if isinstance(row[column], list)
+                    else row[column]
+                    for column in columns
+                ]
+            )
+            count += 1
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
+
+    return count
@@ -0,0 +1,24 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterable, List, Optional
+
+from helpers import profiler
+
+
+def map_feeds(
+    function: Callable[[Any], Any], tasks: Iterable[Any], processes: Optional[int]
+) -> List[Any]:
+    """
+    Results of the function over the tasks (one feed per task) in the
+    tasks order, in a pool of `processes` worker processes, in the
+    current process if it is not set or one. Results come in the same order either way, so merging
+    them gives the same output as the serial run. Spans the function
+    times in the workers are merged into the profiler of this process
+    """
+    tasks = list(tasks)
+    if not processes or processes <= 1 or len(tasks) <= 1:
+        return [function(task) for task in tasks]
+
+    with ProcessPoolExecutor(max_workers=min(processes, len(tasks))) as executor:
+        return profiler.merge_collected(
+            list(executor.map(profiler.collecting(function), tasks))
+        )
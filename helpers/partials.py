@@ -0,0 +1,440 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import functions
+import scoring_engine as engine
+from helpers import io, parallel, profiler, whitelist
+from helpers.index import factorize_iocs
+from helpers.integrity_checker import feeds_checksums, get_feeds_changes
+
+PARTIALS_FILE: str = ".statistics-partials.npz"
+PARTIALS_FORMAT_VERSION: int = 2
+
+# Per-feed aggregates: every (IoC, feed) pair is an edge, which keeps
+# everything the feed contributes to the global statistics
+EDGE_COLUMNS: Tuple[str, ...] = (
+    "ioc",  # IoC position in `iocs.value`
+    "feed",  # feed position in `feeds.*`
+    "count",  # number of the IoC rows in the feed
+    "min_first_seen",  # min `first_seen` of the IoC in the feed
+    "inv_first_seen",  # sum of 1 / `first_seen` over the IoC rows
+    "first_row",  # row of the first occurrence of the IoC in the feed
+    "first_id",  # `id` of the first occurrence of the IoC in the feed
+)
+FEED_COLUMNS: Tuple[str, ...] = (
+    "feed_name",
+    "checksum",
+    "feed_size",
+    "sum_extensiveness",
+    "wl_overlap",
+)
+
+
+def empty_partials() -> Dict[str, np.ndarray]:
+    return {
+        "iocs.value": np.array([], dtype=object),
+        "feeds.feed_name": np.array([], dtype=object),
+        "feeds.checksum": np.array([], dtype=object),
+        "feeds.feed_size": np.array([], dtype=np.int64),
+        "feeds.sum_extensiveness": np.array([], dtype=np.float64),
+        "feeds.wl_overlap": np.array([], dtype=np.float64),
+        "edges.ioc": np.array([], dtype=np.int64),
+        "edges.feed": np.array([], dtype=np.int64),
+        "edges.count": np.array([], dtype=np.int64),
+        "edges.min_first_seen": np.array([], dtype=np.int64),
+        "edges.inv_first_seen": np.array([], dtype=np.float64),
+        "edges.first_row": np.array([], dtype=np.int64),
+        "edges.first_id": np.array([], dtype=object),
+        # Whitelist the feeds overlaps are calculated with
+        "whitelist.fingerprint": np.array([""], dtype=object),
+    }
+
+
+def feed_partials(cti_feed: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Function calculates aggregates of the single feed,
+    edges refer to the feed's own unique IoC values
+    """
+    EXTENSIVENESS_PARAM_COUNT: int = 3  # Extensiveness parameters count
+    codes, values = factorize_iocs(cti_feed["value"])
+    first_seen = cti_feed["first_seen"].to_numpy(dtype=np.int64)
+
+    order = np.argsort(codes, kind="stable")
+    count = np.bincount(codes, minlength=len(values))
+    starts = np.cumsum(count) - count
+    first_row = order[starts]
+
+    iocs_extensiveness = functions.ioc_extensiveness_array(
+        EXTENSIVENESS_PARAM_COUNT,
+        cti_feed["last_seen"].to_numpy() != 0,
+        cti_feed["relationship_count"].to_numpy() > 0,
+        cti_feed["detections_count"].to_numpy() > 0,
+    )
+
+    return {
+        "values": values,
+        "count": count.astype(np.int64),
+        "min_first_seen": (
+            np.minimum.reduceat(first_seen[order], starts)
+            if len(values)
+            else np.array([], dtype=np.int64)
+        ),
+        "inv_first_seen": np.bincount(
+            codes, weights=1 / first_seen.astype(np.float64), minlength=len(values)
+        ),
+        "first_row": first_row.astype(np.int64),
+        "first_id": cti_feed["id"].to_numpy(dtype=object)[first_row],
+        "feed_size": len(cti_feed.index),
+        "sum_extensiveness": float(iocs_extensiveness.sum()),
+        "wl_overlap": engine.get_whitelist_overlap_coef(cti_feed),
+    }
+
+
+def remove_feeds(
+    partials: Dict[str, np.ndarray], feed_names: List[str]
+) -> Dict[str, np.ndarray]:
+    """Drop contribution of the feeds, IoCs left without edges are dropped too"""
+    if not len(feed_names):
+        return partials
+
+    removed = np.isin(partials["feeds.feed_name"], feed_names)
+    feeds_remap = np.cumsum(~removed) - 1
+    kept_edges = ~removed[partials["edges.feed"]]
+
+    result = {
+        key: value[~removed] if key.startswith("feeds.") else value
+        for key, value in partials.items()
+    }
+    for column in EDGE_COLUMNS:
+        result[f"edges.{column}"] = partials[f"edges.{column}"][kept_edges]
+    result["edges.feed"] = feeds_remap[result["edges.feed"]]
+
+    alive = np.bincount(result["edges.ioc"], minlength=len(result["iocs.value"])) > 0
+    iocs_remap = np.cumsum(alive) - 1
+    result["iocs.value"] = result["iocs.value"][alive]
+    result["edges.ioc"] = iocs_remap[result["edges.ioc"]]
+
+    return result
+
+
+def add_feed(
+    partials: Dict[str, np.ndarray],
+    feed_name: str,
+    cti_feed: pd.DataFrame,
+    checksum: str = "",
+    feed: Optional[Dict[str, Any]] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Merge contribution of the feed into the global aggregates,
+    `feed` is the already calculated `feed_partials` of the feed
+    """
+    if feed is None:
+        feed = feed_partials(cti_feed)
+    result = dict(partials)
+    feed_position = len(partials["feeds.feed_name"])
+
+    ioc_ids = pd.Index(partials["iocs.value"]).get_indexer(
+        pd.Index(feed["values"], dtype=object)
+    )
+    new_iocs = ioc_ids < 0
+    ioc_ids[new_iocs] = len(partials["iocs.value"]) + np.arange(new_iocs.sum())
+    result["iocs.value"] = np.concatenate(
+        (partials["iocs.value"], feed["values"][new_iocs])
+    )
+
+    feed_row = {
+        "feed_name": feed_name,
+        "checksum": checksum,
+        "feed_size": feed["feed_size"],
+        "sum_extensiveness": feed["sum_extensiveness"],
+        "wl_overlap": feed["wl_overlap"],
+    }
+    for column in FEED_COLUMNS:
+        key = f"feeds.{column}"
+        result[key] = np.concatenate(
+            (partials[key], np.array([feed_row[column]], dtype=partials[key].dtype))
+        )
+
+    feed_edges = {
+        "ioc": ioc_ids,
+        "feed": np.full(len(ioc_ids), feed_position),
+        "count": feed["count"],
+        "min_first_seen": feed["min_first_seen"],
+        "inv_first_seen": feed["inv_first_seen"],
+        "first_row": feed["first_row"],
+        "first_id": feed["first_id"],
+    }
+    for column in EDGE_COLUMNS:
+        key = f"edges.{column}"
+        result[key] = np.concatenate(
+            (partials[key], np.asarray(feed_edges[column], dtype=partials[key].dtype))
+        )
+
+    return result
+
+
+def update_wl_overlaps(
+    partials: Dict[str, np.ndarray], feed_whitelist: whitelist.Whitelist
+) -> Dict[str, np.ndarray]:
+    """
+    Recalculate whitelist overlap of every feed after the whitelist has
+    changed. Edges keep the feed's IoC values with their rows count,
+    so the feeds are not read again
+    """
+    result = dict(partials)
+    whitelisted = feed_whitelist.contains(partials["iocs.value"])
+    wl_iocs = np.bincount(
+        partials["edges.feed"],
+        weights=partials["edges.count"] * whitelisted[partials["edges.ioc"]],
+        minlength=len(partials["feeds.feed_name"]),
+    )
+    result["feeds.wl_overlap"] = np.array(
+        [
+            functions.whitelist_overlap_score(int(count), int(size))
+            for count, size in zip(
+                np.rint(wl_iocs).tolist(), partials["feeds.feed_size"].tolist()
+            )
+        ],
+        dtype=np.float64,
+    )
+    result["whitelist.fingerprint"] = np.array(
+        [feed_whitelist.fingerprint], dtype=object
+    )
+    return result
+
+
+def feeds_statistics(
+    feed_names: np.ndarray,
+    feed_sizes: np.ndarray,
+    sums_extensiveness: np.ndarray,
+    sigmas: np.ndarray,
+    wl_overlaps: np.ndarray,
+) -> pd.DataFrame:
+    """
+    Function calculates feeds statistics from the per-feed sums:
+    size, sum of IoCs extensiveness, timeliness sigma and
+    whitelist overlap coefficient of every feed
+    """
+    overall_iocs = int(np.sum(feed_sizes))
+    feeds_stats: List[Dict[str, Any]] = []
+
+    for i, feed_name in enumerate(feed_names.tolist()):
+        feed_size = int(feed_sizes[i])
+        extensiveness = functions.extensiveness(float(sums_extensiveness[i]), feed_size)
+        completeness = engine.get_completeness_coef(feed_size, overall_iocs)
+        timeliness = functions.timeliness(float(sigmas[i]), feed_size)
+        wl_overlap_coef = float(wl_overlaps[i])
+
+        feeds_stats.append(
+            {
+                "feed_name": feed_name,
+                "feed_extensiveness": extensiveness,
+                "feed_completeness": completeness,
+                "feed_timeliness": timeliness,
+                "feed_wl_overlap": wl_overlap_coef,
+                "feed_source_confidence": engine.get_source_confidence(
+                    extensiveness, completeness, timeliness, wl_overlap_coef
+                ),
+                "feed_size": feed_size,
+            }
+        )
+
+    return pd.DataFrame(feeds_stats)
+
+
+def partials_to_statistics(partials: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """
+    Function derives IoCs and feeds statistics from the aggregates,
+    in the same shape as `stats.calculate_all_statistics` does.
+    IoCs are ordered by the first appearance across the feeds
+    """
+    edge_ioc, edge_feed = partials["edges.ioc"], partials["edges.feed"]
+    edge_count = partials["edges.count"]
+    iocs_count = len(partials["iocs.value"])
+    feed_names = partials["feeds.feed_name"]
+    feed_sizes = partials["feeds.feed_size"]
+
+    # Global row of the first occurrence: feeds are concatenated in
+    # their order in the aggregates, IoCs are renumbered by it
+    feed_offsets = np.concatenate(([0], np.cumsum(feed_sizes)[:-1])).astype(np.int64)
+    edge_rows = feed_offsets[edge_feed] + partials["edges.first_row"]
+
+    first_rows = np.full(iocs_count, np.iinfo(np.int64).max)
+    np.minimum.at(first_rows, edge_ioc, edge_rows)
+    iocs_order = np.argsort(first_rows, kind="stable")
+    rank = np.empty_like(iocs_order)
+    rank[iocs_order] = np.arange(iocs_count)
+    edge_ioc = rank[edge_ioc]
+
+    order = np.lexsort((edge_rows, edge_ioc))
+    edges_per_ioc = np.bincount(edge_ioc, minlength=iocs_count)
+    starts = np.cumsum(edges_per_ioc) - edges_per_ioc
+    first_edges = order[starts]
+
+    min_first_seen = np.full(iocs_count, np.iinfo(np.int64).max)
+    np.minimum.at(min_first_seen, edge_ioc, partials["edges.min_first_seen"])
+    mentioned_in_count = np.bincount(
+        edge_ioc, weights=edge_count, minlength=iocs_count
+    ).astype(np.int64)
+
+    # Membership: every feed repeated as many times as the IoC is in it
+    membership_feeds = np.repeat(edge_feed[order], edge_count[order])
+    membership_offsets = np.concatenate(([0], np.cumsum(mentioned_in_count)))
+    iocs_stats = pd.DataFrame(
+        {
+            "id": partials["edges.first_id"][first_edges],
+            "value": partials["iocs.value"][iocs_order],
+            "min_first_seen": min_first_seen,
+            "mentioned_in_count": mentioned_in_count,
+        },
+        index=first_rows[iocs_order],
+    )
+
+    # Edges keep sum of 1 / first_seen over the IoC rows in the feed
+    sigmas = functions.timeliness_sigmas(
+        edge_feed,
+        min_first_seen[edge_ioc],
+        partials["edges.inv_first_seen"],
+        len(feed_names),
+    )
+    feeds_stats = feeds_statistics(
+        feed_names,
+        feed_sizes,
+        partials["feeds.sum_extensiveness"],
+        sigmas,
+        partials["feeds.wl_overlap"],
+    )
+
+    return {
+        "iocs": iocs_stats,
+        "feeds": feeds_stats,
+        "membership": (membership_offsets, membership_feeds),
+    }
+
+
+def write_partials(path: str, partials: Dict[str, np.ndarray]) -> None:
+    arrays: Dict[str, np.ndarray] = {
+        "format_version": np.array(PARTIALS_FORMAT_VERSION)
+    }
+
+    for key, value in partials.items():
+        if value.dtype == object:
+            arrays[key], arrays[f"{key}_missing"] = io.encode_strings(value)
+        else:
+            arrays[key] = value
+
+    PARTIALS_PATH: str = os.path.join(path, PARTIALS_FILE)
+    with open(PARTIALS_PATH + ".tmp", "wb") as file:
+        np.savez(file, **arrays)
+    os.replace(PARTIALS_PATH + ".tmp", PARTIALS_PATH)
+
+
+def load_partials(path: str) -> Optional[Dict[str, np.ndarray]]:
+    PARTIALS_PATH: str = os.path.join(path, PARTIALS_FILE)
+
+    if not os.path.isfile(PARTIALS_PATH):
+        return None
+
+    with np.load(PARTIALS_PATH, allow_pickle=False) as stored:
+        if int(stored["format_version"]) != PARTIALS_FORMAT_VERSION:
+            return None
+        arrays = {key: stored[key] for key in stored.files}
+
+    partials = empty_partials()
+    for key, empty in partials.items():
+        if empty.dtype == object:
+            partials[key] = io.decode_strings(arrays[key], arrays[f"{key}_missing"])
+        else:
+            partials[key] = arrays[key]
+
+    return partials
+
+
+@profiler.profiled()
+def update_statistics(
+    cti_feeds_path: str,
+    cti_feeds: Optional[List[Dict[str, Any]]] = None,
+    force: bool = False,
+    checksums: Optional[Dict[str, str]] = None,
+    processes: Optional[int] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Function updates the per-feed aggregates stored next to the feeds:
+    only added, modified and removed feeds are processed, then the
+    global statistics are derived from the aggregates. Aggregates of
+    the changed feeds are calculated in a pool of `processes` and
+    merged in the feeds order, the same way as one by one.
+
+        Parameters:
+
+            cti_feeds_path (str) — path to the directory with the CTI feeds
+            cti_feeds — already loaded feeds, otherwise only the
+            changed feeds are read
+            force (bool) — rebuild aggregates of all feeds
+            checksums (dict) — already calculated feeds checksums
+            processes (int) — number of processes calculating aggregates
+
+        Returns:
+
+            Statistics (see `partials_to_statistics`) or None
+            if no feed has been changed
+    """
+    if checksums is None:
+        checksums = feeds_checksums(cti_feeds_path)
+    partials = None if force else load_partials(cti_feeds_path)
+    if partials is None:
+        partials = empty_partials()
+
+    previous = dict(
+        zip(partials["feeds.feed_name"].tolist(), partials["feeds.checksum"].tolist())
+    )
+    changes = get_feeds_changes(previous, checksums)
+    changed = changes["added"] + changes["modified"]
+
+    feed_whitelist = engine.get_whitelist()
+    whitelist_changed = (
+        partials["whitelist.fingerprint"][0] != feed_whitelist.fingerprint
+    )
+
+    if not changed and not changes["removed"] and not whitelist_changed and not force:
+        return None
+
+    if whitelist_changed:
+        print("[STATISTICS] Whitelist changed, feeds overlaps are recalculated")
+        partials = update_wl_overlaps(partials, feed_whitelist)
+
+    print(
+        "[STATISTICS] Feeds changed: {} added, {} modified, {} removed".format(
+            len(changes["added"]), len(changes["modified"]), len(changes["removed"])
+        )
+    )
+
+    loaded = {feed["name"]: feed["df"] for feed in cti_feeds or []}
+    # Keep the load order of the feeds, so that a full rebuild
+    # orders IoCs the same way `stats.calculate_all_statistics` does
+    loaded_order = {name: i for i, name in enumerate(loaded)}
+    changed.sort(key=lambda name: loaded_order.get(name, len(loaded_order)))
+    partials = remove_feeds(partials, changes["modified"] + changes["removed"])
+
+    changed_feeds = []
+    for feed_name in changed:
+        cti_feed = loaded.get(feed_name)
+        if cti_feed is None:
+            cti_feed = io.load_single_feed(
+                os.path.join(cti_feeds_path, feed_name), typed=True
+            )
+        changed_feeds.append(cti_feed)
+
+    for feed_name, cti_feed, feed in zip(
+        changed,
+        changed_feeds,
+        parallel.map_feeds(feed_partials, changed_feeds, processes),
+    ):
+        partials = add_feed(partials, feed_name, cti_feed, checksums[feed_name], feed)
+
+    write_partials(cti_feeds_path, partials)
+
+    return partials_to_statistics(partials)
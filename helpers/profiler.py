@@ -0,0 +1,404 @@
+import json
+import math
+import os
+import threading
+import time
+from functools import partial, wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+PROFILE_FORMAT_VERSION: int = 1
+
+
+def _env_flag(name: str) -> bool:
+    return os.environ.get(name, "false").lower() in ("true", "1")
+
+
+# Spans are timed only when enabled, `HOWLONG_ENABLE` is the former name
+ENABLED: bool = _env_flag("PROFILE_ENABLE") or _env_flag("HOWLONG_ENABLE")
+# Keep every timed span as a trace event for `write_chrome_trace`
+TRACE_ENABLED: bool = _env_flag("PROFILE_TRACE")
+# Trace events kept at most, the spans statistics are kept in full anyway
+TRACE_EVENTS_LIMIT: int = 10 ** 6
+
+# Durations histogram: buckets of a quarter octave from 1 ns, so that
+# a percentile is within ~10% of the true one
+BUCKETS_PER_OCTAVE: int = 4
+PERCENTILES: Tuple[int, ...] = (50, 90, 99)
+# Spans around every row (IoC) time only every this many calls
+ROW_SAMPLE: int = 100
+# Separates the names of the nested spans in the span path
+PATH_SEPARATOR: str = "/"
+
+
+def bucket_of(duration_ns: int) -> int:
+    return int(math.log2(max(duration_ns, 1)) * BUCKETS_PER_OCTAVE)
+
+
+def bucket_value(bucket: int) -> float:
+    """Middle of the bucket, seconds"""
+    return 2 ** ((bucket + 0.5) / BUCKETS_PER_OCTAVE) / 1e9
+
+
+class SpanStats:
+    """
+    Statistics of a span path: calls (sampled out ones included),
+    timed calls count, total, min and max duration (nanoseconds)
+    and the durations histogram
+    """
+
+    __slots__ = ("calls", "count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+        self.buckets: Dict[int, int] = {}
+
+    def add(self, duration_ns: int) -> None:
+        if not self.count or duration_ns < self.min:
+            self.min = duration_ns
+        if duration_ns > self.max:
+            self.max = duration_ns
+        self.count += 1
+        self.total += duration_ns
+        bucket = bucket_of(duration_ns)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def merge(self, other: Dict[str, Any]) -> None:
+        if other["count"]:
+            self.min = other["min"] if not self.count else min(self.min, other["min"])
+            self.max = max(self.max, other["max"])
+        self.calls += other["calls"]
+        self.count += other["count"]
+        self.total += other["total"]
+        for bucket, count in other["buckets"].items():
+            bucket = int(bucket)
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    def percentile(self, q: float) -> float:
+        """Percentile of the timed durations by the histogram, seconds"""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(max(bucket_value(bucket), self.min / 1e9), self.max / 1e9)
+        return self.max / 1e9
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            "buckets": {str(bucket): count for bucket, count in self.buckets.items()},
+        }
+
+
+class NullSpan:
+    """Span of the disabled profiler, nothing is timed"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+# Marks the sampled out span in the stack, its children are not timed
+SKIPPED: str = ""
+
+
+class Span:
+    __slots__ = ("profiler", "path", "start")
+
+    def __init__(self, profiler: "Profiler", path: str):
+        self.profiler = profiler
+        self.path = path
+        self.start = 0
+
+    def __enter__(self):
+        self.profiler.stack().append(self.path)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        end = time.perf_counter_ns()
+        self.profiler.stack().pop()
+        self.profiler.record(self.path, self.start, end)
+        return False
+
+
+class SkippedSpan:
+    """Sampled out span, spans nested in it are not timed"""
+
+    __slots__ = ("profiler",)
+
+    def __init__(self, profiler: "Profiler"):
+        self.profiler = profiler
+
+    def __enter__(self):
+        self.profiler.stack().append(SKIPPED)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.profiler.stack().pop()
+        return False
+
+
+class Profiler:
+    """
+    Spans statistics keyed by the span path (names of the enclosing spans
+    and the span name joined by `PATH_SEPARATOR`), every thread nests its
+    own spans. With `trace` every timed span is kept as a trace event
+    too. Statistics of other processes are added by `merge`
+    """
+
+    def __init__(self, trace: bool = False, root: str = ""):
+        self.trace = trace
+        self.root = root
+        self.spans: Dict[str, SpanStats] = {}
+        self.events: List[Tuple[str, int, int, int, int]] = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def stack(self) -> List[str]:
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = [self.root] if self.root else []
+        return stack
+
+    def current_path(self) -> str:
+        stack = self.stack()
+        return stack[-1] if stack else ""
+
+    def span(self, name: str, sample: int = 1):
+        """
+        Span of the name nested in the current span of the thread. With
+        `sample` only every `sample`-th call of the span path is timed,
+        for spans around every row; spans nested in a sampled out span
+        are not timed either
+        """
+        stack = self.stack()
+        parent = stack[-1] if stack else None
+        if parent == SKIPPED:
+            return SkippedSpan(self)
+
+        path = f"{parent}{PATH_SEPARATOR}{name}" if parent else name
+        with self.lock:
+            stats = self.spans.get(path)
+            if stats is None:
+                stats = self.spans[path] = SpanStats()
+            stats.calls += 1
+            calls = stats.calls
+
+        if sample > 1 and (calls - 1) % sample:
+            return SkippedSpan(self)
+        return Span(self, path)
+
+    def record(self, path: str, start: int, end: int) -> None:
+        with self.lock:
+            self.spans[path].add(end - start)
+            if self.trace and len(self.events) < TRACE_EVENTS_LIMIT:
+                self.events.append(
+                    (path, start, end - start, os.getpid(), threading.get_ident())
+                )
+
+    def merge(self, data: Dict[str, Any]) -> None:
+        """Add the statistics and trace events exported by `to_dict`"""
+        with self.lock:
+            for path, stats in data["spans"].items():
+                if path not in self.spans:
+                    self.spans[path] = SpanStats()
+                self.spans[path].merge(stats)
+            room = TRACE_EVENTS_LIMIT - len(self.events)
+            self.events.extend(tuple(event) for event in data["events"][:room])
+
+    def clear(self) -> None:
+        with self.lock:
+            self.spans.clear()
+            self.events.clear()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Raw statistics and events, JSON serializable and mergeable"""
+        with self.lock:
+            return {
+                "format_version": PROFILE_FORMAT_VERSION,
+                "spans": {path: stats.to_dict() for path, stats in self.spans.items()},
+                "events": [list(event) for event in self.events],
+            }
+
+    def report(self) -> List[Dict[str, Any]]:
+        """
+        Summary of every timed span path in the order of the first call:
+        calls, timed calls, total, mean, min, max and percentiles of the
+        duration (seconds). `estimated_calls` and `estimated_total` scale
+        the sampled spans and the spans nested in them up to all the calls
+        """
+        with self.lock:
+            spans = [(path, stats) for path, stats in self.spans.items()]
+
+        # Share of the calls of every path timed, parents come before children
+        timed_share: Dict[str, float] = {}
+        report: List[Dict[str, Any]] = []
+        for path, stats in spans:
+            parent = path.rsplit(PATH_SEPARATOR, 1)[0] if PATH_SEPARATOR in path else ""
+            parent_share = timed_share.get(parent, 1.0)
+            timed_share[path] = parent_share * (
+                stats.count / stats.calls if stats.calls else 1.0
+            )
+            if not stats.count:
+                continue
+
+            row = {
+                "path": path,
+                "calls": stats.calls,
+                "count": stats.count,
+                "estimated_calls": round(stats.calls / parent_share),
+                "total": stats.total / 1e9,
+                "estimated_total": stats.total / 1e9 / timed_share[path],
+                "mean": stats.total / 1e9 / stats.count,
+                "min": stats.min / 1e9,
+                "max": stats.max / 1e9,
+            }
+            row.update({f"p{q}": stats.percentile(q) for q in PERCENTILES})
+            report.append(row)
+        return report
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """Trace events in the Chrome trace event format (complete events)"""
+        with self.lock:
+            events = list(self.events)
+
+        return {
+            "traceEvents": [
+                {
+                    "name": path.rsplit(PATH_SEPARATOR, 1)[-1],
+                    "cat": "span",
+                    "ph": "X",
+                    "ts": start / 1e3,
+                    "dur": duration / 1e3,
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"path": path},
+                }
+                for path, start, duration, pid, tid in events
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+
+PROFILER = Profiler(trace=TRACE_ENABLED)
+
+
+def span(name: str, sample: int = 1):
+    """
+    Span of the global profiler: `with profiler.span("name"): ...`,
+    just a branch when profiling is disabled
+    """
+    if not ENABLED:
+        return NULL_SPAN
+    return PROFILER.span(name, sample)
+
+
+def profiled(name: Optional[str] = None):
+    """Decorator timing every call of the function as a span of the name"""
+
+    def decorator(function: Callable) -> Callable:
+        span_name = name or function.__name__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with PROFILER.span(span_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enable(trace: bool = False) -> None:
+    global ENABLED
+    ENABLED = True
+    PROFILER.trace = PROFILER.trace or trace
+
+
+def disable() -> None:
+    global ENABLED
+    ENABLED = False
+
+
+def _collect(
+    function: Callable[[Any], Any], trace: bool, root: str, task: Any
+) -> Tuple[Any, Dict[str, Any]]:
+    global PROFILER, ENABLED
+    saved = PROFILER, ENABLED
+    PROFILER, ENABLED = Profiler(trace=trace, root=root), True
+    try:
+        result = function(task)
+        return result, PROFILER.to_dict()
+    finally:
+        PROFILER, ENABLED = saved
+
+
+def collecting(function: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    """
+    The function for a worker process: it profiles the task into a fresh
+    profiler nested in the current span and returns (result, profile) to
+    be merged by `merge_collected`. The function is returned as is when
+    profiling is disabled
+    """
+    if not ENABLED:
+        return function
+    return partial(_collect, function, PROFILER.trace, PROFILER.current_path())
+
+
+def merge_collected(results: List[Any]) -> List[Any]:
+    """Results of the `collecting` function, their profiles merged in"""
+    if not ENABLED:
+        return results
+    for _, data in results:
+        PROFILER.merge(data)
+    return [result for result, _ in results]
+
+
+def write_json(path: str) -> None:
+    with open(path, "w") as file:
+        json.dump({"report": PROFILER.report(), **PROFILER.to_dict()}, file, indent=2)
+
+
+def write_chrome_trace(path: str) -> None:
+    """Trace to open in chrome://tracing or Perfetto"""
+    with open(path, "w") as file:
+        json.dump(PROFILER.chrome_trace(), file)
+
+
+def flush_stat(limit: Optional[int] = None) -> None:
+    """Print the spans summary, the slowest spans first"""
+    if not ENABLED:
+        return
+    print("[PROFILE] Flushing stat...")
+
+    report = sorted(PROFILER.report(), key=lambda row: -row["estimated_total"])
+    for row in report[:limit]:
+        print(
+            "{path}: {estimated_calls}; {estimated_total:.2f} sec.; mean {mean_ms:.3f} ms, "
+            "p50 {p50_ms:.3f} ms, p99 {p99_ms:.3f} ms".format(
+                mean_ms=row["mean"] * 1e3,
+                p50_ms=row["p50"] * 1e3,
+                p99_ms=row["p99"] * 1e3,
+                **row,
+            )
+        )
+
+    print("[PROFILE] Done")
@@ -0,0 +1,265 @@
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import functions
+import scoring_engine as engine
+from helpers.index import IocIndex
+
+# (mention, date) pairs reduced at once by `IocScorer.score_matrix`
+MATRIX_BLOCK_SIZE: int = 2 ** 22
+
+
+class IocScorer:
+    """
+    Point queries over the scored dataset: final score of one IoC or
+    a batch of IoCs without scoring the whole corpus. IoC values are
+    looked up in the hash index of `IocIndex`, feeds source
+    confidences are resolved per mention once, the decay is
+    calculated at query time for the mentions of the queried IoCs only.
+    Source confidences of the mentions may be given as is, e.g. mapped
+    from the engine snapshot (see `helpers.snapshot`)
+    """
+
+    def __init__(
+        self,
+        index: IocIndex,
+        feed_confidences: np.ndarray,
+        edge_confidences: Optional[np.ndarray] = None,
+    ):
+        self.index = index
+        self.feed_confidences = np.asarray(feed_confidences, dtype=np.float64)
+        self.edge_confidences = (
+            self.feed_confidences[index.feed_ids]
+            if edge_confidences is None
+            else edge_confidences
+        )
+
+        # Warm up the values hash index
+        index.ioc_ids([])
+
+    @classmethod
+    def from_statistics(cls, index: IocIndex, feeds_stats: pd.DataFrame) -> "IocScorer":
+        """Scorer over the index with confidences from the feeds statistics"""
+        return cls(
+            index,
+            feeds_stats.loc[index.feed_names, "feed_source_confidence"].to_numpy(
+                dtype=np.float64
+            ),
+        )
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, ioc_value: Any) -> bool:
+        return self.index.ioc_id(ioc_value) is not None
+
+    def _query_edges(self, ioc_ids: np.ndarray):
+        """Edge positions of the IoCs and the position of their IoC in `ioc_ids`"""
+        starts = self.index.indptr[ioc_ids]
+        counts = self.index.indptr[ioc_ids + 1] - starts
+        owners = np.repeat(np.arange(len(ioc_ids)), counts)
+        offsets = np.cumsum(counts) - counts
+        edges = np.arange(counts.sum()) + np.repeat(starts - offsets, counts)
+        return edges, owners, counts
+
+    def score_matrix(
+        self,
+        dates: Iterable[float],
+        ioc_values: Optional[Iterable[Any]] = None,
+        block_size: int = MATRIX_BLOCK_SIZE,
+    ) -> pd.DataFrame:
+        """
+        Final scores of the IoCs as of every date in one pass: decay is
+        calculated per distinct `last_seen` and date, the weighted sums
+        are reduced for all (IoC, date) pairs of a block of dates with a
+        single `np.bincount`, in the same order as the single-date scoring
+
+            Parameters:
+
+                dates — unixtimes the scores are calculated as of
+                ioc_values — IoC values to score, all IoCs if not set
+                block_size (int) — (mention, date) pairs reduced at once,
+                bounds the memory taken by the intermediate arrays
+
+            Returns:
+
+                pandas.DataFrame of int64 scores indexed by IoC value,
+                one column per date, -1 for IoCs missing in the index
+        """
+        dates = np.asarray(list(dates), dtype=np.float64)
+
+        if ioc_values is None:
+            values = self.index.values
+            ioc_ids = np.arange(len(self.index))
+        else:
+            values = np.array(list(ioc_values), dtype=object)
+            ioc_ids = self.index.ioc_ids(values)
+
+        known = np.flatnonzero(ioc_ids >= 0)
+        edges, owners, _ = self._query_edges(ioc_ids[known])
+        edge_confidences = self.edge_confidences[edges]
+        confidences_squared = edge_confidences ** 2
+        last_seens, last_seens_ids = np.unique(
+            self.index.last_seen[edges], return_inverse=True
+        )
+
+        y = np.bincount(owners, weights=edge_confidences, minlength=len(known))
+        scores = np.full((len(values), len(dates)), -1, dtype=np.int64)
+        dates_per_block = max(1, block_size // max(len(edges), 1))
+
+        for start in range(0, len(dates), dates_per_block):
+            block = dates[start : start + dates_per_block]
+            decay_coefs = np.stack(
+                [engine.get_decay_coefs(last_seens, date) for date in block.tolist()],
+                axis=1,
+            )
+
+            # (IoC, date) pairs numbered IoC-major, so the mentions of
+            # the IoC are accumulated in their order for every date
+            pairs = owners[:, None] * len(block) + np.arange(len(block))
+            x = np.bincount(
+                pairs.ravel(),
+                weights=(
+                    confidences_squared[:, None] * decay_coefs[last_seens_ids]
+                ).ravel(),
+                minlength=len(known) * len(block),
+            ).reshape(len(known), len(block))
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                scores[known, start : start + len(block)] = np.where(
+                    y[:, None] > 0, np.rint(x / y[:, None] * 100), 0
+                )
+
+        return pd.DataFrame(
+            scores,
+            index=pd.Index(values, name="value"),
+            columns=pd.Index(dates, name="dt_now"),
+        )
+
+    def final_scores(
+        self, ioc_values: Iterable[Any], dt_now: Optional[float] = None
+    ) -> np.ndarray:
+        """
+        Final scores of the IoCs, -1 for IoCs missing in the index
+
+            Parameters:
+
+                ioc_values — IoC values to score
+                dt_now (float) — unixtime means current time, now if not set
+
+            Returns:
+
+                numpy.ndarray of int64 scores (0..100) in the order of values
+        """
+        return self._score(ioc_values, dt_now)[0]
+
+    def _score(self, ioc_values: Iterable[Any], dt_now: Optional[float]):
+        """
+        Scores of the IoCs along with the positions of the known IoCs
+        in values, their mentions (edges) and per-mention details
+        """
+        if dt_now is None:
+            dt_now = time.mktime(datetime.now().timetuple())
+
+        ioc_ids = self.index.ioc_ids(list(ioc_values))
+        known = np.flatnonzero(ioc_ids >= 0)
+        edges, owners, counts = self._query_edges(ioc_ids[known])
+
+        last_seens = self.index.last_seen[edges]
+        feeds_scores = engine.get_decay_coefs(
+            np.where(last_seens == 0, dt_now, last_seens), dt_now
+        )
+        edge_confidences = self.edge_confidences[edges]
+
+        x = np.bincount(
+            owners, weights=edge_confidences**2 * feeds_scores, minlength=len(known)
+        )
+        y = np.bincount(owners, weights=edge_confidences, minlength=len(known))
+
+        scores = np.full(len(ioc_ids), -1, dtype=np.int64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores[known] = np.where(y > 0, np.rint(x / y * 100), 0)
+
+        return scores, known, edges, counts, edge_confidences, feeds_scores
+
+    def query(
+        self, ioc_values: Iterable[Any], dt_now: Optional[float] = None
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        Scores of the IoCs with the per-feed details, in the same shape
+        as the per-IoC part of `engine.calculate_iocs_score` rows.
+
+            Parameters:
+
+                ioc_values — IoC values to score
+                dt_now (float) — unixtime means current time, now if not set
+
+            Returns:
+
+                List of {"value", "score", "ioc_mentions", "feeds",
+                "source_confidences", "feeds_scores"} dicts in the
+                order of values, None for IoCs missing in the index
+        """
+        ioc_values = list(ioc_values)
+        scores, known, edges, counts, edge_confidences, feeds_scores = self._score(
+            ioc_values, dt_now
+        )
+
+        result: List[Optional[Dict[str, Any]]] = [None] * len(ioc_values)
+        bounds = np.concatenate(([0], np.cumsum(counts))).tolist()
+        feed_names = self.index.feed_names[self.index.feed_ids[edges]].tolist()
+        confidences_list = edge_confidences.tolist()
+        feeds_scores_list = np.rint(feeds_scores * 100).astype(np.int64).tolist()
+        scores_list = scores.tolist()
+
+        for i, position in enumerate(known.tolist()):
+            start, end = bounds[i], bounds[i + 1]
+            result[position] = {
+                "value": ioc_values[position],
+                "score": scores_list[position],
+                "ioc_mentions": end - start,
+                "feeds": feed_names[start:end],
+                "source_confidences": confidences_list[start:end],
+                "feeds_scores": feeds_scores_list[start:end],
+            }
+
+        return result
+
+    def query_one(
+        self, ioc_value: Any, dt_now: Optional[float] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Score of the single IoC, see `query`. A handful of mentions is
+        cheaper to score in plain Python than with array operations
+        """
+        if dt_now is None:
+            dt_now = time.mktime(datetime.now().timetuple())
+
+        ioc_id = self.index.ioc_id(ioc_value)
+        if ioc_id is None:
+            return None
+
+        edges = self.index.edges(ioc_id)
+        source_confidences = self.edge_confidences[edges].tolist()
+        feeds_scores = [
+            engine.get_single_feed_ioc_score(None, last_seen, dt_now)
+            for last_seen in self.index.last_seen[edges].tolist()
+        ]
+        mentions = len(source_confidences)
+
+        return {
+            "value": ioc_value,
+            "score": (
+                functions.score(source_confidences, feeds_scores, mentions)
+                if sum(source_confidences) > 0
+                else 0
+            ),
+            "ioc_mentions": mentions,
+            "feeds": self.index.feed_names[self.index.feed_ids[edges]].tolist(),
+            "source_confidences": source_confidences,
+            "feeds_scores": [round(r * 100) for r in feeds_scores],
+        }
@@ -0,0 +1,323 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from helpers import io, keys
+from helpers.index import IocIndex, factorize_iocs
+
+SCORES_FILE: str = ".scores.npz"
+SCORES_FORMAT_VERSION: int = 3
+SECONDS_PER_DAY: int = 24 * 60 * 60
+
+
+def decayed_at(last_seen: np.ndarray, decay_ttl: float) -> np.ndarray:
+    """
+    Unixtime from which the mention has decayed completely (its
+    `last_seen` plus `decay_ttl` days), so its single feed score no
+    longer changes with time. Mentions without `last_seen` never
+    decay, -inf for them
+    """
+    return np.where(
+        last_seen == 0,
+        -np.inf,
+        np.asarray(last_seen, dtype=np.float64) + decay_ttl * SECONDS_PER_DAY,
+    )
+
+
+def write_scores(
+    path: str,
+    index: IocIndex,
+    final_scores: np.ndarray,
+    feeds_scores: np.ndarray,
+    feed_confidences: np.ndarray,
+    checksums: Dict[str, str],
+    dt_now: float,
+    decay_rate: float,
+    decay_ttl: int,
+) -> None:
+    """
+    Store the state of the run next to the feeds, enough to score the
+    next run without reading unchanged feeds: the index (IoCs, their
+    mentions and the feeds rows), final score of every IoC, single feed
+    score of every mention, checksum, rows count and source confidence
+    of every feed and the decay parameters
+    """
+    arrays: Dict[str, np.ndarray] = {
+        "format_version": np.array(SCORES_FORMAT_VERSION),
+        "dt_now": np.array(dt_now, dtype=np.float64),
+        "decay_rate": np.array(decay_rate, dtype=np.float64),
+        "decay_ttl": np.array(decay_ttl, dtype=np.float64),
+        "iocs.score": np.asarray(final_scores, dtype=np.int64),
+        "iocs.indptr": index.indptr.astype(np.int64),
+        "edges.first_seen": index.first_seen.astype(np.int64),
+        "edges.last_seen": index.last_seen.astype(np.int64),
+        "edges.feed_score": np.asarray(feeds_scores, dtype=np.float64),
+        "rows.ioc_id": index.row_ioc_ids.astype(np.int64),
+        "rows.edge": index.row_edges.astype(np.int64),
+        "feeds.feed_name": index.feed_names.astype(str),
+        "feeds.checksum": np.array(
+            [checksums.get(name, "") for name in index.feed_names.tolist()], dtype=str
+        ),
+        "feeds.size": np.bincount(index.feed_ids, minlength=len(index.feed_names)),
+        "feeds.source_confidence": np.asarray(feed_confidences, dtype=np.float64),
+    }
+    arrays["iocs.value"], arrays["iocs.value_missing"] = io.encode_strings(index.values)
+    if index.keys is not None:
+        arrays["iocs.key"] = index.keys
+
+    SCORES_PATH: str = os.path.join(path, SCORES_FILE)
+    with open(SCORES_PATH + ".tmp", "wb") as file:
+        np.savez(file, **arrays)
+    os.replace(SCORES_PATH + ".tmp", SCORES_PATH)
+
+
+def load_scores(path: str) -> Optional[Dict[str, np.ndarray]]:
+    """State of the previous run, None if there is no usable one"""
+    SCORES_PATH: str = os.path.join(path, SCORES_FILE)
+
+    if not os.path.isfile(SCORES_PATH):
+        return None
+
+    with np.load(SCORES_PATH, allow_pickle=False) as stored:
+        if int(stored["format_version"]) != SCORES_FORMAT_VERSION:
+            return None
+        scores = {key: stored[key] for key in stored.files}
+
+    scores["iocs.value"] = io.decode_strings(
+        scores["iocs.value"], scores.pop("iocs.value_missing")
+    )
+    return scores
+
+
+def unchanged_feeds(
+    previous: Optional[Dict[str, np.ndarray]], checksums: Dict[str, str]
+) -> List[str]:
+    """Feeds of the previous run with the same checksum now"""
+    if previous is None:
+        return []
+
+    return [
+        name
+        for name, checksum in zip(
+            previous["feeds.feed_name"].tolist(), previous["feeds.checksum"].tolist()
+        )
+        if checksums.get(name) == checksum
+    ]
+
+
+def carry_forward(
+    previous: Optional[Dict[str, np.ndarray]],
+    feed_names: List[str],
+    cti_feeds: List[Dict[str, Any]],
+    hashed_keys: bool = False,
+) -> Tuple[IocIndex, np.ndarray, np.ndarray]:
+    """
+    Build the index over the feeds (in `feed_names` order) without
+    reading the unchanged ones: rows of the feeds which are not in
+    `cti_feeds` (the added and modified feeds) are taken from the
+    previous run state. IoCs are joined with the previous ones by the
+    values and numbered by the first appearance, the same way
+    `IocIndex.from_feeds` does. With `hashed_keys` the index gets the
+    IoC keys, unless distinct IoCs happen to share a key
+
+        Returns:
+
+            Index, previous id of every IoC (-1 for new IoCs) and
+            the previous single feed score of every mention (NaN
+            for the mentions read from `cti_feeds`)
+    """
+    loaded = {feed["name"]: feed["df"] for feed in cti_feeds}
+
+    def concatenate(parts: List[np.ndarray], dtype) -> np.ndarray:
+        return np.concatenate(parts + [np.array([], dtype=dtype)]).astype(dtype)
+
+    if previous is None:
+        previous_values = np.array([], dtype=object)
+        previous_positions: Dict[str, int] = {}
+        previous_offsets = np.zeros(1, dtype=np.int64)
+    else:
+        previous_values = previous["iocs.value"]
+        previous_positions = {
+            name: i for i, name in enumerate(previous["feeds.feed_name"].tolist())
+        }
+        previous_offsets = np.concatenate(([0], np.cumsum(previous["feeds.size"])))
+
+    # Values of the read rows are looked up among the previous IoCs at
+    # once, the unknown ones get ids after them
+    read_values = concatenate(
+        [
+            loaded[name]["value"].to_numpy(dtype=object)
+            for name in feed_names
+            if name in loaded
+        ],
+        object,
+    )
+    read_ids = pd.Index(previous_values, dtype=object).get_indexer(read_values)
+    unknown = read_ids < 0
+    codes, new_values = factorize_iocs(read_values[unknown])
+    read_ids[unknown] = len(previous_values) + codes
+    values = np.concatenate((previous_values, new_values))
+
+    ioc_ids: List[np.ndarray] = []
+    feed_ids: List[np.ndarray] = []
+    first_seen: List[np.ndarray] = []
+    last_seen: List[np.ndarray] = []
+    feeds_scores: List[np.ndarray] = []
+    read_offset = 0
+    for feed_id, name in enumerate(feed_names):
+        if name in loaded:
+            df = loaded[name]
+            size = len(df.index)
+            ioc_ids.append(read_ids[read_offset : read_offset + size])
+            first_seen.append(df["first_seen"].to_numpy(dtype=np.int64))
+            last_seen.append(df["last_seen"].to_numpy(dtype=np.int64))
+            feeds_scores.append(np.full(size, np.nan))
+            read_offset += size
+        else:
+            position = previous_positions[name]
+            rows = slice(previous_offsets[position], previous_offsets[position + 1])
+            edges = previous["rows.edge"][rows]
+            size = len(edges)
+            ioc_ids.append(previous["rows.ioc_id"][rows])
+            first_seen.append(previous["edges.first_seen"][edges])
+            last_seen.append(previous["edges.last_seen"][edges])
+            feeds_scores.append(previous["edges.feed_score"][edges])
+        feed_ids.append(np.full(size, feed_id, dtype=np.int32))
+
+    row_ioc_ids = concatenate(ioc_ids, np.int64)
+
+    # Renumber IoCs by the first appearance, IoCs only in the
+    # removed feeds are left out
+    used, first_rows = np.unique(row_ioc_ids, return_index=True)
+    used = used[np.argsort(first_rows, kind="stable")]
+    renumbered = np.empty(len(values), dtype=np.int64)
+    renumbered[used] = np.arange(len(used))
+
+    ioc_keys = None
+    if hashed_keys:
+        if previous is not None and "iocs.key" in previous:
+            previous_keys = previous["iocs.key"]
+        else:
+            previous_keys = keys.ioc_keys(previous_values)
+        ioc_keys = np.concatenate((previous_keys, keys.ioc_keys(new_values)))[used]
+        sorted_keys = np.sort(ioc_keys)
+        if (sorted_keys[1:] == sorted_keys[:-1]).any():
+            print("[INDEX] 64-bit IoC key collision, IoCs are grouped by values")
+            ioc_keys = None
+
+    index = IocIndex.from_rows(
+        np.array(feed_names, dtype=object),
+        values[used],
+        renumbered[row_ioc_ids],
+        concatenate(feed_ids, np.int32),
+        concatenate(first_seen, np.int64),
+        concatenate(last_seen, np.int64),
+        ioc_keys,
+    )
+
+    edge_feeds_scores = np.empty(index.edges_count, dtype=np.float64)
+    edge_feeds_scores[index.row_edges] = concatenate(feeds_scores, np.float64)
+
+    return (
+        index,
+        np.where(used < len(previous_values), used, -1),
+        edge_feeds_scores,
+    )
+
+
+def stale_edges(
+    previous: Optional[Dict[str, np.ndarray]],
+    index: IocIndex,
+    feeds_scores: np.ndarray,
+    dt_now: float,
+    decay_rate: float,
+    decay_ttl: int,
+) -> np.ndarray:
+    """
+    Function finds mentions whose single feed score has to be decayed
+    again: mentions read from the feeds (no previous score) and, if
+    `dt_now` has moved forward, mentions which were still decaying at
+    the previous `dt_now` (see `decayed_at`). All mentions if there is
+    no previous run, the decay parameters have changed or `dt_now`
+    has moved back
+
+        Returns:
+
+            Boolean mask over the index edges
+    """
+    if (
+        previous is None
+        or float(previous["decay_rate"]) != decay_rate
+        or float(previous["decay_ttl"]) != decay_ttl
+        or dt_now < float(previous["dt_now"])
+    ):
+        return np.ones(index.edges_count, dtype=bool)
+
+    stale = np.isnan(feeds_scores)
+    previous_dt_now = float(previous["dt_now"])
+    if dt_now > previous_dt_now:
+        stale |= ~(decayed_at(index.last_seen, decay_ttl) < previous_dt_now)
+
+    return stale
+
+
+def get_dirty_iocs(
+    previous: Optional[Dict[str, np.ndarray]],
+    index: IocIndex,
+    previous_ids: np.ndarray,
+    stale: np.ndarray,
+    feed_confidences: np.ndarray,
+) -> np.ndarray:
+    """
+    Function finds IoCs whose score may differ from the previous run:
+
+        * IoCs which are new or whose mentions count has changed
+          (e.g. they were in a removed feed)
+        * IoCs with a mention whose single feed score is decayed
+          again, see `stale_edges` (this covers the mentions in the
+          added and modified feeds)
+        * IoCs mentioned in feeds whose source confidence has moved
+
+        Returns:
+
+            Boolean mask over the index IoC ids
+    """
+    if previous is None:
+        return np.ones(len(index), dtype=bool)
+
+    dirty = previous_ids < 0
+    known = previous_ids[~dirty]
+    previous_mentions = np.diff(previous["iocs.indptr"])
+    dirty[~dirty] = previous_mentions[known] != index.mentions[~dirty]
+
+    previous_confidences = dict(
+        zip(
+            previous["feeds.feed_name"].tolist(),
+            previous["feeds.source_confidence"].tolist(),
+        )
+    )
+    moved_feeds = np.array(
+        [
+            previous_confidences.get(name) != confidence
+            for name, confidence in zip(
+                index.feed_names.tolist(), np.asarray(feed_confidences).tolist()
+            )
+        ],
+        dtype=bool,
+    )
+
+    dirty_edges = stale | moved_feeds[index.feed_ids]
+    dirty |= np.bincount(index.edge_ioc_ids[dirty_edges], minlength=len(index)) > 0
+
+    return dirty
+
+
+def previous_final_scores(
+    previous: Optional[Dict[str, np.ndarray]], previous_ids: np.ndarray
+) -> np.ndarray:
+    """Previous final scores over the index IoC ids, -1 for new IoCs"""
+    if previous is None:
+        return np.full(len(previous_ids), -1, dtype=np.int64)
+    return np.where(previous_ids >= 0, previous["iocs.score"][previous_ids], -1)
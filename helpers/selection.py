@@ -0,0 +1,44 @@
+from typing import Optional
+
+import numpy as np
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Positions of the `k` highest scores ordered by score descending,
+    equal scores by position. Only the candidates picked by partial
+    selection (`np.argpartition`) are sorted
+    """
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    if k >= len(scores):
+        return np.lexsort((np.arange(len(scores)), -scores))
+
+    kth_score = scores[np.argpartition(-scores, k - 1)[k - 1]]
+
+    # All scores above the k-th one and the first of the equal ones
+    above = np.flatnonzero(scores > kth_score)
+    equal = np.flatnonzero(scores == kth_score)[: k - len(above)]
+    positions = np.concatenate((above, equal))
+
+    return positions[np.lexsort((positions, -scores[positions]))]
+
+
+def select_scores(
+    scores: np.ndarray,
+    min_score: Optional[int] = None,
+    k: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Positions of the scores passing the threshold (`score >= min_score`),
+    in their order, or at most `k` highest of them, see `top_k`
+    """
+    positions = np.arange(len(scores))
+
+    if min_score is not None:
+        positions = np.flatnonzero(scores >= min_score)
+
+    if k is not None:
+        positions = positions[top_k(scores[positions], k)]
+
+    return positions
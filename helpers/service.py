@@ -0,0 +1,292 @@
+import asyncio
+import json
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import scoring_engine as engine
+from helpers import whitelist
+from helpers.integrity_checker import feeds_checksums, get_feeds_changes
+from helpers.query import IocScorer
+
+# How often the feeds directory is checked for changes, seconds
+CHECK_INTERVAL: float = 60.0
+# Bulk requests with more IoCs are scored in a worker thread
+INLINE_BULK_SIZE: int = 1000
+MAX_BODY_SIZE: int = 64 * 2 ** 20
+
+HTTP_STATUSES: Dict[int, str] = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class ScoringService:
+    """
+    Resident scoring service: the feeds are loaded once and IoC score
+    requests are answered from the in-memory `IocScorer` over HTTP/1.1
+    (TCP or Unix socket, keep-alive connections).
+
+    The feeds directory and the whitelist files are checked every
+    `check_interval` seconds, on changes the scorer is rebuilt in a
+    worker thread and swapped in with a single assignment, requests
+    keep using the previous scorer until the new one is ready.
+
+        Endpoints:
+
+            GET /score?ioc=<value>[&dt_now=<unixtime>] — single IoC,
+            404 for an IoC that is not in the feeds
+            POST /score {"iocs": [...], "dt_now": <unixtime>} — bulk,
+            `dt_now` is optional, now by default
+            GET /health — loaded IoCs and feeds count, load time
+    """
+
+    def __init__(
+        self,
+        cti_feeds_path: str,
+        check_interval: float = CHECK_INTERVAL,
+        workers: Optional[int] = None,
+    ):
+        self.cti_feeds_path = cti_feeds_path
+        self.check_interval = check_interval
+        self.workers = workers
+
+        self.scorer: Optional[IocScorer] = None
+        self.checksums: Dict[str, str] = {}
+        self.whitelist_stamp: Tuple = ()
+        self.loaded_at: Optional[float] = None
+        self.loads_count: int = 0
+
+        self._watcher: Optional[asyncio.Task] = None
+
+    def load(self) -> Tuple[IocScorer, Dict[str, str], Tuple]:
+        """
+        Build the scorer, checksums and the whitelist stamp
+        are taken before the feeds are read
+        """
+        checksums, whitelist_stamp = self.stamps()
+        scorer = engine.load_iocs_scorer(self.cti_feeds_path, workers=self.workers)
+        return scorer, checksums, whitelist_stamp
+
+    def stamps(self) -> Tuple[Dict[str, str], Tuple]:
+        """Feeds checksums and the whitelist files stamp"""
+        return (
+            feeds_checksums(self.cti_feeds_path),
+            whitelist.files_stamp(engine.WHITELISTS_PATH),
+        )
+
+    def swap(
+        self, scorer: IocScorer, checksums: Dict[str, str], whitelist_stamp: Tuple
+    ) -> None:
+        self.scorer, self.checksums = scorer, checksums
+        self.whitelist_stamp = whitelist_stamp
+        self.loaded_at = time.time()
+        self.loads_count += 1
+
+    async def reload_if_modified(self) -> bool:
+        """
+        Rebuild the scorer in a worker thread if the feeds
+        or the whitelist files have changed
+        """
+        loop = asyncio.get_running_loop()
+        checksums, whitelist_stamp = await loop.run_in_executor(None, self.stamps)
+        changes = get_feeds_changes(self.checksums, checksums)
+        whitelist_changed = whitelist_stamp != self.whitelist_stamp
+        if not any(changes.values()) and not whitelist_changed:
+            return False
+
+        if any(changes.values()):
+            print(
+                "[SERVICE] Feeds changed: {} added, {} modified, {} removed".format(
+                    len(changes["added"]),
+                    len(changes["modified"]),
+                    len(changes["removed"]),
+                )
+            )
+        if whitelist_changed:
+            print("[SERVICE] Whitelist changed")
+        self.swap(*await loop.run_in_executor(None, self.load))
+        print("[SERVICE] Reloaded")
+
+        return True
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.reload_if_modified()
+            except Exception as error:  # keep serving the loaded scorer
+                print("[SERVICE] Reload failed:", repr(error))
+
+    async def start(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        unix_socket: Optional[str] = None,
+    ) -> asyncio.AbstractServer:
+        """Load the feeds and start serving, Unix socket if the path is given"""
+        if self.scorer is None:
+            loop = asyncio.get_running_loop()
+            self.swap(*await loop.run_in_executor(None, self.load))
+
+        if unix_socket:
+            server = await asyncio.start_unix_server(self._serve, path=unix_socket)
+        else:
+            server = await asyncio.start_server(self._serve, host=host, port=port)
+
+        if self.check_interval and self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch())
+
+        return server
+
+    async def stop(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    async def _serve(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers: Dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                body = b""
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_SIZE:
+                    status, payload = 413, {"error": "request body is too large"}
+                else:
+                    if length:
+                        body = await reader.readexactly(length)
+                    try:
+                        status, payload = await self.handle(
+                            request_line.decode("latin-1"), body
+                        )
+                    except Exception as error:
+                        # The connection is answered even if scoring fails
+                        status, payload = 500, {"error": repr(error)}
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {HTTP_STATUSES[status]}\r\n"
+                        "Content-Type: application/json\r\n"
+                        f"Content-Length: {len(data)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                        "\r\n"
+                    ).encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+
+                if not keep_alive or status == 413:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle(self, request_line: str, body: bytes) -> Tuple[int, Any]:
+        """Route the request, returns HTTP status and JSON payload"""
+        try:
+            method, target, _ = request_line.split(" ", 2)
+        except ValueError:
+            return 400, {"error": "malformed request line"}
+
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        # Requests in flight keep the scorer they have started with
+        scorer = self.scorer
+
+        if url.path == "/health":
+            return 200, {
+                "iocs": len(scorer),
+                "feeds": len(scorer.index.feed_names),
+                "loaded_at": datetime.fromtimestamp(self.loaded_at).isoformat(),
+                "loads_count": self.loads_count,
+            }
+
+        if url.path != "/score":
+            return 404, {"error": "not found"}
+
+        if method == "GET":
+            if "ioc" not in params:
+                return 400, {"error": "`ioc` parameter is required"}
+            try:
+                dt_now = float(params["dt_now"][0]) if "dt_now" in params else None
+            except ValueError:
+                return 400, {"error": "`dt_now` must be unixtime"}
+
+            result = scorer.query_one(params["ioc"][0], dt_now)
+            if result is None:
+                return 404, {"error": "unknown IoC"}
+            return 200, result
+
+        if method != "POST":
+            return 405, {"error": "method not allowed"}
+
+        try:
+            request = json.loads(body or b"{}")
+            iocs, dt_now = request["iocs"], request.get("dt_now")
+        except (KeyError, ValueError, TypeError, AttributeError) as error:
+            return 400, {"error": f"malformed request: {error!r}"}
+        if not isinstance(iocs, list):
+            return 400, {"error": "`iocs` must be a list"}
+        if not all(isinstance(ioc, str) for ioc in iocs):
+            return 400, {"error": "`iocs` items must be strings"}
+        if dt_now is not None and (
+            isinstance(dt_now, bool) or not isinstance(dt_now, (int, float))
+        ):
+            return 400, {"error": "`dt_now` must be unixtime"}
+
+        if len(iocs) > INLINE_BULK_SIZE:
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(None, scorer.query, iocs, dt_now)
+        else:
+            results = scorer.query(iocs, dt_now)
+
+        return 200, {"results": results}
+
+
+async def serve(
+    cti_feeds_path: str,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    unix_socket: Optional[str] = None,
+    check_interval: float = CHECK_INTERVAL,
+    workers: Optional[int] = None,
+) -> None:
+    """Run the scoring service until cancelled"""
+    service = ScoringService(cti_feeds_path, check_interval, workers)
+    server = await service.start(host, port, unix_socket)
+    print(
+        "[SERVICE] Serving {} IoCs on {}".format(
+            len(service.scorer), unix_socket or f"http://{host}:{port}"
+        )
+    )
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
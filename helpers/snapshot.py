@@ -0,0 +1,282 @@
+import json
+import mmap
+import os
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from helpers import io, keys
+from helpers.index import IocIndex
+
+SNAPSHOT_FILE: str = ".engine-snapshot"
+SNAPSHOT_FORMAT_VERSION: int = 1
+SNAPSHOT_MAGIC: bytes = b"IOCSNAP\x00"
+# Arrays start at multiples of the alignment, so they can be viewed
+# in the mapped file as is
+ALIGNMENT: int = 64
+
+
+def align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def string_offsets(buffer: np.ndarray, count: int) -> np.ndarray:
+    """
+    Start of every string packed by `io.encode_strings` in the buffer,
+    followed by the end of the buffer plus one, so that the string `i`
+    is `buffer[offsets[i] : offsets[i + 1] - 1]`
+    """
+    if not count:
+        return np.zeros(1, dtype=np.int64)
+    return np.concatenate(
+        ([0], np.flatnonzero(buffer == 0) + 1, [len(buffer) + 1])
+    ).astype(np.int64)
+
+
+class PackedStrings:
+    """
+    Read-only array of strings packed into one utf-8 buffer (see
+    `io.encode_strings`), the strings are decoded only when taken.
+    Taking a handful of strings from a mapped snapshot touches only
+    their pages, nothing is decoded at load
+    """
+
+    def __init__(self, buffer: np.ndarray, offsets: np.ndarray, missing: np.ndarray):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.missing = missing
+
+    def __len__(self) -> int:
+        return len(self.missing)
+
+    def decode(self) -> np.ndarray:
+        """All the strings as an object array"""
+        return io.decode_strings(self.buffer, self.missing)
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        return self.decode() if dtype is None else self.decode().astype(dtype)
+
+    def tolist(self) -> List[Any]:
+        return self.decode().tolist()
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return self.take(np.array([item]))[0]
+        if isinstance(item, slice):
+            return self.take(np.arange(*item.indices(len(self))))
+        return self.take(np.arange(len(self))[item])
+
+    def take(self, positions: np.ndarray) -> np.ndarray:
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(positions) * 8 > len(self):
+            # Most of the strings, decoding the whole buffer at once is cheaper
+            return self.decode()[positions]
+
+        data = memoryview(self.buffer)
+        values = np.array(
+            [
+                str(data[start:end], "utf-8")
+                for start, end in zip(
+                    self.offsets[positions].tolist(),
+                    (self.offsets[positions + 1] - 1).tolist(),
+                )
+            ],
+            dtype=object,
+        )
+        values[self.missing[positions]] = np.nan
+        return values
+
+
+class Snapshot:
+    """
+    Engine state restored from the snapshot file: the IoC index, source
+    confidence of every feed and of every edge, feeds checksums and
+    the whitelist files stamp the state has been built with. Arrays
+    are read-only views of the mapped file, processes loading the same
+    snapshot share its pages
+    """
+
+    def __init__(
+        self,
+        index: IocIndex,
+        feed_confidences: np.ndarray,
+        edge_confidences: np.ndarray,
+        checksums: Dict[str, str],
+        whitelist_stamp: List,
+    ):
+        self.index = index
+        self.feed_confidences = feed_confidences
+        self.edge_confidences = edge_confidences
+        self.checksums = checksums
+        self.whitelist_stamp = whitelist_stamp
+
+
+def snapshot_arrays(
+    index: IocIndex, feed_confidences: np.ndarray
+) -> Tuple[Dict[str, np.ndarray], bool]:
+    """
+    Arrays of the snapshot and whether they have the IoC keys. Keys are
+    taken from the index or calculated, they are left out if distinct
+    IoCs of an index grouped by values happen to share a key
+    """
+    feed_confidences = np.asarray(feed_confidences, dtype=np.float64)
+    values, missing = io.encode_strings(index.values)
+
+    arrays: Dict[str, np.ndarray] = {
+        "feeds.source_confidence": feed_confidences,
+        "iocs.value": values,
+        "iocs.value_offsets": string_offsets(values, len(missing)),
+        "iocs.value_missing": missing,
+        "iocs.indptr": index.indptr.astype(np.int64),
+        "edges.feed_id": index.feed_ids.astype(np.int32),
+        "edges.first_seen": index.first_seen.astype(np.int64),
+        "edges.last_seen": index.last_seen.astype(np.int64),
+        "edges.source_confidence": feed_confidences[index.feed_ids],
+        "rows.ioc_id": index.row_ioc_ids.astype(np.int64),
+        "rows.edge": index.row_edges.astype(np.int64),
+    }
+
+    ioc_keys = index.keys if index.keys is not None else keys.ioc_keys(index.values)
+    key_order = np.argsort(ioc_keys, kind="stable")
+    sorted_keys = ioc_keys[key_order]
+    if (sorted_keys[1:] == sorted_keys[:-1]).any():
+        return arrays, False
+
+    arrays["iocs.key"] = ioc_keys
+    arrays["iocs.sorted_key"] = sorted_keys
+    arrays["iocs.key_order"] = key_order.astype(np.int64)
+    return arrays, True
+
+
+def write_snapshot(
+    path: str,
+    index: IocIndex,
+    feed_confidences: np.ndarray,
+    checksums: Dict[str, str],
+    whitelist_stamp=(),
+) -> None:
+    """
+    Store the engine state in the snapshot file next to the feeds:
+    magic, header length, JSON header (format version, feeds, checksums,
+    whitelist stamp and the dtype, shape and offset of every array) and
+    the raw arrays aligned to `ALIGNMENT` bytes. The file is replaced
+    atomically, processes mapping the previous one keep reading it
+    """
+    arrays, has_keys = snapshot_arrays(index, feed_confidences)
+
+    layout: Dict[str, Dict[str, Any]] = {}
+    size = 0
+    for name, array in arrays.items():
+        layout[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": size,
+        }
+        size = align(size + array.nbytes)
+
+    header = json.dumps(
+        {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "feed_names": index.feed_names.tolist(),
+            "checksums": checksums,
+            "whitelist_stamp": [list(item) for item in whitelist_stamp],
+            "has_keys": has_keys,
+            "arrays": layout,
+        }
+    ).encode("utf-8")
+    data_offset = align(len(SNAPSHOT_MAGIC) + 8 + len(header))
+
+    SNAPSHOT_PATH: str = os.path.join(path, SNAPSHOT_FILE)
+    with open(SNAPSHOT_PATH + ".tmp", "wb") as file:
+        file.write(SNAPSHOT_MAGIC)
+        file.write(struct.pack("<Q", len(header)))
+        file.write(header)
+        for name, array in arrays.items():
+            file.seek(data_offset + layout[name]["offset"])
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.truncate(data_offset + size)
+    os.replace(SNAPSHOT_PATH + ".tmp", SNAPSHOT_PATH)
+
+
+def read_header(file) -> Optional[Dict[str, Any]]:
+    """Header of the snapshot file, None if it is not a snapshot"""
+    if file.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+        return None
+    (length,) = struct.unpack("<Q", file.read(8))
+    header = json.loads(file.read(length).decode("utf-8"))
+    header["data_offset"] = align(len(SNAPSHOT_MAGIC) + 8 + length)
+    return header
+
+
+def load_snapshot(
+    path: str,
+    checksums: Optional[Dict[str, str]] = None,
+    whitelist_stamp=None,
+) -> Optional[Snapshot]:
+    """
+    Map the snapshot file read-only. None if there is no snapshot, it
+    has another format version or it has been built from other feeds
+    (`checksums`) or whitelist files (`whitelist_stamp`) than given
+    """
+    SNAPSHOT_PATH: str = os.path.join(path, SNAPSHOT_FILE)
+
+    if not os.path.isfile(SNAPSHOT_PATH):
+        return None
+
+    with open(SNAPSHOT_PATH, "rb") as file:
+        header = read_header(file)
+        if header is None or header["format_version"] != SNAPSHOT_FORMAT_VERSION:
+            return None
+        if checksums is not None and header["checksums"] != checksums:
+            return None
+        if whitelist_stamp is not None and header["whitelist_stamp"] != [
+            list(item) for item in whitelist_stamp
+        ]:
+            return None
+
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    arrays: Dict[str, np.ndarray] = {}
+    for name, spec in header["arrays"].items():
+        dtype, shape = np.dtype(spec["dtype"]), tuple(spec["shape"])
+        count = int(np.prod(shape))
+        if not count:
+            arrays[name] = np.empty(shape, dtype=dtype)
+            continue
+        arrays[name] = np.frombuffer(
+            mapped, dtype=dtype, count=count, offset=header["data_offset"] + spec["offset"]
+        ).reshape(shape)
+
+    values = PackedStrings(
+        arrays["iocs.value"], arrays["iocs.value_offsets"], arrays["iocs.value_missing"]
+    )
+    index = IocIndex(
+        feed_names=np.array(header["feed_names"], dtype=object),
+        # Without the keys IoCs are looked up by the values hash index,
+        # which needs them all decoded
+        values=values if header["has_keys"] else values.decode(),
+        indptr=arrays["iocs.indptr"],
+        feed_ids=arrays["edges.feed_id"],
+        first_seen=arrays["edges.first_seen"],
+        last_seen=arrays["edges.last_seen"],
+        row_ioc_ids=arrays["rows.ioc_id"],
+        row_edges=arrays["rows.edge"],
+        keys=arrays.get("iocs.key"),
+        sorted_keys=(
+            (arrays["iocs.sorted_key"], arrays["iocs.key_order"])
+            if header["has_keys"]
+            else None
+        ),
+    )
+
+    return Snapshot(
+        index,
+        arrays["feeds.source_confidence"],
+        arrays["edges.source_confidence"],
+        header["checksums"],
+        header["whitelist_stamp"],
+    )
@@ -1,12 +1,13 @@
 import calendar
-from typing import Any, Dict, List, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 from dateutil import parser
 import scoring_engine as engine
 
-from helpers import lookups
-from helpers.howlong import HowLong
+from helpers import lookups, profiler
+from helpers.index import IocIndex
 
 
 def date_to_unixtime(time: str) -> int:
@@ -22,55 +23,34 @@ def get_tqdm_instance(use_tqdm: bool):
         return lambda x: x
 
 
-def _calculate_iocs_statistics(
-    feed_list,
-    iocs_min_date: Dict[str, str],
-    iocs_feed_names: Dict[str, List[str]],
-    use_tqdm=True,
-):
+def _calculate_iocs_statistics(iocs_meta: pd.DataFrame) -> pd.DataFrame:
     """
     Function is intended for calculating overall iocs
     statistics, that will be needed for IoC scoring calculation.
 
         Params:
 
-            feed_list — CTI feeds dict with it names and dataframes.
+            iocs_meta — per-IoC metadata built by `_get_meta_data`.
 
         Returns:
 
             Calculated iocs statistics
     """
-    tqdm_instance = get_tqdm_instance(use_tqdm)
-
-    iocs_stats: List[Any] = []
-
     print("[STATISTICS] Started CTI iocs statistics recalculating...")
 
-    for feed in tqdm_instance(feed_list):
-        for row in feed["df"].itertuples(index=False):
-            value = row.value
-            iocs_stats.append(
-                (
-                    row.id,
-                    value,
-                    iocs_min_date[value],
-                    len(iocs_feed_names[value]),
-                    iocs_feed_names[value],
-                )
-            )
+    iocs_stats = pd.DataFrame(
+        {
+            "id": iocs_meta["id"].to_numpy(),
+            "value": iocs_meta.index.to_numpy(),
+            "min_first_seen": iocs_meta["min_first_seen"].to_numpy(),
+            "mentioned_in_count": iocs_meta["mentioned_in_count"].to_numpy(),
+        },
+        index=iocs_meta["row"].to_numpy(),
+    )
 
     print("[STATISTICS] IoCs statistics recalculated")
 
-    return pd.DataFrame(
-        iocs_stats,
-        columns=[
-            "id",
-            "value",
-            "min_first_seen",
-            "mentioned_in_count",
-            "feeds_ioc_mentioned_in",
-        ],
-    ).drop_duplicates(subset=["value"])
+    return iocs_stats
 
 
 def _calculate_feeds_statistics(
@@ -100,11 +80,13 @@ def _calculate_feeds_statistics(
     for feed in tqdm_instance(feed_list):
         feed_iocs_count = len(feed["df"].index)
 
-        extensiveness: float = engine.get_extensiveness_coef(feed["df"])
+        extensiveness: float = engine.get_extensiveness_coef_vectorized(feed["df"])
         completeness: float = engine.get_completeness_coef(
             feed_iocs_count, overall_iocs
         )
-        timeliness: float = engine.get_timeliness_coef(feed["df"], iocs_min_date)
+        timeliness: float = engine.get_timeliness_coef_vectorized(
+            feed["df"], iocs_min_date
+        )
         wl_overlap_coef: float = engine.get_whitelist_overlap_coef(feed["df"])
         source_confidence: float = engine.get_source_confidence(
             extensiveness, completeness, timeliness, wl_overlap_coef
@@ -127,34 +109,51 @@ def _calculate_feeds_statistics(
     return pd.DataFrame(feeds_stats)
 
 
-def _get_meta_data(cti_feeds, use_tqdm=True) -> Tuple[Any, Any]:
-    tqdm_instance = get_tqdm_instance(use_tqdm)
+def _get_meta_data(
+    cti_feeds, use_tqdm=True, index: Optional[IocIndex] = None
+) -> pd.DataFrame:
+    """
+    Function groups rows of all feeds by IoC value,
+    using the IoC-to-feed incidence index.
 
-    iocs_min_date: Dict[str, str] = dict()
-    iocs_feed_names: Dict[str, List[str]] = dict()
+        Returns:
 
-    for feed in tqdm_instance(cti_feeds):
-        for row in feed["df"].itertuples(index=False):
-            value = row.value
-            if value in iocs_min_date:
-                iocs_min_date[value] = min(iocs_min_date[value], row.first_seen)
-            else:
-                iocs_min_date[value] = row.first_seen
+            pandas.DataFrame indexed by unique IoC value (in order of
+            first appearance) with `id` and `row` (position across all
+            feeds) of the first occurrence, `min_first_seen` and
+            `mentioned_in_count`. Feeds the IoC was mentioned in stay
+            in the index arrays
+    """
+    tqdm_instance = get_tqdm_instance(use_tqdm)
+
+    if index is None:
+        index = IocIndex.from_feeds(cti_feeds)
 
-            if value in iocs_feed_names:
-                iocs_feed_names[value].append(feed["name"])
-            else:
-                iocs_feed_names[value] = [feed["name"]]
+    first_rows = index.first_rows
+    ids = np.concatenate(
+        [feed["df"]["id"].to_numpy(dtype=object) for feed in tqdm_instance(cti_feeds)]
+        or [np.array([], dtype=object)]
+    )
 
-    return iocs_min_date, iocs_feed_names
+    return pd.DataFrame(
+        {
+            "id": ids[first_rows],
+            "row": first_rows,
+            "min_first_seen": index.min_first_seen,
+            "mentioned_in_count": index.mentions,
+        },
+        index=pd.Index(index.values, name="value"),
+    )
 
 
+@profiler.profiled()
 def calculate_all_statistics(
-    cti_feeds: List[Dict[str, Any]], use_tqdm=True
+    cti_feeds: List[Dict[str, Any]], use_tqdm=True, index: Optional[IocIndex] = None
 ) -> Dict[str, Any]:
     """
     Wrapper for start calculating feeds and iocs stats simultaneosly
-    and write results into the files
+    and write results into the files. The IoC-to-feed index
+    can be shared with the scoring engine by passing it in
 
     TODO: Force recalculate stats in case when `functions.py` has
     been modified (formulas, constants, etc)
@@ -162,16 +161,18 @@ def calculate_all_statistics(
     result: Dict[str, Any] = {}
 
     try:
-        with HowLong("prepare of metadata"):
-            iocs_min_date, iocs_feed_names = _get_meta_data(cti_feeds, use_tqdm)
-        with HowLong("result['iocs']"):
-            result["iocs"] = _calculate_iocs_statistics(
-                cti_feeds, iocs_min_date, iocs_feed_names, use_tqdm=use_tqdm
-            )
-        with HowLong("result['feeds']"):
+        with profiler.span("prepare of metadata"):
+            if index is None:
+                index = IocIndex.from_feeds(cti_feeds)
+            iocs_meta = _get_meta_data(cti_feeds, use_tqdm, index=index)
+        with profiler.span("result['iocs']"):
+            result["iocs"] = _calculate_iocs_statistics(iocs_meta)
+        with profiler.span("result['feeds']"):
             result["feeds"] = _calculate_feeds_statistics(
-                cti_feeds, iocs_min_date, use_tqdm=use_tqdm
+                cti_feeds, iocs_meta["min_first_seen"], use_tqdm=use_tqdm
             )
+        result["index"] = index
+        result["membership"] = (index.indptr, index.feed_ids)
 
         return result
     except Exception as e:
@@ -0,0 +1,405 @@
+import math
+import os
+import shutil
+import tempfile
+from glob import glob
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import functions
+import scoring_engine as engine
+from helpers import io
+from helpers.index import factorize_iocs
+from helpers.partials import feeds_statistics
+
+# Upper bound of the memory the partitioned rows may take, bytes
+MEMORY_BUDGET: int = 256 * 2 ** 20
+# Rows read from a feed at once
+CHUNK_SIZE: int = 100_000
+# How many times a scored partition is bigger than its CSV text
+PARTITION_MEMORY_FACTOR: int = 4
+
+# Row columns kept for scoring, IoC values are packed separately
+ROW_COLUMNS: Dict[str, Any] = {
+    "feed": np.int32,  # feed position in the directory listing
+    "row": np.int64,  # row number within the feed
+    "first_seen": np.int64,
+    "last_seen": np.int64,
+}
+
+
+class RowsSpill:
+    """
+    Feed rows split into partitions by the IoC value hash, so all
+    mentions of the IoC are in the same partition. Rows are kept in
+    memory until they take more than `memory_budget` bytes, then all
+    buffered rows are written to `.npz` files in a temporary directory.
+
+    A partition read once can be put back factorized (see `store`),
+    later loads take it as is instead of reading its rows again
+    """
+
+    def __init__(
+        self,
+        partitions: int,
+        memory_budget: int = MEMORY_BUDGET,
+        spill_dir: Optional[str] = None,
+    ):
+        self.partitions = partitions
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.tmp_dir: Optional[str] = None
+        self.spills_count: int = 0
+
+        self._buffers: List[List[Dict[str, np.ndarray]]] = [
+            [] for _ in range(partitions)
+        ]
+        self._files: List[List[str]] = [[] for _ in range(partitions)]
+        self._buffered_bytes: int = 0
+        # Rows bytes of every partition, buffered and spilled
+        self._partition_bytes: List[int] = [0] * partitions
+        # Factorized partitions: rows in memory or the file with them
+        self._stored: Dict[int, Any] = {}
+        self._stored_bytes: int = 0
+
+    def append(self, feed_id: int, row_offset: int, chunk: pd.DataFrame) -> None:
+        """Split the feed chunk by partitions and buffer it"""
+        values = chunk["value"].to_numpy(dtype=object)
+        partition_ids = (
+            pd.util.hash_array(values) % np.uint64(self.partitions)
+        ).astype(np.int64)
+        columns = {
+            "feed": np.full(len(values), feed_id),
+            "row": row_offset + np.arange(len(values)),
+            "first_seen": chunk["first_seen"].to_numpy(),
+            "last_seen": chunk["last_seen"].to_numpy(),
+        }
+
+        order = np.argsort(partition_ids, kind="stable")
+        bounds = np.searchsorted(
+            partition_ids[order], np.arange(self.partitions + 1)
+        ).tolist()
+
+        for partition in range(self.partitions):
+            rows = order[bounds[partition] : bounds[partition + 1]]
+            if not len(rows):
+                continue
+
+            part = {
+                name: columns[name][rows].astype(dtype)
+                for name, dtype in ROW_COLUMNS.items()
+            }
+            part["value"], part["value_missing"] = io.encode_strings(values[rows])
+
+            part_bytes = sum(array.nbytes for array in part.values())
+            self._buffers[partition].append(part)
+            self._buffered_bytes += part_bytes
+            self._partition_bytes[partition] += part_bytes
+
+        if self._buffered_bytes > self.memory_budget:
+            self.spill()
+
+    def spill(self) -> None:
+        """Write all buffered rows to disk"""
+        if self.tmp_dir is None:
+            self.tmp_dir = tempfile.mkdtemp(prefix="iocs-stream-", dir=self.spill_dir)
+
+        for partition, buffer in enumerate(self._buffers):
+            if not buffer:
+                continue
+
+            filename = os.path.join(
+                self.tmp_dir, f"part-{partition:05d}-{self.spills_count:06d}.npz"
+            )
+            np.savez(
+                filename,
+                **{
+                    f"{i}.{name}": array
+                    for i, part in enumerate(buffer)
+                    for name, array in part.items()
+                },
+            )
+            self._files[partition].append(filename)
+            self._buffers[partition] = []
+
+        self._buffered_bytes = 0
+        self.spills_count += 1
+
+    def load(self, partition: int) -> Dict[str, np.ndarray]:
+        """
+        All rows of the partition, IoC values are unpacked. A stored
+        partition comes as it has been stored
+        """
+        stored = self._stored.get(partition)
+        if isinstance(stored, str):
+            with np.load(stored, allow_pickle=False) as file:
+                rows = {name: file[name] for name in file.files}
+            rows["values"] = io.decode_strings(
+                rows.pop("values"), rows.pop("values_missing")
+            )
+            return rows
+        if stored is not None:
+            return stored
+
+        parts: List[Dict[str, np.ndarray]] = []
+
+        for filename in self._files[partition]:
+            with np.load(filename, allow_pickle=False) as stored:
+                parts_count = len(stored.files) // (len(ROW_COLUMNS) + 2)
+                for i in range(parts_count):
+                    parts.append(
+                        {
+                            name: stored[f"{i}.{name}"]
+                            for name in [*ROW_COLUMNS, "value", "value_missing"]
+                        }
+                    )
+        parts.extend(self._buffers[partition])
+
+        rows: Dict[str, np.ndarray] = {
+            name: np.concatenate(
+                [part[name] for part in parts] or [np.array([], dtype=dtype)]
+            )
+            for name, dtype in ROW_COLUMNS.items()
+        }
+        rows["value"] = np.concatenate(
+            [io.decode_strings(part["value"], part["value_missing"]) for part in parts]
+            or [np.array([], dtype=object)]
+        )
+
+        return rows
+
+    def store(self, partition: int, rows: Dict[str, np.ndarray]) -> None:
+        """
+        Put the factorized rows of the partition (`code` of every row and
+        distinct `values`) in the place of its buffered and spilled rows.
+        They are kept in memory while the stored partitions fit into the
+        memory budget, otherwise they are written to a single file
+        """
+        for filename in self._files[partition]:
+            os.remove(filename)
+        self._files[partition] = []
+        self._buffered_bytes -= sum(
+            array.nbytes for part in self._buffers[partition] for array in part.values()
+        )
+        self._buffers[partition] = []
+
+        rows_bytes = self._partition_bytes[partition]
+        if self._stored_bytes + rows_bytes <= self.memory_budget:
+            self._stored[partition] = rows
+            self._stored_bytes += rows_bytes
+            return
+
+        if self.tmp_dir is None:
+            self.tmp_dir = tempfile.mkdtemp(prefix="iocs-stream-", dir=self.spill_dir)
+        filename = os.path.join(self.tmp_dir, f"part-{partition:05d}-stored.npz")
+        values, values_missing = io.encode_strings(rows["values"])
+        np.savez(
+            filename,
+            values=values,
+            values_missing=values_missing,
+            **{name: array for name, array in rows.items() if name != "values"},
+        )
+        self._stored[partition] = filename
+
+    def cleanup(self) -> None:
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            self.tmp_dir = None
+        self._stored.clear()
+
+
+def get_partitions_count(
+    filenames: List[str], memory_budget: int = MEMORY_BUDGET
+) -> int:
+    """
+    Number of partitions such that a single partition
+    being scored fits into the memory budget
+    """
+    total_size = sum(os.path.getsize(filename) for filename in filenames)
+    return max(1, math.ceil(total_size * PARTITION_MEMORY_FACTOR / memory_budget))
+
+
+def factorize_partition(rows: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Rows of the partition with IoC `code` of every row and distinct
+    `values` instead of the value of every row, see `factorize_iocs`
+    """
+    factorized = {name: rows[name] for name in ROW_COLUMNS}
+    factorized["code"], factorized["values"] = factorize_iocs(rows["value"])
+    return factorized
+
+
+def _partition_sigmas(rows: Dict[str, np.ndarray], feeds_count: int) -> np.ndarray:
+    """
+    Timeliness sigma contribution of the factorized partition IoCs
+    to every feed, see `functions.timeliness_sigmas`
+    """
+    codes = rows["code"]
+    min_first_seen = np.full(len(rows["values"]), np.iinfo(np.int64).max)
+    np.minimum.at(min_first_seen, codes, rows["first_seen"])
+
+    return functions.timeliness_sigmas(
+        rows["feed"],
+        min_first_seen[codes],
+        1 / rows["first_seen"].astype(np.float64),
+        feeds_count,
+    )
+
+
+def _score_partition(
+    rows: Dict[str, np.ndarray],
+    feed_names: List[str],
+    feed_confidences: np.ndarray,
+    dt_now: float,
+    min_score: Optional[int] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Function scores IoCs of the factorized partition the same way
+    `engine._calculate_iocs_score_batch` does for the whole dataset,
+    yields the scored rows (with score >= `min_score` if set) ordered
+    by feed and row within the feed
+    """
+    codes, values = rows["code"], rows["values"]
+
+    # Mentions of the IoC are ordered like the feeds rows
+    edges = np.lexsort((rows["row"], rows["feed"], codes))
+    edge_ioc_ids = codes[edges]
+    edge_confidences = feed_confidences[rows["feed"][edges]]
+    last_seens = rows["last_seen"][edges]
+    feeds_scores = engine.get_decay_coefs(
+        np.where(last_seens == 0, dt_now, last_seens), dt_now
+    )
+
+    x = np.bincount(
+        edge_ioc_ids,
+        weights=edge_confidences ** 2 * feeds_scores,
+        minlength=len(values),
+    )
+    y = np.bincount(edge_ioc_ids, weights=edge_confidences, minlength=len(values))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        final_scores = np.where(y > 0, np.rint(x / y * 100), 0).astype(np.int64)
+
+    indptr = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=len(values)), out=indptr[1:])
+
+    bounds = indptr.tolist()
+    confidences_list = edge_confidences.tolist()
+    feeds_scores_list = np.rint(feeds_scores * 100).astype(np.int64).tolist()
+    final_scores_list = final_scores.tolist()
+
+    order = np.lexsort((rows["row"], rows["feed"]))
+    if min_score is not None:
+        order = order[final_scores[codes[order]] >= min_score]
+    ioc_ids_list = codes[order].tolist()
+    feeds_list = rows["feed"][order].tolist()
+    values_list = values[codes[order]].tolist()
+    first_seens = engine.format_dates(rows["first_seen"][order])
+    last_seens_str = engine.format_dates(rows["last_seen"][order])
+
+    for i, ioc_id in enumerate(ioc_ids_list):
+        start, end = bounds[ioc_id], bounds[ioc_id + 1]
+        yield {
+            "feed_name": feed_names[feeds_list[i]],
+            "value": values_list[i],
+            "score": final_scores_list[ioc_id],
+            "first_seen": first_seens[i],
+            "last_seen": last_seens_str[i],
+            "ioc_mentions": end - start,
+            "source_confidences": confidences_list[start:end],
+            "feeds_scores": feeds_scores_list[start:end],
+        }
+
+
+def stream_iocs_score(
+    cti_feeds_path: str,
+    dt_now: float,
+    memory_budget: int = MEMORY_BUDGET,
+    chunksize: int = CHUNK_SIZE,
+    partitions: Optional[int] = None,
+    spill_dir: Optional[str] = None,
+    min_score: Optional[int] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Function scores feeds which don't fit into memory. Feeds are read
+    by chunks and their rows are partitioned by the IoC value hash
+    (spilled to disk when the rows exceed the memory budget), then
+    partitions are scored one by one. Peak memory is bounded by
+    the memory budget and the chunk size, not by the dataset size.
+
+        Parameters:
+
+            cti_feeds_path (str) — path to the directory with the CTI feeds
+            dt_now (float) — unixtime means current time
+            memory_budget (int) — bytes the buffered rows may take
+            chunksize (int) — rows read from a feed at once
+            partitions (int) — number of partitions, by default
+            derived from the feeds size and the memory budget
+            spill_dir (str) — directory for the temporary files,
+            system default if not set
+            min_score (int) — lowest score of the yielded rows, 0..100
+
+        Returns:
+
+            Generator of scored rows, the same dicts as in `score_data`
+            of `engine.calculate_iocs_score` plus `feed_name`. Rows are
+            ordered by partition, then by feed and row within the feed
+    """
+    EXTENSIVENESS_PARAM_COUNT: int = 3  # Extensiveness parameters count
+    filenames = glob(f"{cti_feeds_path}/*.csv")
+    feed_names = [os.path.basename(filename) for filename in filenames]
+
+    if partitions is None:
+        partitions = get_partitions_count(filenames, memory_budget)
+
+    spill = RowsSpill(partitions, memory_budget, spill_dir)
+    feed_sizes = np.zeros(len(filenames), dtype=np.int64)
+    sums_extensiveness = np.zeros(len(filenames), dtype=np.float64)
+    wl_overlaps = np.zeros(len(filenames), dtype=np.float64)
+    feed_whitelist = engine.get_whitelist()
+
+    try:
+        for feed_id, filename in enumerate(filenames):
+            wl_iocs = 0
+            for chunk in io.iter_feed_chunks(filename, chunksize):
+                wl_iocs += feed_whitelist.overlap(chunk["value"])
+                sums_extensiveness[feed_id] += functions.ioc_extensiveness_array(
+                    EXTENSIVENESS_PARAM_COUNT,
+                    chunk["last_seen"].to_numpy() != 0,
+                    chunk["relationship_count"].to_numpy() > 0,
+                    chunk["detections_count"].to_numpy() > 0,
+                ).sum()
+                spill.append(feed_id, int(feed_sizes[feed_id]), chunk)
+                feed_sizes[feed_id] += len(chunk.index)
+
+            wl_overlaps[feed_id] = functions.whitelist_overlap_score(
+                wl_iocs, int(feed_sizes[feed_id])
+            )
+
+        # Every partition is read and factorized once, the scoring
+        # pass below takes it back from the spill as is
+        sigmas = np.zeros(len(filenames), dtype=np.float64)
+        for partition in range(partitions):
+            rows = factorize_partition(spill.load(partition))
+            sigmas += _partition_sigmas(rows, len(filenames))
+            spill.store(partition, rows)
+            del rows
+
+        feeds_stats = feeds_statistics(
+            np.array(feed_names, dtype=object),
+            feed_sizes,
+            sums_extensiveness,
+            sigmas,
+            wl_overlaps,
+        )
+        feed_confidences = feeds_stats["feed_source_confidence"].to_numpy(
+            dtype=np.float64
+        )
+
+        for partition in range(partitions):
+            yield from _score_partition(
+                spill.load(partition), feed_names, feed_confidences, dt_now, min_score
+            )
+    finally:
+        spill.cleanup()
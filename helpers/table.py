@@ -0,0 +1,270 @@
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from helpers.index import IocIndex
+
+# Columns of the scored rows, in the order of the output records
+ROW_COLUMNS: List[str] = ["value", "score", "first_seen", "last_seen", "ioc_mentions"]
+
+
+def format_dates(timestamps: np.ndarray) -> np.ndarray:
+    """
+    Function formats unixtime values as `%Y-%m-%d` strings in UTC, the
+    zone feed dates are parsed in: every distinct timestamp is formatted
+    once, the strings are gathered to the timestamps positions with
+    a single array take
+    """
+    uniques, inverse = np.unique(np.asarray(timestamps), return_inverse=True)
+    formatted = np.array(
+        [
+            datetime.utcfromtimestamp(ts).strftime("%Y-%m-%d")
+            for ts in uniques.tolist()
+        ],
+        dtype="U10",
+    )
+    return formatted[inverse]
+
+
+class ScoreTable:
+    """
+    Columnar scoring result: one array per output column instead of
+    a dict per row. The per-mention explanation of the row (source
+    confidences and single feed scores of every feed the IoC is
+    mentioned in) is not copied into the row, rows keep the offset
+    and length of their IoC mentions in the flat explanation arrays,
+    which hold every mentioned IoC once.
+
+    Rows are grouped by feed, rows of the feed `i` are
+    `feed_offsets[i]:feed_offsets[i + 1]`.
+
+        Attributes:
+
+            feed_names (numpy.ndarray) — feed name by feed position
+            feed_offsets (numpy.ndarray) — rows offsets, len(feed_names) + 1
+            value, score, first_seen, last_seen, ioc_mentions
+            (numpy.ndarray) — per row columns, dates as `%Y-%m-%d`
+            mentions_offset (numpy.ndarray) — per row offset of the IoC
+            mentions in `source_confidences` and `feeds_scores`
+            source_confidences, feeds_scores (numpy.ndarray) — flat
+            explanation arrays, feeds scores are 0..100
+    """
+
+    def __init__(
+        self,
+        feed_names: np.ndarray,
+        feed_offsets: np.ndarray,
+        columns: Dict[str, np.ndarray],
+        mentions_offset: np.ndarray,
+        source_confidences: np.ndarray,
+        feeds_scores: np.ndarray,
+    ):
+        self.feed_names = feed_names
+        self.feed_offsets = feed_offsets
+        self.columns = columns
+        self.mentions_offset = mentions_offset
+        self.source_confidences = source_confidences
+        self.feeds_scores = feeds_scores
+
+    @classmethod
+    def from_index(
+        cls,
+        index: IocIndex,
+        final_scores: np.ndarray,
+        edge_confidences: np.ndarray,
+        feeds_scores: np.ndarray,
+        rows: Optional[np.ndarray] = None,
+        feed_names: Optional[np.ndarray] = None,
+        feed_sizes: Optional[np.ndarray] = None,
+    ) -> "ScoreTable":
+        """
+        Table of the feeds rows (positions across all feeds
+        concatenated), all rows by default. Only mentions of the IoCs
+        of these rows are gathered into the explanation arrays
+
+            Parameters:
+
+                index (IocIndex) — index the scores are calculated over
+                final_scores (numpy.ndarray) — final score by IoC id
+                edge_confidences, feeds_scores (numpy.ndarray) — source
+                confidence and single feed score (0..1) by edge
+                rows (numpy.ndarray) — rows of the table grouped by feed
+                feed_names, feed_sizes — feeds of the rows and number of
+                the rows of every feed, the index feeds by default
+        """
+        if rows is None:
+            rows = np.arange(len(index.row_ioc_ids))
+        if feed_names is None:
+            feed_names = index.feed_names
+            feed_sizes = np.bincount(index.feed_ids, minlength=len(feed_names))
+
+        ioc_ids = index.row_ioc_ids[rows]
+        unique_ids, positions = np.unique(ioc_ids, return_inverse=True)
+
+        starts = index.indptr[unique_ids]
+        counts = index.indptr[unique_ids + 1] - starts
+        offsets = np.cumsum(counts) - counts
+        edges = np.arange(counts.sum()) + np.repeat(starts - offsets, counts)
+
+        row_edges = index.row_edges[rows]
+
+        return cls(
+            feed_names=np.asarray(feed_names, dtype=object),
+            feed_offsets=np.concatenate(([0], np.cumsum(feed_sizes))).astype(np.int64),
+            columns={
+                "value": index.values[ioc_ids],
+                "score": np.asarray(final_scores, dtype=np.int64)[ioc_ids],
+                "first_seen": format_dates(index.first_seen[row_edges]),
+                "last_seen": format_dates(index.last_seen[row_edges]),
+                "ioc_mentions": counts[positions].astype(np.int64),
+            },
+            mentions_offset=offsets[positions].astype(np.int64),
+            source_confidences=edge_confidences[edges],
+            feeds_scores=np.rint(feeds_scores[edges] * 100).astype(np.int64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.mentions_offset)
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.columns[column]
+
+    @property
+    def feed_name(self) -> pd.Categorical:
+        """Feed name of every row"""
+        return pd.Categorical.from_codes(
+            np.repeat(np.arange(len(self.feed_names)), np.diff(self.feed_offsets)),
+            categories=pd.Index(self.feed_names, dtype=object),
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        DataFrame with a row per table row: feed name (categorical),
+        row columns and the `mentions_offset` into the explanation arrays
+        """
+        return pd.DataFrame(
+            {
+                "feed_name": self.feed_name,
+                **self.columns,
+                "mentions_offset": self.mentions_offset,
+            }
+        )
+
+    def records(self, start: int = 0, stop: Optional[int] = None) -> List[Dict]:
+        """Output records of the rows `start:stop`, see `engine.calculate_iocs_score`"""
+        rows = slice(start, len(self) if stop is None else stop)
+        offsets = self.mentions_offset[rows]
+        counts = self.columns["ioc_mentions"][rows]
+
+        # Mentions of the rows gathered into one contiguous block,
+        # converted to Python objects at once
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        mentions = np.arange(bounds[-1]) + np.repeat(offsets - bounds[:-1], counts)
+        confidences_list = self.source_confidences[mentions].tolist()
+        feeds_scores_list = self.feeds_scores[mentions].tolist()
+
+        records: List[Dict] = []
+        for value, score, first_seen, last_seen, count, bound in zip(
+            *(self.columns[column][rows].tolist() for column in ROW_COLUMNS),
+            bounds.tolist(),
+        ):
+            records.append(
+                {
+                    "value": value,
+                    "score": score,
+                    "first_seen": first_seen,
+                    "last_seen": last_seen,
+                    "ioc_mentions": count,
+                    "source_confidences": confidences_list[bound : bound + count],
+                    "feeds_scores": feeds_scores_list[bound : bound + count],
+                }
+            )
+
+        return records
+
+    def iter_feeds(self, block_size: Optional[int] = None) -> Iterator[Any]:
+        """
+        Yield (feed name, records) for every feed, or for every
+        `block_size` rows of the feed if the block size is given
+        """
+        offsets = self.feed_offsets.tolist()
+        for i, feed_name in enumerate(self.feed_names.tolist()):
+            start, end = offsets[i], offsets[i + 1]
+            step = block_size or max(end - start, 1)
+            for block_start in range(start, max(end, start + 1), step):
+                yield feed_name, self.records(block_start, min(block_start + step, end))
+
+    def to_feeds(self) -> List[Dict]:
+        """List-of-dicts result of `engine.calculate_iocs_score`"""
+        return [
+            {"feed_name": feed_name, "score_data": records}
+            for feed_name, records in self.iter_feeds()
+        ]
+
+
+def unique_records(
+    index: IocIndex,
+    final_scores: np.ndarray,
+    edge_confidences: np.ndarray,
+    feeds_scores: np.ndarray,
+    ioc_ids: np.ndarray,
+) -> List[Dict]:
+    """
+    Function builds one output record per IoC straight from the IoC
+    arrays of the index, however many feeds the IoC is mentioned in:
+    the earliest `first_seen` and the latest `last_seen` across the
+    feeds, names of the feeds and the per-feed explanation
+
+        Parameters:
+
+            index (IocIndex) — index the scores are calculated over
+            final_scores (numpy.ndarray) — final score by IoC id
+            edge_confidences, feeds_scores (numpy.ndarray) — source
+            confidence and single feed score (0..1) by edge
+            ioc_ids (numpy.ndarray) — IoCs of the records
+
+        Returns:
+
+            List of {"value", "score", "first_seen", "last_seen",
+            "ioc_mentions", "feeds", "source_confidences", "feeds_scores"}
+    """
+    starts = index.indptr[ioc_ids]
+    counts = index.indptr[ioc_ids + 1] - starts
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+    edges = np.arange(bounds[-1]) + np.repeat(starts - bounds[:-1], counts)
+
+    # Every IoC has at least one edge, edges of the IoC are contiguous
+    first_seens = last_seens = np.array([], dtype=np.int64)
+    if len(ioc_ids):
+        first_seens = np.minimum.reduceat(index.first_seen[edges], bounds[:-1])
+        last_seens = np.maximum.reduceat(index.last_seen[edges], bounds[:-1])
+
+    feed_names = index.feed_names[index.feed_ids[edges]].tolist()
+    confidences_list = edge_confidences[edges].tolist()
+    feeds_scores_list = np.rint(feeds_scores[edges] * 100).astype(np.int64).tolist()
+
+    records: List[Dict] = []
+    for value, score, first_seen, last_seen, start, end in zip(
+        index.values[ioc_ids].tolist(),
+        np.asarray(final_scores, dtype=np.int64)[ioc_ids].tolist(),
+        format_dates(first_seens).tolist(),
+        format_dates(last_seens).tolist(),
+        bounds[:-1].tolist(),
+        bounds[1:].tolist(),
+    ):
+        records.append(
+            {
+                "value": value,
+                "score": score,
+                "first_seen": first_seen,
+                "last_seen": last_seen,
+                "ioc_mentions": end - start,
+                "feeds": feed_names[start:end],
+                "source_confidences": confidences_list[start:end],
+                "feeds_scores": feeds_scores_list[start:end],
+            }
+        )
+
+    return records
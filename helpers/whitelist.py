@@ -0,0 +1,289 @@
+import csv
+import hashlib
+import ipaddress
+import json
+import os
+import socket
+from glob import glob
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# MISP warning-list types which are matched by exact value or range,
+# `substring` and `regex` lists are not supported
+MISP_LIST_TYPES: Tuple[str, ...] = ("string", "hostname", "cidr")
+
+# IPv4 addresses are keyed as IPv4-mapped IPv6 ones, so that both
+# families share one 16-byte big-endian key space
+IPV4_MAPPED_PREFIX: bytes = b"\x00" * 10 + b"\xff\xff"
+IP_KEY_DTYPE: str = "S16"
+# Values which may be IP addresses: dotted quads and hex groups with
+# colons (hashes are hex too, but have neither dots nor colons)
+IP_CANDIDATE_PATTERN: str = (
+    r"(?:\d{1,3}(?:\.\d{1,3}){3}|[0-9A-Fa-f]{0,4}:[0-9A-Fa-f:.]*)$"
+)
+# Dotted quads `inet_pton` accepts: octets up to 255, no leading zeros
+IPV4_OCTET_PATTERN: str = r"(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)"
+IPV4_PATTERN: str = rf"{IPV4_OCTET_PATTERN}(?:\.{IPV4_OCTET_PATTERN}){{3}}$"
+
+# Loaded whitelists by path, reloaded when the files change
+_loaded: Dict[str, Tuple[Tuple, "Whitelist"]] = {}
+
+
+def normalize_values(values) -> np.ndarray:
+    """Whitelist matching is case-insensitive and ignores surrounding spaces"""
+    return (
+        pd.Series(values, dtype=object).astype(str).str.strip().str.lower().to_numpy()
+    )
+
+
+def hash_values(values) -> np.ndarray:
+    """
+    Stable 64-bit hashes of the normalized values (SipHash with the
+    fixed pandas key, so the same across runs and processes)
+    """
+    normalized = normalize_values(values)
+    if not len(normalized):
+        return np.array([], dtype=np.uint64)
+    return pd.util.hash_array(normalized.astype(object), categorize=False)
+
+
+def ip_key(address) -> bytes:
+    """16-byte key of the IPv4 or IPv6 address"""
+    if address.version == 4:
+        return IPV4_MAPPED_PREFIX + address.packed
+    return address.packed
+
+
+def ipv4_keys(addresses: List[str]) -> np.ndarray:
+    """
+    Keys of the valid IPv4 addresses (see `IPV4_PATTERN`), the
+    octets of all addresses are parsed by one numpy cast
+    """
+    keys = np.zeros((len(addresses), 16), dtype=np.uint8)
+    keys[:, 10:12] = 0xFF
+    if addresses:
+        octets = np.array(".".join(addresses).split("."))
+        keys[:, 12:] = octets.astype(np.uint8).reshape(-1, 4)
+    return keys.view(IP_KEY_DTYPE).ravel()
+
+
+def ip_keys(values) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Keys of the values which are IP addresses. Candidates are picked
+    by a vectorized `IP_CANDIDATE_PATTERN` match, IPv4 addresses are
+    validated by `IPV4_PATTERN` and parsed at once, only IPv6
+    candidates are parsed one by one (`inet_pton`)
+
+        Returns:
+
+            Positions of the IP addresses in values and their keys
+    """
+    values = pd.Series(values, dtype=object).reset_index(drop=True)
+    candidates = values[values.str.match(IP_CANDIDATE_PATTERN, na=False)]
+
+    is_ipv6 = candidates.str.contains(":", regex=False).to_numpy(dtype=bool)
+    ipv4 = candidates[~is_ipv6]
+    ipv4 = ipv4[ipv4.str.match(IPV4_PATTERN).to_numpy(dtype=bool)]
+
+    ipv6_positions: List[int] = []
+    ipv6_keys: List[bytes] = []
+    ipv6 = candidates[is_ipv6]
+    for position, value in zip(ipv6.index.tolist(), ipv6.tolist()):
+        try:
+            ipv6_keys.append(socket.inet_pton(socket.AF_INET6, value))
+        except OSError:
+            continue
+        ipv6_positions.append(position)
+
+    positions = np.concatenate(
+        (ipv4.index.to_numpy(dtype=np.int64), np.array(ipv6_positions, dtype=np.int64))
+    )
+    keys = np.concatenate(
+        (ipv4_keys(ipv4.tolist()), np.array(ipv6_keys, dtype=IP_KEY_DTYPE))
+    )
+    order = np.argsort(positions, kind="stable")
+
+    return positions[order], keys[order]
+
+
+def parse_network(entry: str):
+    """IP network of the entry (CIDR or single address), None for other entries"""
+    if not entry or not (entry[0].isdigit() or ":" in entry):
+        return None
+    try:
+        return ipaddress.ip_network(entry, strict=False)
+    except ValueError:
+        return None
+
+
+def merge_ranges(
+    ranges: List[Tuple[bytes, bytes]]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Sorted disjoint (start, end) ranges covering the given inclusive ranges"""
+    merged: List[List[bytes]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    return (
+        np.array([start for start, _ in merged], dtype=IP_KEY_DTYPE),
+        np.array([end for _, end in merged], dtype=IP_KEY_DTYPE),
+    )
+
+
+def read_entries(filename: str) -> List[str]:
+    """
+    Read the whitelist file:
+
+        * `.json` — MISP warning-list, entries of its `list`
+          (lists of unsupported types are skipped)
+        * `.csv` — last column of every row, e.g. `rank,domain`
+          top-domain lists
+        * anything else — one entry per line, `#` starts a comment
+    """
+    with open(filename, "r", encoding="utf-8", errors="replace") as file:
+        if filename.endswith(".json"):
+            warninglist = json.load(file)
+            if warninglist.get("type", "string") not in MISP_LIST_TYPES:
+                return []
+            return [str(entry) for entry in warninglist.get("list", [])]
+
+        if filename.endswith(".csv"):
+            return [row[-1] for row in csv.reader(file) if row]
+
+        return [
+            line.split("#", 1)[0].strip()
+            for line in file
+            if line.split("#", 1)[0].strip()
+        ]
+
+
+class Whitelist:
+    """
+    Well-known benign values (top domains, MISP warning-lists, CIDR
+    ranges) packed for vectorized membership tests:
+
+        * exact values — sorted unique 64-bit hashes of the normalized
+          values, looked up with `np.searchsorted` (a false positive
+          needs a 64-bit hash collision)
+        * IP ranges — sorted disjoint inclusive ranges of 16-byte
+          keys, single addresses are ranges of one address. An IoC
+          is in the ranges if it is not above the end of the last
+          range starting at or below it
+    """
+
+    def __init__(self, hashes: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+        self.hashes = hashes
+        self.starts = starts
+        self.ends = ends
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[str]) -> "Whitelist":
+        values: List[str] = []
+        ranges: List[Tuple[bytes, bytes]] = []
+
+        for entry in entries:
+            entry = entry.strip()
+            network = parse_network(entry)
+            if network is None:
+                values.append(entry)
+            else:
+                ranges.append(
+                    (ip_key(network.network_address), ip_key(network.broadcast_address))
+                )
+
+        return cls(np.unique(hash_values(values)), *merge_ranges(ranges))
+
+    @classmethod
+    def load(cls, path: str) -> "Whitelist":
+        """Whitelist of the file or of all files in the directory"""
+        if os.path.isdir(path):
+            filenames = sorted(
+                filename
+                for filename in glob(os.path.join(path, "*"))
+                if os.path.isfile(filename)
+            )
+        elif os.path.isfile(path):
+            filenames = [path]
+        else:
+            filenames = []
+
+        entries: List[str] = []
+        for filename in filenames:
+            entries.extend(read_entries(filename))
+
+        return cls.from_entries(entries)
+
+    def __len__(self) -> int:
+        return len(self.hashes) + len(self.starts)
+
+    @property
+    def fingerprint(self) -> str:
+        """Checksum of the whitelist content"""
+        md5 = hashlib.md5()
+        for array in (self.hashes, self.starts, self.ends):
+            md5.update(np.ascontiguousarray(array).tobytes())
+        return md5.hexdigest()
+
+    def contains(self, values) -> np.ndarray:
+        """Boolean mask of the whitelisted values, missing values are not"""
+        values = pd.Series(values, dtype=object)
+        result = np.zeros(len(values), dtype=bool)
+        if not len(self) or not len(values):
+            return result
+
+        present = values.notna().to_numpy()
+
+        if len(self.hashes):
+            hashes = hash_values(values[present])
+            positions = np.searchsorted(self.hashes, hashes)
+            found = self.hashes[np.minimum(positions, len(self.hashes) - 1)] == hashes
+            result[np.flatnonzero(present)[found]] = True
+
+        if len(self.starts):
+            positions, keys = ip_keys(values)
+            ranges = np.searchsorted(self.starts, keys, side="right") - 1
+            inside = (ranges >= 0) & (keys <= self.ends[np.maximum(ranges, 0)])
+            result[positions[inside]] = True
+
+        return result
+
+    def overlap(self, values) -> int:
+        """Number of the whitelisted values"""
+        return int(self.contains(values).sum())
+
+
+def files_stamp(path: Optional[str]) -> Tuple:
+    """Name, modification time and size of every whitelist file of the path"""
+    if not path:
+        return ()
+
+    filenames = (
+        sorted(glob(os.path.join(path, "*"))) if os.path.isdir(path) else [path]
+    )
+    return tuple(
+        (filename, os.stat(filename).st_mtime_ns, os.stat(filename).st_size)
+        for filename in filenames
+        if os.path.isfile(filename)
+    )
+
+
+def get_whitelist(path: Optional[str]) -> Whitelist:
+    """
+    Whitelist of the path, loaded once and reloaded only when
+    the files in it are added, removed or modified
+    """
+    if not path:
+        return Whitelist.from_entries([])
+
+    stamp = files_stamp(path)
+    if path not in _loaded or _loaded[path][0] != stamp:
+        if not stamp:
+            print(f"[WHITELIST] No whitelist files at {path}, nothing is whitelisted")
+        _loaded[path] = (stamp, Whitelist.load(path))
+
+    return _loaded[path][1]
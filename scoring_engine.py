@@ -1,17 +1,55 @@
+import os
 import time
 from datetime import datetime
-from typing import List, Dict, Tuple, Union, Any
-from random import randint
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple, Union, Any
 
+import numpy as np
 from pandas import DataFrame, Series
 
 import functions
-from helpers import io, lookups, stats
-from helpers.howlong import HowLong
-from helpers.integrity_checker import is_modified
+from helpers import (
+    io,
+    lookups,
+    partials,
+    profiler,
+    rescoring,
+    selection,
+    snapshot,
+    stats,
+    streaming,
+    table,
+    whitelist,
+)
+from helpers.index import IocIndex
+from helpers.query import IocScorer
+from helpers.table import ScoreTable
+from helpers.integrity_checker import feeds_checksums
 
 DECAY_RATE: float = 0.5
 DECAY_TTL: int = 10
+# Rows of output records built at once by `iter_iocs_score_rows`
+RECORDS_BLOCK_SIZE: int = 10_000
+# Whitelist files (top domains lists, MISP warning-lists, CIDR ranges),
+# a directory or a single file, see `whitelist.read_entries`. The
+# shipped `whitelists` directory is empty, the lists are put there
+WHITELISTS_PATH: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "whitelists"
+)
+# Group and join IoCs by their 64-bit keys instead of the values,
+# see `helpers.keys`
+HASHED_IOC_KEYS: bool = False
+# Keep the scoring state next to the feeds, read only the changed feeds
+# and re-score only IoCs affected by the changes since the previous
+# run, see `_incremental_scores`
+INCREMENTAL_SCORES: bool = False
+# Worker processes calculating the aggregates of the changed feeds,
+# one feed per task, in the current process if not set, see
+# `helpers.parallel`. Reading the feeds and the statistics over all
+# feeds are not parallelized
+PROCESSES: Optional[int] = None
+# Reuse the memory-mapped engine snapshot of unchanged feeds for point
+# queries, see `helpers.snapshot`
+USE_SNAPSHOT: bool = True
 
 
 def get_tqdm_instance(use_tqdm: bool):
@@ -100,30 +138,83 @@ def get_timeliness_coef(cti_feed: DataFrame, iocs_min_date) -> float:
     return functions.timeliness(sigma, curr_feed_len)
 
 
-def get_whitelist_overlap_coef(cti_feed: DataFrame) -> float:
+def get_extensiveness_coef_vectorized(cti_feed: DataFrame) -> float:
+    """
+    Function calculates the extensiveness for the specified
+    feed in one pass over its columns, see `get_extensiveness_coef`
+
+        Parameters:
+
+            cti_feed (pandas.DataFrame) — CTI feed as pandas.DataFrame
+
+        Returns:
+
+            Extensiveness coefficient (float, 0..1)
+    """
+    EXTENSIVENESS_PARAM_COUNT: int = 3  # Extensiveness parameters count
+    feed_len: int = len(cti_feed.index)
+
+    iocs_extensiveness = functions.ioc_extensiveness_array(
+        EXTENSIVENESS_PARAM_COUNT,
+        cti_feed["last_seen"].to_numpy() != 0,
+        cti_feed["relationship_count"].to_numpy() > 0,
+        cti_feed["detections_count"].to_numpy() > 0,
+    )
+    return functions.extensiveness(float(iocs_extensiveness.sum()), feed_len)
+
+
+def get_timeliness_coef_vectorized(cti_feed: DataFrame, iocs_min_date) -> float:
+    """
+    Function calculates timeliness factor for given pandas
+    dataframe in one pass over its columns, see `get_timeliness_coef`
+
+        Parameters:
+
+            cti_feed (pandas.DataFrame) — CTI feed as pandas.DataFrame
+            iocs_min_date (dict or pandas.Series) — min `first_seen`
+            across all feeds for each IoC value
+
+        Returns:
+
+            Timeliness coefficient (float, 0..1)
+    """
+    feed_len: int = len(cti_feed.index)
+    min_first_seen = cti_feed["value"].map(iocs_min_date).to_numpy(dtype=np.float64)
+    sigma: float = functions.timeliness_sigma_array(
+        min_first_seen, cti_feed["first_seen"].to_numpy(dtype=np.float64)
+    )
+
+    return functions.timeliness(sigma, feed_len)
+
+
+def get_whitelist() -> whitelist.Whitelist:
+    """Whitelist of `WHITELISTS_PATH`, empty if there are no whitelist files"""
+    return whitelist.get_whitelist(WHITELISTS_PATH)
+
+
+def get_whitelist_overlap_coef(
+    cti_feed: DataFrame, feed_whitelist: Optional[whitelist.Whitelist] = None
+) -> float:
     """
     Function calculates whitelist overlapping ratio
     The higher ratio = the better feed quality
 
-    NOTE: THIS FUNCTION IS A MOCK NOW, JUST FOR
-    TESTING REASONS
+        Parameters:
 
-    TODO: Make working version of function.
-    Params: dataframe with CTIfeed, dataframe
-    with WL feed.
+            cti_feed (pandas.DataFrame) — CTI feed as pandas.DataFrame
+            feed_whitelist (Whitelist) — well-known benign values,
+            `get_whitelist()` if not set
 
-    Function calculates overlap between CTI & WL
-    feeds, calculates CTI feed lenght -> send this
-    calcutaions as parameters to
+        Returns:
 
-    Returns: functions.whitelist_overlap_score()
+            Whitelist overlap coefficient (float, 0..1),
+            see `functions.whitelist_overlap_score`
     """
+    if feed_whitelist is None:
+        feed_whitelist = get_whitelist()
 
     feed_iocs_count: int = len(cti_feed.index)
-
-    wl_iocs: int = randint(
-        0, round(feed_iocs_count * 0.1)
-    )  # NOTE: Randomly generate WL iocs (max 10% of feed), real WL overlap not implemented yet
+    wl_iocs: int = feed_whitelist.overlap(cti_feed["value"])
 
     return functions.whitelist_overlap_score(wl_iocs, feed_iocs_count)
 
@@ -192,11 +283,175 @@ def get_single_feed_ioc_score(
     return functions.single_feed_ioc_score(ioc_score, ioc_decay_coef)
 
 
+@profiler.profiled()
+def load_scoring_data(
+    cti_feeds_path: str,
+    skip_is_modified: bool = False,
+    workers: Optional[int] = None,
+    hashed_keys: Optional[bool] = None,
+    processes: Optional[int] = None,
+) -> Tuple[io.FeedSet, IocIndex, Dict[str, str], Dict[str, np.ndarray]]:
+    """
+    Function loads the feeds, builds the IoC-to-feed index and
+    loads the statistics, recalculating them for the changed feeds
+    in a pool of `processes`, `PROCESSES` by default. The index groups
+    IoCs by 64-bit keys if `hashed_keys` is set, `HASHED_IOC_KEYS`
+    by default
+
+        Returns:
+
+            Loaded feeds, index, feeds checksums and statistics arrays
+    """
+    if hashed_keys is None:
+        hashed_keys = HASHED_IOC_KEYS
+    if processes is None:
+        processes = PROCESSES
+
+    cti_feeds = io.load_feeds(cti_feeds_path, workers=workers)
+    index = IocIndex.from_feeds(cti_feeds, hashed_keys)
+    checksums = feeds_checksums(cti_feeds_path)
+
+    return (
+        cti_feeds,
+        index,
+        checksums,
+        _load_statistics(
+            cti_feeds_path, cti_feeds, checksums, skip_is_modified, processes
+        ),
+    )
+
+
+def _load_statistics(
+    cti_feeds_path: str,
+    cti_feeds: List[Dict[str, Any]],
+    checksums: Dict[str, str],
+    skip_is_modified: bool = False,
+    processes: Optional[int] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Function loads the statistics arrays, recalculating them for the
+    changed feeds first. `cti_feeds` are the loaded feeds, the changed
+    feeds which are not among them are read by `partials.update_statistics`
+    """
+    if not skip_is_modified:
+        # Only feeds added, modified or removed since the last run
+        # are processed, the rest comes from the stored aggregates
+        statistics = partials.update_statistics(
+            cti_feeds_path, cti_feeds, checksums=checksums, processes=processes
+        )
+        if statistics is None and not io.has_statistics_arrays(cti_feeds_path):
+            # The aggregates are up to date, but the statistics store
+            # is lost: it is derived from them again
+            stored = partials.load_partials(cti_feeds_path)
+            statistics = partials.partials_to_statistics(
+                partials.empty_partials() if stored is None else stored
+            )
+        if statistics:
+            io.write_statistics(cti_feeds_path, **statistics)
+
+    return io.load_statistics_arrays(cti_feeds_path)
+
+
+@profiler.profiled()
+def load_iocs_scorer(
+    cti_feeds_path: str,
+    skip_is_modified: bool = False,
+    workers: Optional[int] = None,
+    use_snapshot: Optional[bool] = None,
+) -> IocScorer:
+    """
+    Function prepares point queries over the feeds: score of one IoC
+    or a batch of IoCs without scoring the whole corpus, see
+    `query.IocScorer`.
+
+    If the engine snapshot next to the feeds has been built from the
+    same feeds and whitelist files, the scorer is served straight from
+    the memory-mapped snapshot and the feeds are not read. Otherwise
+    the scorer is built from the feeds and the snapshot is rewritten
+
+        Parameters:
+
+            cti_feeds_path (str) — path to the directory with the CTI feeds
+            skip_is_modified (bool) — used to avoid statistics recalculating
+            workers (int) — number of workers reading the feeds concurrently
+            use_snapshot (bool) — load and write the engine snapshot,
+            `USE_SNAPSHOT` by default
+
+        Returns:
+
+            IocScorer with `query`, `query_one` and `final_scores` methods
+    """
+    if use_snapshot is None:
+        use_snapshot = USE_SNAPSHOT
+
+    # Taken before the feeds are read, a feed modified meanwhile makes
+    # the snapshot stale rather than the other way round
+    checksums = feeds_checksums(cti_feeds_path)
+    whitelist_stamp = whitelist.files_stamp(WHITELISTS_PATH)
+
+    if use_snapshot:
+        stored = snapshot.load_snapshot(cti_feeds_path, checksums, whitelist_stamp)
+        if stored is not None:
+            return IocScorer(
+                stored.index, stored.feed_confidences, stored.edge_confidences
+            )
+
+    _, index, _, statistics = load_scoring_data(
+        cti_feeds_path, skip_is_modified, workers
+    )
+    scorer = IocScorer.from_statistics(index, io.feeds_statistics_frame(statistics))
+
+    if use_snapshot:
+        snapshot.write_snapshot(
+            cti_feeds_path,
+            index,
+            scorer.feed_confidences,
+            checksums,
+            whitelist_stamp,
+        )
+
+    return scorer
+
+
+def calculate_iocs_score_timeline(
+    cti_feeds_path: str,
+    dates: Iterable[float],
+    ioc_values: Optional[Iterable[Any]] = None,
+    skip_is_modified: bool = False,
+    workers: Optional[int] = None,
+) -> DataFrame:
+    """
+    Function calculates IoCs scores as of every given date
+    in a single pass, see `query.IocScorer.score_matrix`
+
+        Parameters:
+
+            cti_feeds_path (str) — path to the directory with the CTI feeds
+            dates — unixtimes the scores are calculated as of,
+            e.g. `numpy.arange(start, end, 24 * 60 * 60)`
+            ioc_values — IoC values to score, all IoCs if not set
+            skip_is_modified (bool) — used to avoid statistics recalculating
+            workers (int) — number of workers reading the feeds concurrently
+
+        Returns:
+
+            (IoC × date) scores as pandas.DataFrame
+    """
+    scorer = load_iocs_scorer(cti_feeds_path, skip_is_modified, workers)
+    return scorer.score_matrix(dates, ioc_values)
+
+
+@profiler.profiled()
 def calculate_iocs_score(
     cti_feeds_path: str,
     skip_is_modified: bool = False,
     dt_now: float = time.mktime(datetime.now().timetuple()),
-) -> List[Dict]:
+    batch: bool = True,
+    workers: Optional[int] = None,
+    incremental: Optional[bool] = None,
+    columnar: bool = False,
+    processes: Optional[int] = None,
+) -> Union[List[Dict], ScoreTable]:
     """
     Function initializes and loads statistics dataframes,
     if statistics in not exists recalculates them
@@ -208,30 +463,401 @@ def calculate_iocs_score(
             just for testing reasons.
             dt_now (float) - unixtime means current time, just for testing
             purposes (don't use it if u don't understand why u want use it)
+            batch (bool) — score the whole dataset at once with array
+            reductions instead of the per-row loop
+            workers (int) — number of workers reading the feeds concurrently
+            incremental (bool) — keep the scoring state next to the feeds,
+            read only the changed feeds and re-score only IoCs affected by
+            the changes since the previous run (batch mode only, see
+            `_incremental_scores`), `INCREMENTAL_SCORES` by default
+            columnar (bool) — return `ScoreTable`, one array per output
+            column, instead of the list of dicts (batch mode only)
+            processes (int) — number of processes calculating the
+            aggregates of the changed feeds, `PROCESSES` by default
 
         Returns:
 
             Calculated iocs scores for each feed in given dataset
     """
-    cti_feeds = io.load_feeds(cti_feeds_path)
-    lookup_df = io.load_whole_feeds(cti_feeds_path)
+    if processes is None:
+        processes = PROCESSES
+    if incremental is None:
+        incremental = INCREMENTAL_SCORES
+
+    if batch and incremental:
+        return _scores_result(
+            *_incremental_scores(
+                cti_feeds_path, dt_now, skip_is_modified, workers, processes
+            ),
+            columnar=columnar,
+        )
 
-    if not skip_is_modified and is_modified(cti_feeds_path):
-        statistics = stats.calculate_all_statistics(cti_feeds)
-        io.write_statistics(cti_feeds_path, **statistics)
+    cti_feeds, index, _, statistics = load_scoring_data(
+        cti_feeds_path, skip_is_modified, workers, processes=processes
+    )
+    feeds_stats = io.feeds_statistics_frame(statistics)
+
+    if batch:
+        return _calculate_iocs_score_batch(
+            cti_feeds,
+            feeds_stats,
+            dt_now=dt_now,
+            index=index,
+            columnar=columnar,
+        )
+    if columnar:
+        raise ValueError("Columnar result is calculated in batch mode only")
 
-    iocs_stats = io.load_iocs_statistics(cti_feeds_path)
-    feeds_stats = io.load_feed_statistics(cti_feeds_path)
+    lookup_df = io.load_whole_feeds(cti_feeds)
 
     return _calculate_iocs_score(
-        cti_feeds, lookup_df, iocs_stats, feeds_stats, dt_now=dt_now
+        cti_feeds,
+        lookup_df,
+        index,
+        feeds_stats,
+        dt_now=dt_now,
+    )
+
+
+def _score_feeds(
+    cti_feeds_path: str,
+    dt_now: float,
+    skip_is_modified: bool = False,
+    workers: Optional[int] = None,
+    incremental: Optional[bool] = None,
+) -> Tuple[IocIndex, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Function loads the feeds and calculates the scores arrays, see
+    `_batch_final_scores` and `_incremental_scores`, output records
+    are not built yet
+    """
+    if incremental is None:
+        incremental = INCREMENTAL_SCORES
+
+    if incremental:
+        return _incremental_scores(cti_feeds_path, dt_now, skip_is_modified, workers)
+
+    cti_feeds, index, _, statistics = load_scoring_data(
+        cti_feeds_path, skip_is_modified, workers
+    )
+    if not cti_feeds:
+        empty = np.array([], dtype=np.float64)
+        return index, empty.astype(np.int64), empty, empty
+
+    return (
+        index,
+        *_batch_final_scores(index, io.feeds_statistics_frame(statistics), dt_now),
+    )
+
+
+@profiler.profiled()
+def _incremental_scores(
+    cti_feeds_path: str,
+    dt_now: float,
+    skip_is_modified: bool = False,
+    workers: Optional[int] = None,
+    processes: Optional[int] = None,
+    hashed_keys: Optional[bool] = None,
+) -> Tuple[IocIndex, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Function calculates the scores arrays like `_batch_final_scores`
+    does, carrying the state of the previous run forward (it is stored
+    next to the feeds, see `helpers.rescoring`):
+
+        * only added and modified feeds are read, rows of the
+          unchanged feeds come from the stored state
+        * single feed scores are decayed again only for the mentions
+          found by `rescoring.stale_edges`
+        * final scores are reduced only for the IoCs found by
+          `rescoring.get_dirty_iocs`, the rest keep their stored scores
+
+    Without a usable previous state all feeds are read and scored
+
+        Returns:
+
+            Index, final score of every IoC, source confidence and
+            single feed score of every edge
+    """
+    if hashed_keys is None:
+        hashed_keys = HASHED_IOC_KEYS
+    if processes is None:
+        processes = PROCESSES
+
+    # Taken before the feeds are read, a feed modified meanwhile is
+    # read again by the next run rather than carried forward
+    checksums = feeds_checksums(cti_feeds_path)
+    previous = rescoring.load_scores(cti_feeds_path)
+    unchanged = set(rescoring.unchanged_feeds(previous, checksums))
+
+    feed_names = [
+        os.path.basename(filename) for filename in io.feed_filenames(cti_feeds_path)
+    ]
+    cti_feeds = io.load_feeds(
+        cti_feeds_path,
+        workers=workers,
+        names=[name for name in feed_names if name not in unchanged],
+    )
+    statistics = _load_statistics(
+        cti_feeds_path, cti_feeds, checksums, skip_is_modified, processes
+    )
+
+    with profiler.span("carry forward"):
+        index, previous_ids, feeds_scores = rescoring.carry_forward(
+            previous, feed_names, cti_feeds, hashed_keys
+        )
+
+    feed_confidences = (
+        io.feeds_statistics_frame(statistics)
+        .loc[index.feed_names, "feed_source_confidence"]
+        .to_numpy(dtype=np.float64)
+    )
+    edge_confidences = feed_confidences[index.feed_ids]
+
+    with profiler.span("batch decay"):
+        stale = rescoring.stale_edges(
+            previous, index, feeds_scores, dt_now, DECAY_RATE, DECAY_TTL
+        )
+        feeds_scores[stale] = get_decay_coefs(index.last_seen[stale], dt_now)
+
+    with profiler.span("batch dirty iocs"):
+        dirty = rescoring.get_dirty_iocs(
+            previous, index, previous_ids, stale, feed_confidences
+        )
+
+    with profiler.span("batch final_score"):
+        final_scores = np.where(
+            dirty,
+            _final_scores(index, edge_confidences, feeds_scores, dirty),
+            rescoring.previous_final_scores(previous, previous_ids),
+        )
+
+    rescoring.write_scores(
+        cti_feeds_path,
+        index,
+        final_scores,
+        feeds_scores,
+        feed_confidences,
+        checksums,
+        dt_now,
+        DECAY_RATE,
+        DECAY_TTL,
+    )
+
+    return index, final_scores, edge_confidences, feeds_scores
+
+
+def select_iocs_score(
+    cti_feeds_path: str,
+    min_score: Optional[int] = None,
+    top_k: Optional[int] = None,
+    dt_now: float = time.mktime(datetime.now().timetuple()),
+    skip_is_modified: bool = False,
+    workers: Optional[int] = None,
+    incremental: Optional[bool] = None,
+) -> List[Dict]:
+    """
+    Function calculates IoCs scores like `calculate_iocs_score` does,
+    but returns only rows of the IoCs with score >= `min_score` and/or
+    `top_k` rows with the highest scores per feed. Rows are selected
+    on the scores arrays, output records are built for them only
+
+        Parameters:
+
+            cti_feeds_path (str) — path to the directory with the CTI feeds
+            min_score (int) — lowest score of the returned rows, 0..100
+            top_k (int) — max number of rows per feed, ordered by
+            score descending (equal scores in the feed order)
+            dt_now (float) - unixtime means current time
+            skip_is_modified (bool) — used to avoid statistics recalculating
+            workers (int) — number of workers reading the feeds concurrently
+            incremental (bool) — see `calculate_iocs_score`
+
+        Returns:
+
+            Selected iocs scores for each feed in given dataset
+    """
+    index, final_scores, edge_confidences, feeds_scores = _score_feeds(
+        cti_feeds_path, dt_now, skip_is_modified, workers, incremental
     )
+    return [
+        {"feed_name": feed_name, "score_data": records}
+        for feed_name, records in _feeds_records(
+            index,
+            final_scores,
+            edge_confidences,
+            feeds_scores,
+            min_score,
+            top_k,
+        )
+    ]
+
+
+def iter_iocs_score_rows(
+    cti_feeds_path: str,
+    dt_now: float = time.mktime(datetime.now().timetuple()),
+    min_score: Optional[int] = None,
+    top_k: Optional[int] = None,
+    skip_is_modified: bool = False,
+    workers: Optional[int] = None,
+    incremental: Optional[bool] = None,
+    block_size: int = RECORDS_BLOCK_SIZE,
+) -> Iterator[Dict]:
+    """
+    Function calculates IoCs scores like `select_iocs_score` does and
+    yields them row by row with `feed_name` of the row. Output records
+    are built by blocks of `block_size` rows, so only one block of
+    records is kept in memory at a time
+
+        Returns:
+
+            Generator of scored rows, the same as `calculate_iocs_score_stream`
+    """
+    index, final_scores, edge_confidences, feeds_scores = _score_feeds(
+        cti_feeds_path, dt_now, skip_is_modified, workers, incremental
+    )
+
+    for feed_name, records in _feeds_records(
+        index,
+        final_scores,
+        edge_confidences,
+        feeds_scores,
+        min_score,
+        top_k,
+        block_size,
+    ):
+        for record in records:
+            yield {"feed_name": feed_name, **record}
+
+
+def iter_unique_iocs_score(
+    cti_feeds_path: str,
+    dt_now: float = time.mktime(datetime.now().timetuple()),
+    min_score: Optional[int] = None,
+    top_k: Optional[int] = None,
+    skip_is_modified: bool = False,
+    workers: Optional[int] = None,
+    incremental: Optional[bool] = None,
+    block_size: int = RECORDS_BLOCK_SIZE,
+) -> Iterator[Dict]:
+    """
+    Function calculates IoCs scores like `iter_iocs_score_rows` does,
+    but yields one record per distinct IoC instead of one per feed row,
+    see `table.unique_records`. IoCs are in the order of their first
+    appearance, or by score descending if `top_k` is given
+
+        Returns:
+
+            Generator of IoC records with `feeds` the IoC is mentioned in
+    """
+    index, final_scores, edge_confidences, feeds_scores = _score_feeds(
+        cti_feeds_path, dt_now, skip_is_modified, workers, incremental
+    )
+    ioc_ids = selection.select_scores(final_scores, min_score, top_k)
+
+    for start in range(0, len(ioc_ids), block_size):
+        yield from table.unique_records(
+            index,
+            final_scores,
+            edge_confidences,
+            feeds_scores,
+            ioc_ids[start : start + block_size],
+        )
 
 
+def calculate_iocs_score_stream(
+    cti_feeds_path: str,
+    dt_now: float = time.mktime(datetime.now().timetuple()),
+    memory_budget: int = streaming.MEMORY_BUDGET,
+    chunksize: int = streaming.CHUNK_SIZE,
+    spill_dir: Optional[str] = None,
+    min_score: Optional[int] = None,
+) -> Iterator[Dict]:
+    """
+    Function scores feeds directories larger than memory: feeds are
+    read by chunks and scored partition by partition, see
+    `streaming.stream_iocs_score`. Statistics files are not updated
+
+        Parameters:
+
+            cti_feeds_path (str) — path to the directory with the CTI feeds
+            dt_now (float) - unixtime means current time
+            memory_budget (int) — bytes the buffered feeds rows may take,
+            the rest is spilled to `spill_dir`
+            chunksize (int) — rows read from a feed at once
+            spill_dir (str) — directory for the temporary files
+            min_score (int) — lowest score of the returned rows, 0..100
+
+        Returns:
+
+            Generator of scored rows with `feed_name` of the row
+    """
+    return streaming.stream_iocs_score(
+        cti_feeds_path,
+        dt_now,
+        memory_budget=memory_budget,
+        chunksize=chunksize,
+        spill_dir=spill_dir,
+        min_score=min_score,
+    )
+
+
+def _score_ioc(
+    ioc_value: Any,
+    iocs_stats: Union[DataFrame, IocIndex],
+    feed_confidence_dict: Dict[str, float],
+    last_seens_meta: Dict[str, List[int]],
+    dt_now: float,
+) -> Tuple[int, int, List[float], List[int]]:
+    """
+    Function calculates the final score of the single IoC
+
+        Returns:
+
+            Final score, number of the IoC mentions, source confidences
+            and single feed scores (0..100) of the mentions
+    """
+    source_confidences = []
+
+    # Only every `profiler.ROW_SAMPLE`-th IoC is timed, with its steps
+    with profiler.span("score_ioc", sample=profiler.ROW_SAMPLE):
+        with profiler.span("feeds_ioc_mentioned"):
+            # Find all feed names where the IoC mentioned in
+            feeds_ioc_mentioned = lookups.find_feeds_name_ioc_mentioned_in(
+                ioc_value, iocs_stats
+            )
+
+        with profiler.span("feed_name in feeds_ioc_mentioned"):
+            # Get all source_confidence metrics for this feeds
+            for feed_name in feeds_ioc_mentioned:
+                source_confidences.append(feed_confidence_dict[feed_name])
+
+        mentioned_in_count = len(source_confidences)
+
+        with profiler.span("feeds_scores"):
+            # Get individual feeds scores for each feed the IoC has been mentioned in
+            feeds_scores = get_multiple_feeds_iocs_score(
+                ioc_value, last_seens_meta, dt_now
+            )
+
+        with profiler.span("final_score"):
+            # Culmination: calculate the final score
+            final_score = functions.score(
+                source_confidences, feeds_scores, mentioned_in_count
+            )
+
+    return (
+        final_score,
+        len(feeds_ioc_mentioned) if feeds_ioc_mentioned else 0,
+        source_confidences,
+        [round(r * 100) for r in feeds_scores],
+    )
+
+
+@profiler.profiled()
 def _calculate_iocs_score(
     cti_feeds: List[Dict[str, Any]],
     lookup_df: Union[DataFrame, Series],
-    iocs_stats: DataFrame,
+    iocs_stats: Union[DataFrame, IocIndex],
     feeds_stats: DataFrame,
     dt_now: float = time.mktime(datetime.now().timetuple()),
     use_tqdm=False,
@@ -253,54 +879,259 @@ def _calculate_iocs_score(
     for feed in feeds_stats.itertuples():
         feed_confidence_dict[feed.Index] = feed.feed_source_confidence
 
+    # An IoC mentioned in several feeds is scored once, the later
+    # rows of the IoC reuse the score and its explanation
+    scored_iocs: Dict[str, Tuple[int, int, List[float], List[int]]] = {}
+
     for feed in tqdm_instance(cti_feeds):
         feed_scores: List = []
         for row in feed["df"].itertuples(index=True):
-            source_confidences = []
             ioc_value = row.value
 
-            with HowLong("feeds_ioc_mentioned"):
-                # Find all feed names where the IoC mentioned in
-                feeds_ioc_mentioned = lookups.find_feeds_name_ioc_mentioned_in(
-                    ioc_value, iocs_stats
+            if ioc_value not in scored_iocs:
+                scored_iocs[ioc_value] = _score_ioc(
+                    ioc_value, iocs_stats, feed_confidence_dict, last_seens_meta, dt_now
                 )
 
-            with HowLong("feed_name in feeds_ioc_mentioned"):
-                # Get all source_confidence metrics for this feeds
-                for feed_name in feeds_ioc_mentioned:
-                    source_confidences.append(feed_confidence_dict[feed_name])
-
-            mentioned_in_count = len(source_confidences)
-
-            with HowLong("feeds_scores"):
-                # Get individual feeds scores for each feed the IoC has been mentioned in
-                feeds_scores = get_multiple_feeds_iocs_score(
-                    ioc_value, last_seens_meta, dt_now
-                )
-
-            with HowLong("final_score"):
-                # Culmination: calculate the final score
-                final_score = functions.score(
-                    source_confidences, feeds_scores, mentioned_in_count
-                )
+            final_score, ioc_mentions, source_confidences, feeds_scores = scored_iocs[
+                ioc_value
+            ]
             feed_scores.append(
                 {
                     "value": ioc_value,
                     "score": final_score,
-                    "first_seen": datetime.fromtimestamp(row.first_seen).strftime(
+                    "first_seen": datetime.utcfromtimestamp(row.first_seen).strftime(
                         "%Y-%m-%d"
                     ),
-                    "last_seen": datetime.fromtimestamp(row.last_seen).strftime(
+                    "last_seen": datetime.utcfromtimestamp(row.last_seen).strftime(
                         "%Y-%m-%d"
                     ),
-                    "ioc_mentions": len(feeds_ioc_mentioned)
-                    if feeds_ioc_mentioned
-                    else 0,
-                    "source_confidences": source_confidences,
-                    "feeds_scores": [round(r * 100) for r in feeds_scores],
+                    "ioc_mentions": ioc_mentions,
+                    "source_confidences": list(source_confidences),
+                    "feeds_scores": list(feeds_scores),
                 }
             )
 
         all_scores.append({"feed_name": feed["name"], "score_data": feed_scores})
 
     return all_scores
+
+
+def get_decay_coefs(
+    last_seens: np.ndarray,
+    date_now: float,
+    decay_rate=DECAY_RATE,
+    decay_ttl=DECAY_TTL,
+) -> np.ndarray:
+    """
+    Function calculates single feed scores for an array of
+    `last_seen` timestamps in one array operation, see
+    `get_single_feed_ioc_score`. Dates without time are
+    looked up in the cached day-granularity decay table
+    """
+    last_seens = np.where(last_seens == 0, date_now, last_seens)
+    decay_coefs = functions.calculate_decay_coef_days(
+        decay_rate, decay_ttl, last_seens, date_now
+    )
+    return functions.single_feed_ioc_score(None, decay_coefs)
+
+
+def format_dates(timestamps: np.ndarray) -> List[str]:
+    """
+    Function formats unixtime values as `%Y-%m-%d`
+    strings, once per distinct timestamp
+    """
+    return table.format_dates(timestamps).tolist()
+
+
+def _final_scores(
+    index: IocIndex,
+    edge_confidences: np.ndarray,
+    feeds_scores: np.ndarray,
+    iocs: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Function reduces the final score of every IoC from its edges.
+    The confidence-weighted sums are reduced per IoC with `np.bincount`,
+    which accumulates in the same order as `functions.score` does, so
+    the numbers are the same as in `_calculate_iocs_score`. With the
+    `iocs` mask only edges of these IoCs are reduced, the rest get 0
+    """
+    edge_ioc_ids = index.edge_ioc_ids
+    if iocs is not None:
+        edges = iocs[edge_ioc_ids]
+        edge_ioc_ids = edge_ioc_ids[edges]
+        edge_confidences = edge_confidences[edges]
+        feeds_scores = feeds_scores[edges]
+
+    x = np.bincount(
+        edge_ioc_ids,
+        weights=edge_confidences ** 2 * feeds_scores,
+        minlength=len(index),
+    )
+    y = np.bincount(edge_ioc_ids, weights=edge_confidences, minlength=len(index))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(y > 0, np.rint(x / y * 100), 0).astype(np.int64)
+
+
+def _batch_final_scores(
+    index: IocIndex,
+    feeds_stats: DataFrame,
+    dt_now: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Function calculates the final score of every IoC of the index.
+    Every (IoC, feed) mention is an edge of the IoC-to-feed index,
+    single feed scores of all edges are decayed at once and reduced
+    per IoC by `_final_scores`
+
+        Returns:
+
+            Final score of every IoC, source confidence and
+            single feed score of every edge
+    """
+    feed_confidences = feeds_stats.loc[
+        index.feed_names, "feed_source_confidence"
+    ].to_numpy(dtype=np.float64)
+    edge_confidences = feed_confidences[index.feed_ids]
+
+    with profiler.span("batch decay"):
+        feeds_scores = get_decay_coefs(index.last_seen, dt_now)
+
+    with profiler.span("batch final_score"):
+        final_scores = _final_scores(index, edge_confidences, feeds_scores)
+
+    return final_scores, edge_confidences, feeds_scores
+
+
+def _feeds_records(
+    index: IocIndex,
+    final_scores: np.ndarray,
+    edge_confidences: np.ndarray,
+    feeds_scores: np.ndarray,
+    min_score: Optional[int] = None,
+    top_k: Optional[int] = None,
+    block_size: Optional[int] = None,
+) -> Iterator[Tuple[str, List[Dict]]]:
+    """
+    Function builds output records feed by feed, for the rows
+    selected by `selection.select_scores` if `min_score` or `top_k`
+    is given. Yields (feed name, records) for every feed, or for every
+    `block_size` rows of the feed if the block size is given
+    """
+    rows_scores = None
+    if min_score is not None or top_k is not None:
+        rows_scores = final_scores[index.row_ioc_ids]
+
+    feed_sizes = np.bincount(index.feed_ids, minlength=len(index.feed_names))
+    offset = 0
+    for feed_name, feed_size in zip(index.feed_names.tolist(), feed_sizes.tolist()):
+        if rows_scores is None:
+            rows = np.arange(offset, offset + feed_size)
+        else:
+            rows = offset + selection.select_scores(
+                rows_scores[offset : offset + feed_size], min_score, top_k
+            )
+        offset += feed_size
+
+        step = block_size or max(len(rows), 1)
+        for start in range(0, max(len(rows), 1), step):
+            block = rows[start : start + step]
+            yield feed_name, ScoreTable.from_index(
+                index,
+                final_scores,
+                edge_confidences,
+                feeds_scores,
+                rows=block,
+                feed_names=[feed_name],
+                feed_sizes=[len(block)],
+            ).records()
+
+
+@profiler.profiled()
+def _calculate_iocs_score_batch(
+    cti_feeds: List[Dict[str, Any]],
+    feeds_stats: DataFrame,
+    dt_now: float = time.mktime(datetime.now().timetuple()),
+    use_tqdm=False,
+    index: Optional[IocIndex] = None,
+    columnar: bool = False,
+) -> Union[List[Dict], ScoreTable]:
+    """
+    Function calculates the final score of IoCs for the whole
+    dataset at once, see `_batch_final_scores`. The result is
+    built as `ScoreTable`, the list of dicts is derived from it
+    unless the columnar result is asked for
+    """
+    if not cti_feeds and not columnar:
+        return []
+
+    if index is None:
+        index = IocIndex.from_feeds(cti_feeds)
+
+    if cti_feeds:
+        final_scores, edge_confidences, feeds_scores = _batch_final_scores(
+            index, feeds_stats, dt_now
+        )
+    else:
+        final_scores = np.array([], dtype=np.int64)
+        edge_confidences = feeds_scores = np.array([], dtype=np.float64)
+
+    return _scores_result(
+        index,
+        final_scores,
+        edge_confidences,
+        feeds_scores,
+        columnar=columnar,
+        use_tqdm=use_tqdm,
+    )
+
+
+def _scores_result(
+    index: IocIndex,
+    final_scores: np.ndarray,
+    edge_confidences: np.ndarray,
+    feeds_scores: np.ndarray,
+    columnar: bool = False,
+    use_tqdm=False,
+) -> Union[List[Dict], ScoreTable]:
+    """
+    Function builds the result of `calculate_iocs_score` from
+    the scores arrays: `ScoreTable` if the columnar result is
+    asked for, otherwise the list of dicts derived from it
+    """
+    tqdm_instance = get_tqdm_instance(use_tqdm)
+    all_scores: List = []
+
+    scores_table = ScoreTable.from_index(
+        index, final_scores, edge_confidences, feeds_scores
+    )
+    if columnar:
+        return scores_table
+
+    for feed_name, feed_scores in tqdm_instance(scores_table.iter_feeds()):
+        all_scores.append({"feed_name": feed_name, "score_data": feed_scores})
+
+    return all_scores
+
+    if index is None:
+        index = IocIndex.from_feeds(cti_feeds)
+
+    if cti_feeds:
+        final_scores, edge_confidences, feeds_scores = _batch_final_scores(
+            index, feeds_stats, dt_now, scores_path, checksums
+        )
+    else:
+        final_scores = np.array([], dtype=np.int64)
+        edge_confidences = feeds_scores = np.array([], dtype=np.float64)
+
+    scores_table = ScoreTable.from_index(
+        index, final_scores, edge_confidences, feeds_scores
+    )
+    if columnar:
+        return scores_table
+
+    for feed_name, feed_scores in tqdm_instance(scores_table.iter_feeds()):
+        all_scores.append({"feed_name": feed_name, "score_data": feed_scores})
+
+    return all_scores
@@ -0,0 +1,67 @@
+import os
+import asyncio
+from argparse import ArgumentParser
+from helpers import service
+
+argparser = ArgumentParser()
+
+argparser.add_argument(
+    "path",
+    help="Path the directory with the CTI feeds",
+)
+argparser.add_argument(
+    "--host",
+    action="store",
+    dest="host",
+    default="127.0.0.1",
+    help="Address to listen on",
+)
+argparser.add_argument(
+    "--port",
+    action="store",
+    dest="port",
+    default=8080,
+    type=int,
+    help="Port to listen on",
+)
+argparser.add_argument(
+    "--unix-socket",
+    action="store",
+    dest="unix_socket",
+    default=None,
+    help="Listen on the Unix socket instead of TCP",
+)
+argparser.add_argument(
+    "--check-interval",
+    action="store",
+    dest="check_interval",
+    default=service.CHECK_INTERVAL,
+    type=float,
+    help="How often the feeds are checked for changes, seconds",
+)
+argparser.add_argument(
+    "--workers",
+    action="store",
+    dest="workers",
+    default=None,
+    type=int,
+    help="Number of workers reading the feeds concurrently",
+)
+
+
+args = argparser.parse_args()
+FEED_PATH: str = os.path.abspath(os.path.join(os.getcwd(), args.path))
+
+try:
+    asyncio.run(
+        service.serve(
+            FEED_PATH,
+            host=args.host,
+            port=args.port,
+            unix_socket=args.unix_socket,
+            check_interval=args.check_interval,
+            workers=args.workers,
+        )
+    )
+except KeyboardInterrupt:
+    pass
@@ -0,0 +1,72 @@
+import os
+import pathlib
+from os.path import join
+
+from helpers import benchmark
+
+FIXTURES_DIR = join(pathlib.Path(__file__).parent.absolute(), "fixtures")
+
+DATASET_NAME = "dataset_04_mid"
+DATASET_DIR = join(FIXTURES_DIR, DATASET_NAME)
+
+
+def result(stage: str, wall_time: float, peak_memory: int):
+    return {
+        "dataset": DATASET_NAME,
+        "stage": stage,
+        "wall_time": wall_time,
+        "peak_memory": peak_memory,
+    }
+
+
+class TestBenchmark:
+    def test_benchmark_dataset(self):
+        feeds_path = join(DATASET_DIR, "feeds")
+        files = sorted(os.listdir(feeds_path))
+
+        results = benchmark.benchmark_dataset(feeds_path, repeat=1, queries=10)
+
+        assert [result["stage"] for result in results] == benchmark.STAGES
+        for result in results:
+            assert result["dataset"] == "feeds"
+            assert result["feeds"] == 5
+            assert result["wall_time"] > 0
+            assert result["iocs_per_sec"] > 0
+            assert result["peak_memory"] > 0
+        assert results[0]["iocs"] == results[0]["rows"]
+        assert results[-1]["iocs"] == 10
+
+        # Runs over a copy, the dataset is not written to
+        assert sorted(os.listdir(feeds_path)) == files
+
+        only_queries = benchmark.benchmark_dataset(
+            feeds_path, stages=["queries"], repeat=1, queries=10
+        )
+        assert [result["stage"] for result in only_queries] == ["queries"]
+
+    def test_compare(self):
+        baseline = {
+            "results": [
+                result("ingestion", 1.0, 100),
+                result("scoring", 0.01, 100),
+                result("queries", 1.0, 100),
+            ]
+        }
+        results = {
+            "results": [
+                result("ingestion", 1.5, 110),
+                result("scoring", 0.02, 100),  # too fast to compare the time
+                result("queries", 1.1, 200),
+                result("statistics", 9.0, 900),  # not in the baseline
+            ]
+        }
+
+        regressions = benchmark.compare(
+            results, baseline, time_threshold=0.2, memory_threshold=0.5
+        )
+
+        assert [(r["stage"], r["metric"]) for r in regressions] == [
+            ("ingestion", "wall_time"),
+            ("queries", "peak_memory"),
+        ]
+        assert regressions[0]["ratio"] == 1.5
@@ -1,5 +1,7 @@
+import math
 from ast import literal_eval
 
+import numpy as np
 import pytest
 from random import randint
 from datetime import datetime
@@ -29,6 +31,45 @@ class TestFunctions:
         timeliness = functions.timeliness(sigma=sigma, curr_feed_len=feed_size)
         assert 0 <= timeliness <= 1
 
+    def test_timeliness_sigma_array(self):
+        rng = np.random.default_rng(1337)
+        curr_first_seen = rng.integers(1.5e9, 1.6e9, 5000)
+        min_first_seen = curr_first_seen - rng.integers(0, EPOCH_DAY * 90, 5000)
+
+        sigma = 0
+        for min_fs, curr_fs in zip(min_first_seen.tolist(), curr_first_seen.tolist()):
+            sigma = functions.calculate_timeliness_sigma(sigma, min_fs, curr_fs)
+        sigma_array = functions.timeliness_sigma_array(min_first_seen, curr_first_seen)
+
+        assert sigma_array == pytest.approx(
+            math.fsum((min_first_seen / curr_first_seen).tolist()), rel=1e-12
+        )
+        # Rounded once instead of after every row, see `timeliness_sigmas`
+        assert (
+            abs(
+                functions.timeliness(sigma_array, 5000)
+                - functions.timeliness(sigma, 5000)
+            )
+            <= 0.001
+        )
+
+    def test_timeliness_sigmas(self):
+        feed_ids = np.array([0, 1, 0, 0, 2])
+        min_first_seen = np.array([90, 80, 70, 60, 50])
+        first_seen = np.array([100, 100, 70, 120, 100])
+
+        sigmas = functions.timeliness_sigmas(
+            feed_ids, min_first_seen, 1 / first_seen, 4
+        )
+        assert sigmas.tolist() == pytest.approx([2.4, 0.8, 0.5, 0])
+        # Rows of the same IoC in the feed summed up first
+        assert functions.timeliness_sigmas(
+            np.array([0, 0]),
+            np.array([60, 90]),
+            np.array([1 / 120, 1 / 100 + 1 / 100]),
+            1,
+        ).tolist() == pytest.approx([2.3])
+
     def test_negative_decay_rate(self):
         last_seen = datetime.now().timestamp() - (EPOCH_DAY * 7)
         result = functions.calculate_decay_coef(
@@ -65,6 +106,32 @@ class TestFunctions:
             )
             assert "`last_seen` arg must be of" in str(e)
 
+    @pytest.mark.parametrize("decay_rate", [0.5, 0.3, 1.0, 0])
+    @pytest.mark.parametrize("decay_ttl", [10, 90])
+    def test_decay_coef_array(self, decay_rate, decay_ttl):
+        now = datetime(2021, 3, 7).timestamp()
+        rng = np.random.default_rng(1337)
+        last_seens = now - rng.integers(0, EPOCH_DAY * (decay_ttl + 3), 5000)
+        # Dates without time: whole days plus the same offset
+        last_dates = now - 3600 - EPOCH_DAY * rng.integers(0, decay_ttl + 3, 5000)
+
+        for values, vectorized in [
+            (last_seens, functions.calculate_decay_coef_array),
+            (last_dates, functions.calculate_decay_coef_days),
+            (last_seens, functions.calculate_decay_coef_days),
+        ]:
+            expected = [
+                functions.calculate_decay_coef(decay_rate, decay_ttl, value, now)
+                for value in values.tolist()
+            ]
+            assert vectorized(decay_rate, decay_ttl, values, now).tolist() == expected
+
+    def test_round_array(self):
+        values = np.array([0.285, 0.015, 2.675, 0.125, 1.005, 0.5])
+        assert functions.round_array(values, 2).tolist() == [
+            round(value, 2) for value in values.tolist()
+        ]
+
     def test_get_extensiveness_coef(self):
         result = functions.extensiveness(feed_sum_extensiveness=50, feed_len=100)
         assert result == 0.5
@@ -0,0 +1,80 @@
+import ipaddress
+import uuid
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from feed_generator import generators
+from feed_generator.generators import FakeGenerators
+from helpers import io
+
+
+class TestGenerators:
+    def test_values(self):
+        fake = FakeGenerators(seed=1)
+
+        ipv4 = fake.generate_ipv4_array(1000).astype(str)
+        assert all(str(ipaddress.IPv4Address(value)) == value for value in ipv4)
+        ipv6 = fake.generate_ipv6_array(1000).astype(str)
+        assert all(
+            ipaddress.IPv6Address(value) and len(value.split(":")) == 8
+            for value in ipv6
+        )
+        uuids = fake.generate_uuid4_array(1000).astype(str)
+        assert all(uuid.UUID(value).version == 4 for value in uuids)
+        assert all(str(uuid.UUID(value)) == value for value in uuids)
+
+        assert generators.format_ints(np.array([0, 7, 10, 1000])).tolist() == [
+            b"0",
+            b"7",
+            b"10",
+            b"1000",
+        ]
+
+    def test_seed(self):
+        first = FakeGenerators(seed=3).generate_values_array(100)
+        assert np.array_equal(first, FakeGenerators(seed=3).generate_values_array(100))
+        assert not np.array_equal(
+            first, FakeGenerators(seed=4).generate_values_array(100)
+        )
+
+    def test_type_mix(self):
+        values = FakeGenerators(seed=1).generate_values_array(
+            1000, {"md5": 1, "ipv4": 3}
+        )
+        lengths = pd.Series(values.astype(str)).str.len()
+        assert set(lengths[lengths > 15]) == {32}
+        assert 0.65 < (lengths <= 15).mean() < 0.85
+
+    def test_feeds(self, tmp_path):
+        feeds = dict(
+            FakeGenerators(seed=2).generate_feeds(
+                5,
+                min_size=1000,
+                max_size=5000,
+                overlap=0.5,
+                start_date=date(2021, 1, 1),
+                end_date=date(2021, 3, 1),
+            )
+        )
+        assert list(feeds) == [f"feed_{i}" for i in range(5)]
+
+        for name, columns in feeds.items():
+            generators.write_feed_csv(str(tmp_path / f"{name}.csv"), columns)
+            # The same file pandas writes for the feed frame
+            frame = FakeGenerators.feed_frame(columns)
+            assert (tmp_path / f"{name}.csv").read_text() == frame.to_csv()
+
+            assert 1000 <= len(frame) <= 5000
+            assert (frame["first_seen"] >= "2021-01-01").all()
+            assert (frame["first_seen"] <= frame["last_seen"]).all()
+            assert (frame["last_seen"] < "2021-03-01").all()
+
+        cti_feeds = io.load_feeds(str(tmp_path))
+        assert sorted(feed["name"] for feed in cti_feeds) == sorted(
+            f"{name}.csv" for name in feeds
+        )
+        # Half of every feed comes from the shared pool, so all the feeds overlap
+        values = [set(feed["df"]["value"]) for feed in cti_feeds]
+        assert all(len(values[0] & other) > 0 for other in values[1:])
@@ -0,0 +1,35 @@
+import pathlib
+from os.path import join
+
+import pytest
+from helpers import io
+
+FIXTURES_DIR = join(pathlib.Path(__file__).parent.absolute(), "fixtures")
+
+DATASET_NAME = "dataset_04_mid"
+DATASET_DIR = join(FIXTURES_DIR, DATASET_NAME)
+FEED_COLUMNS = list(io.FEED_DTYPES)
+
+
+class TestIO:
+    @pytest.mark.parametrize("workers", [None, 4])
+    def test_typed_load_feeds(self, workers):
+        untyped = io.load_feeds(join(DATASET_DIR, "feeds"), typed=False)
+        typed = io.load_feeds(join(DATASET_DIR, "feeds"), workers=workers)
+
+        assert typed.names == untyped.names
+        assert set(typed.timings) == set(typed.names)
+        for typed_feed, untyped_feed in zip(typed, untyped):
+            assert list(typed_feed["df"].columns) == FEED_COLUMNS
+            assert typed_feed["df"].equals(untyped_feed["df"][FEED_COLUMNS])
+
+    def test_typed_load_falls_back_to_inference(self, tmp_path):
+        feed = tmp_path / "feed.csv"
+        feed.write_text(
+            "id,value,first_seen,last_seen\n"
+            "1,8.8.8.8,2021-1-28,2021-02-01 10:00:00\n"
+        )
+
+        df = io.load_single_feed(str(feed), typed=True)
+        assert df["first_seen"].tolist() == [1611792000]
+        assert df["last_seen"].tolist() == [1612173600]
@@ -0,0 +1,57 @@
+import pathlib
+from os.path import join
+
+import numpy as np
+import pytest
+
+from helpers import io, keys
+from helpers.index import IocIndex, factorize_iocs
+
+FIXTURES_DIR = join(pathlib.Path(__file__).parent.absolute(), "fixtures")
+
+DATASET_NAME = "dataset_04_mid"
+DATASET_DIR = join(FIXTURES_DIR, DATASET_NAME)
+
+
+class TestKeys:
+    def test_factorize_keys(self):
+        values = np.array(["b", "a", None, "b", np.nan, "c", "a"], dtype=object)
+        codes, unique_values, unique_keys = keys.factorize_keys(values)
+        expected_codes, expected_values = factorize_iocs(values)
+
+        assert codes.tolist() == expected_codes.tolist()
+        assert str(unique_values.tolist()) == str(expected_values.tolist())
+        assert unique_keys.tolist() == keys.ioc_keys(unique_values).tolist()
+        assert unique_keys[2] == keys.MISSING_KEY
+
+        # Keys are stable: the same values give the same keys in any run
+        assert keys.ioc_keys(["a"]).tolist() == keys.ioc_keys(
+            np.array(["a"], dtype=object)
+        ).tolist()
+
+    def test_collisions(self, monkeypatch):
+        ioc_keys = keys.ioc_keys
+        monkeypatch.setattr(
+            keys, "ioc_keys", lambda values: ioc_keys(values) % np.uint64(2)
+        )
+
+        with pytest.raises(keys.KeyCollisionError) as error:
+            keys.factorize_keys(np.array(["a", "b", "c", "a"], dtype=object))
+        assert error.value.values
+
+        cti_feeds = io.load_feeds(join(DATASET_DIR, "feeds"))
+        index = IocIndex.from_feeds(cti_feeds, hashed_keys=True)
+        assert index.keys is None
+        assert len(index) == len(IocIndex.from_feeds(cti_feeds))
+
+    def test_hashed_index(self):
+        cti_feeds = io.load_feeds(join(DATASET_DIR, "feeds"))
+        index = IocIndex.from_feeds(cti_feeds)
+        hashed = IocIndex.from_feeds(cti_feeds, hashed_keys=True)
+
+        assert hashed.keys is not None
+        for attribute in ("values", "indptr", "feed_ids", "row_ioc_ids", "row_edges"):
+            assert np.array_equal(getattr(hashed, attribute), getattr(index, attribute))
+
+        values = [*index.values[:50].tolist(), "unknown", None]
+        assert hashed.ioc_ids(values).tolist() == index.ioc_ids(values).tolist()
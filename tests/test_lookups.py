@@ -2,10 +2,12 @@ import pathlib
 from os.path import join
 from typing import Any, Dict, List, Tuple
 
+import numpy as np
 import pytest
-from pandas import DataFrame
+from pandas import DataFrame, Series
 
 from helpers import io, lookups
+from helpers.index import IocIndex
 
 
 FIXTURES_DIR = join(pathlib.Path(__file__).parent.absolute(), "fixtures")
@@ -19,7 +21,7 @@ def fixtures() -> Tuple[List[Dict[str, Any]], Any, DataFrame, DataFrame]:
     cti_feeds_path = join(DATASET_DIR, "feeds")
 
     cti_feeds = io.load_feeds(cti_feeds_path)
-    lookup_df = io.load_whole_feeds(cti_feeds_path)
+    lookup_df = io.load_whole_feeds(cti_feeds)
 
     cti_feeds_path = join(DATASET_DIR, "stat")
     iocs_stats = io.load_iocs_statistics(cti_feeds_path, "iocs.csv")
@@ -28,6 +30,12 @@ def fixtures() -> Tuple[List[Dict[str, Any]], Any, DataFrame, DataFrame]:
     return cti_feeds, lookup_df, iocs_stats, feeds_stats
 
 
+@pytest.fixture(scope="class")
+def index(fixtures) -> IocIndex:
+    cti_feeds, _, _, _ = fixtures
+    return IocIndex.from_feeds(cti_feeds)
+
+
 class TestLookups:
     def test_find_feed_ioc_mentioned_in(self, fixtures):
         cti_feeds, lookup_df, iocs_stats, feeds_stats = fixtures
@@ -62,3 +70,75 @@ class TestLookups:
         cti_feeds, _, _, _ = fixtures
         result = lookups.find_min_date("65.42.162.18", cti_feeds)
         assert int(result) == 1608508800
+        assert lookups.find_min_date("not an ioc", cti_feeds) is None
+
+    def test_factorize_iocs_keeps_missing_values(self):
+        codes, values = lookups.factorize_iocs(
+            Series(["a", np.nan, "b", "a", np.nan])
+        )
+        assert codes.tolist() == [0, 1, 2, 0, 1]
+        assert values[0] == "a" and values[2] == "b"
+        assert np.isnan(values[1])
+
+    def test_index_lookups(self, fixtures, index):
+        cti_feeds, _, iocs_stats, _ = fixtures
+
+        assert lookups.overall_ioc_count(index) == 3382
+        assert lookups.feeds_ioc_mentioned_in("65.42.162.18", index) == ["feed_2.csv"]
+        assert lookups.number_of_feeds_ioc_mentioned_in("65.42.162.18", index) == 1
+        assert int(lookups.find_min_date("65.42.162.18", index)) == 1608508800
+        assert lookups.feeds_ioc_mentioned_in("not an ioc", index) == []
+        assert lookups.number_of_feeds_ioc_mentioned_in("not an ioc", index) == 0
+        assert lookups.find_min_date("not an ioc", index) is None
+
+    def test_index_repeated_mentions(self):
+        def feed(name: str, values: List[str]) -> Dict[str, Any]:
+            return {
+                "name": name,
+                "df": DataFrame(
+                    {
+                        "value": values,
+                        "first_seen": [1] * len(values),
+                        "last_seen": [2] * len(values),
+                    }
+                ),
+            }
+
+        cti_feeds = [
+            feed("feed_b.csv", ["1.1.1.1", "2.2.2.2", "1.1.1.1"]),
+            feed("feed_a.csv", ["1.1.1.1"]),
+        ]
+        index = IocIndex.from_feeds(cti_feeds)
+
+        assert lookups.feeds_ioc_mentioned_in("1.1.1.1", index) == [
+            "feed_b.csv",
+            "feed_a.csv",
+        ]
+        assert lookups.feeds_ioc_mentioned_in(
+            "1.1.1.1", index
+        ) == lookups.feeds_ioc_mentioned_in("1.1.1.1", cti_feeds)
+        assert index.neighbours(index.ioc_id("1.1.1.1")).tolist() == [0, 1]
+        assert lookups.number_of_feeds_ioc_mentioned_in(
+            "1.1.1.1", index
+        ) == lookups.number_of_feeds_ioc_mentioned_in("1.1.1.1", cti_feeds)
+        assert lookups.find_feeds_name_ioc_mentioned_in("1.1.1.1", index) == [
+            "feed_b.csv",
+            "feed_b.csv",
+            "feed_a.csv",
+        ]
+
+    def test_index_membership(self, fixtures, index):
+        _, _, iocs_stats, _ = fixtures
+
+        for ioc_id, edges in index.iter_edges():
+            value = index.values[ioc_id]
+            assert sorted(index.feed_names[index.feed_ids[edges]]) == sorted(
+                lookups.find_feeds_name_ioc_mentioned_in(value, iocs_stats)
+            )
+
+    def test_feed_set_parses_once(self, fixtures):
+        cti_feeds, lookup_df, _, _ = fixtures
+
+        assert io.load_whole_feeds(cti_feeds) is lookup_df
+        assert len(lookup_df.index) == lookups.overall_ioc_count(cti_feeds)
+        assert cti_feeds.names == [feed["name"] for feed in cti_feeds]
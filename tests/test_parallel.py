@@ -0,0 +1,29 @@
+import pathlib
+import shutil
+from os.path import join
+
+import scoring_engine as engine  # noqa: F401, imported before helpers.partials
+from helpers import parallel, partials
+
+FIXTURES_DIR = join(pathlib.Path(__file__).parent.absolute(), "fixtures")
+
+DATASET_NAME = "dataset_04_mid"
+DATASET_DIR = join(FIXTURES_DIR, DATASET_NAME)
+
+
+class TestParallel:
+    def test_map_feeds(self):
+        tasks = [-3, 1, -2, 5]
+        assert parallel.map_feeds(abs, tasks, None) == [3, 1, 2, 5]
+        # Results come in the tasks order from the pool too
+        assert parallel.map_feeds(abs, tasks, 2) == [3, 1, 2, 5]
+
+    def test_parallel_statistics(self, tmp_path):
+        feeds_path = tmp_path / "feeds"
+        shutil.copytree(join(DATASET_DIR, "feeds"), feeds_path)
+
+        serial = partials.update_statistics(str(feeds_path), force=True)
+        parallel = partials.update_statistics(str(feeds_path), force=True, processes=2)
+
+        assert parallel["feeds"].equals(serial["feeds"])
+        assert parallel["iocs"].equals(serial["iocs"])
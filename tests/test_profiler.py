@@ -0,0 +1,101 @@
+import json
+import pathlib
+import time
+from os.path import join
+
+import pytest
+
+import scoring_engine as engine
+from helpers import io, parallel, profiler
+
+FIXTURES_DIR = join(pathlib.Path(__file__).parent.absolute(), "fixtures")
+
+DATASET_NAME = "dataset_04_mid"
+DATASET_DIR = join(FIXTURES_DIR, DATASET_NAME)
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(profiler, "ENABLED", True)
+    monkeypatch.setattr(profiler, "PROFILER", profiler.Profiler(trace=True))
+    return profiler.PROFILER
+
+
+def shard_task(task):
+    with profiler.span("shard"):
+        with profiler.span("sleep"):
+            time.sleep(task)
+    return task * 2
+
+
+class TestProfiler:
+    def test_disabled(self, monkeypatch):
+        monkeypatch.setattr(profiler, "ENABLED", False)
+        assert profiler.span("anything") is profiler.NULL_SPAN
+        assert profiler.collecting(shard_task) is shard_task
+
+    def test_spans(self, enabled):
+        for _ in range(10):
+            with profiler.span("outer"):
+                for _ in range(20):
+                    with profiler.span("row", sample=5):
+                        with profiler.span("step"):
+                            pass
+
+        report = {row["path"]: row for row in enabled.report()}
+        assert list(report) == ["outer", "outer/row", "outer/row/step"]
+        assert report["outer"]["calls"] == report["outer"]["count"] == 10
+        assert report["outer/row"]["calls"] == 200
+        assert report["outer/row"]["count"] == 40
+        # Steps are timed only in the timed rows, their totals are scaled up
+        assert report["outer/row/step"]["count"] == 40
+        assert report["outer/row/step"]["estimated_calls"] == 200
+        assert report["outer/row/step"]["estimated_total"] == pytest.approx(
+            report["outer/row/step"]["total"] * 5
+        )
+
+    def test_percentiles(self):
+        stats = profiler.SpanStats()
+        for duration_ms in range(1, 101):
+            stats.add(duration_ms * 10 ** 6)
+
+        assert stats.percentile(50) == pytest.approx(0.050, rel=0.1)
+        assert stats.percentile(99) == pytest.approx(0.099, rel=0.1)
+        assert stats.percentile(100) == pytest.approx(0.100)
+
+    def test_merge_processes(self, enabled):
+        with profiler.span("map"):
+            results = parallel.map_feeds(shard_task, [0.01, 0.02, 0.03], 2)
+        assert results == [0.02, 0.04, 0.06]
+
+        report = {row["path"]: row for row in enabled.report()}
+        assert report["map/shard"]["count"] == 3
+        assert report["map/shard/sleep"]["total"] >= 0.06
+        assert report["map/shard/sleep"]["max"] >= 0.03
+
+        trace = enabled.chrome_trace()
+        json.dumps(trace)
+        events = [event for event in trace["traceEvents"] if event["name"] == "sleep"]
+        assert len(events) == 3
+        assert {event["ph"] for event in events} == {"X"}
+        assert all(event["args"]["path"] == "map/shard/sleep" for event in events)
+
+    def test_engine_spans(self, enabled, tmp_path):
+        cti_feeds = io.load_feeds(join(DATASET_DIR, "feeds"))
+        lookup_df = io.load_whole_feeds(cti_feeds)
+        iocs_stats = io.load_iocs_statistics(join(DATASET_DIR, "stat"), "iocs.csv")
+        feeds_stats = io.load_feed_statistics(join(DATASET_DIR, "stat"), "feeds.csv")
+        engine._calculate_iocs_score(cti_feeds, lookup_df, iocs_stats, feeds_stats)
+
+        report = {row["path"]: row for row in enabled.report()}
+        rows = report["_calculate_iocs_score/score_ioc"]
+        assert rows["count"] == -(-rows["calls"] // profiler.ROW_SAMPLE)
+        assert "_calculate_iocs_score/score_ioc/feeds_scores" in report
+
+        profiler.write_json(str(tmp_path / "profile.json"))
+        profiler.write_chrome_trace(str(tmp_path / "trace.json"))
+        stored = json.loads((tmp_path / "profile.json").read_text())
+        assert [row["path"] for row in stored["report"]] == list(report)
+        assert set(stored["spans"]) == set(report)
+        trace = json.loads((tmp_path / "trace.json").read_text())
+        assert len(trace["traceEvents"]) == sum(row["count"] for row in report.values())
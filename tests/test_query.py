@@ -0,0 +1,82 @@
+import datetime
+import pathlib
+import time
+from os.path import join
+
+import numpy as np
+import pytest
+from helpers import io
+from helpers.index import IocIndex
+from helpers.query import IocScorer
+from scoring_engine import _calculate_iocs_score_batch
+
+FIXTURES_DIR = join(pathlib.Path(__file__).parent.absolute(), "fixtures")
+
+DATASET_NAME = "dataset_04_mid"
+DATASET_DIR = join(FIXTURES_DIR, DATASET_NAME)
+
+
+def str2timestamp(date_iso: str) -> float:
+    dt = datetime.datetime.fromisoformat(date_iso)
+    return time.mktime(dt.timetuple())
+
+
+@pytest.fixture(scope="class")
+def scorer_fixture():
+    cti_feeds = io.load_feeds(join(DATASET_DIR, "feeds"))
+    feeds_stats = io.load_feed_statistics(join(DATASET_DIR, "stat"), "feeds.csv")
+    scorer = IocScorer.from_statistics(IocIndex.from_feeds(cti_feeds), feeds_stats)
+    scores = _calculate_iocs_score_batch(
+        cti_feeds, feeds_stats, str2timestamp("2021-03-07")
+    )
+
+    return scorer, scores
+
+
+class TestQuery:
+    def test_query_matches_batch(self, scorer_fixture):
+        scorer, scores = scorer_fixture
+        now = str2timestamp("2021-03-07")
+        rows = [row for feed in scores for row in feed["score_data"]]
+        values = [row["value"] for row in rows]
+
+        results = scorer.query(values, now)
+        final_scores = scorer.final_scores(values, now).tolist()
+
+        for row, result, final_score in zip(rows, results, final_scores):
+            assert result == scorer.query_one(row["value"], now)
+            assert result["score"] == final_score == row["score"]
+            assert result["ioc_mentions"] == row["ioc_mentions"]
+            assert result["source_confidences"] == row["source_confidences"]
+            assert result["feeds_scores"] == row["feeds_scores"]
+
+    def test_query_unknown_ioc(self, scorer_fixture):
+        scorer, scores = scorer_fixture
+        now = str2timestamp("2021-03-07")
+        value = scores[0]["score_data"][0]["value"]
+
+        assert "unknown" not in scorer and value in scorer
+        assert scorer.query_one("unknown", now) is None
+        assert scorer.query(["unknown", value], now)[0] is None
+        assert scorer.final_scores(["unknown", value], now)[0] == -1
+        assert scorer.final_scores([], now).tolist() == []
+
+    def test_score_matrix(self, scorer_fixture):
+        scorer, scores = scorer_fixture
+        dates = str2timestamp("2021-02-20") + 24 * 60 * 60 * np.arange(20)
+        value = scores[0]["score_data"][0]["value"]
+
+        matrix = scorer.score_matrix(dates)
+        assert matrix.shape == (len(scorer), len(dates))
+        # Blocks of a few dates give the same result
+        assert matrix.equals(scorer.score_matrix(dates, block_size=5000))
+
+        for date in dates.tolist():
+            assert (
+                matrix[date].tolist()
+                == scorer.final_scores(scorer.index.values, date).tolist()
+            )
+
+        subset = scorer.score_matrix(dates, ["unknown", value])
+        assert subset.loc["unknown"].tolist() == [-1] * len(dates)
+        assert subset.loc[value].tolist() == matrix.loc[value].tolist()
@@ -1,15 +1,23 @@
+import csv
 import datetime
+import gzip
 import json
 import pathlib
-import time
-from os.path import join
+import shutil
+from os.path import basename, join
 from typing import Any, Dict, List, Tuple
 
+import numpy as np
+import pandas as pd
 import pytest
-from helpers import io
-from helpers.howlong import HowLong, howlong_flush_stat
+import scoring_engine as engine
+from helpers import io, output, profiler, rescoring, selection, stats, streaming
 from pandas import DataFrame
-from scoring_engine import _calculate_iocs_score, get_single_feed_ioc_score
+from scoring_engine import (
+    _calculate_iocs_score,
+    _calculate_iocs_score_batch,
+    get_single_feed_ioc_score,
+)
 
 FIXTURES_DIR = join(pathlib.Path(__file__).parent.absolute(), "fixtures")
 
@@ -17,20 +25,26 @@ DATASET_NAME = "dataset_04_mid"
 DATASET_DIR = join(FIXTURES_DIR, DATASET_NAME)
 
 
+# Expected scores of the fixtures are calculated as of the Moscow midnight
+FIXTURES_TZ = datetime.timezone(datetime.timedelta(hours=3))
+
+
 def str2timestamp(date_iso: str) -> float:
     dt = datetime.datetime.fromisoformat(date_iso)
-    return time.mktime(dt.timetuple())
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=FIXTURES_TZ)
+    return dt.timestamp()
 
 
 @pytest.fixture(scope="class")
 def fixtures() -> Tuple[List[Dict[str, Any]], Any, DataFrame, DataFrame, float]:
     now = str2timestamp("2021-03-07")
 
-    with HowLong("fixtures"):
+    with profiler.span("fixtures"):
         cti_feeds_path = join(DATASET_DIR, "feeds")
 
         cti_feeds = io.load_feeds(cti_feeds_path)
-        lookup_df = io.load_whole_feeds(cti_feeds_path)
+        lookup_df = io.load_whole_feeds(cti_feeds)
 
         cti_feeds_path = join(DATASET_DIR, "stat")
         iocs_stats = io.load_iocs_statistics(cti_feeds_path, "iocs.csv")
@@ -40,9 +54,9 @@ def fixtures() -> Tuple[List[Dict[str, Any]], Any, DataFrame, DataFrame, float]:
 
 
 @pytest.fixture(scope="session", autouse=True)
-def howlong_flush():
+def profile_flush():
     yield
-    howlong_flush_stat()
+    profiler.flush_stat()
 
 
 class TestStatisticCalculation:
@@ -55,7 +69,7 @@ class TestStatisticCalculation:
 
     def _test_dump_iocs_score(self, fixtures):
         cti_feeds, lookup_df, iocs_stats, feeds_stats, now = fixtures
-        with HowLong("calculating overall"):
+        with profiler.span("calculating overall"):
             scores = _calculate_iocs_score(
                 cti_feeds, lookup_df, iocs_stats, feeds_stats, now
             )
@@ -65,7 +79,7 @@ class TestStatisticCalculation:
 
     def test_calculate_iocs_score(self, fixtures):
         cti_feeds, lookup_df, iocs_stats, feeds_stats, now = fixtures
-        with HowLong("calculating overall"):
+        with profiler.span("calculating overall"):
             scores = _calculate_iocs_score(
                 cti_feeds, lookup_df, iocs_stats, feeds_stats, now
             )
@@ -75,3 +89,308 @@ class TestStatisticCalculation:
 
         # TODO fix freeze on big data
         assert scores_original == scores
+
+    def test_calculate_iocs_score_batch(self, fixtures):
+        cti_feeds, _, _, feeds_stats, now = fixtures
+        with profiler.span("calculating overall batch"):
+            scores = _calculate_iocs_score_batch(cti_feeds, feeds_stats, now)
+
+        with open(join(DATASET_DIR, "stat", "scores.json")) as f:
+            scores_original = json.load(f)
+
+        scores_original = {feed["feed_name"]: feed for feed in scores_original}
+        for feed in scores:
+            assert scores_original[feed["feed_name"]] == feed
+
+    def test_stream_iocs_score(self, fixtures, tmp_path, monkeypatch):
+        cti_feeds, _, _, _, now = fixtures
+        whitelist_path = tmp_path / "whitelist.txt"
+        whitelist_path.write_text(
+            "\n".join(["0.0.0.0/2", *cti_feeds[0]["df"]["value"].head(5)])
+        )
+        monkeypatch.setattr(engine, "WHITELISTS_PATH", str(whitelist_path))
+        spill_dir = tmp_path / "spill"
+        spill_dir.mkdir()
+
+        feeds_stats = stats.calculate_all_statistics(cti_feeds, use_tqdm=False)
+        scores = _calculate_iocs_score_batch(
+            cti_feeds, feeds_stats["feeds"].set_index("feed_name"), now
+        )
+
+        loaded_files: List[str] = []
+        np_load = np.load
+
+        def load(file, *args, **kwargs):
+            loaded_files.append(pathlib.Path(file).name)
+            return np_load(file, *args, **kwargs)
+
+        monkeypatch.setattr(streaming.np, "load", load)
+
+        # Tiny budget and chunks: every chunk is spilled to disk
+        streamed = streaming.stream_iocs_score(
+            join(DATASET_DIR, "feeds"),
+            now,
+            memory_budget=10_000,
+            chunksize=50,
+            partitions=4,
+            spill_dir=str(spill_dir),
+        )
+        streamed_scores: Dict[str, List] = {feed["feed_name"]: [] for feed in scores}
+        for row in streamed:
+            streamed_scores[row.pop("feed_name")].append(row)
+
+        assert not list(spill_dir.iterdir())
+        # Spilled rows are read once, the factorized partitions once more
+        assert len(loaded_files) == len(set(loaded_files))
+        assert sum(name.endswith("-stored.npz") for name in loaded_files) == 4
+        for feed in scores:
+            assert sorted(feed["score_data"], key=json.dumps) == sorted(
+                streamed_scores[feed["feed_name"]], key=json.dumps
+            )
+
+        min_score = 40
+        selected: Dict[str, List] = {feed["feed_name"]: [] for feed in scores}
+        for row in engine.calculate_iocs_score_stream(
+            join(DATASET_DIR, "feeds"), now, chunksize=50, min_score=min_score
+        ):
+            selected[row.pop("feed_name")].append(row)
+
+        assert 0 < sum(map(len, selected.values())) < sum(
+            len(feed["score_data"]) for feed in scores
+        )
+        for feed in scores:
+            assert sorted(selected[feed["feed_name"]], key=json.dumps) == sorted(
+                (row for row in feed["score_data"] if row["score"] >= min_score),
+                key=json.dumps,
+            )
+
+    def test_incremental_rescoring(self, tmp_path, monkeypatch):
+        feeds_path = tmp_path / "feeds"
+        shutil.copytree(join(DATASET_DIR, "feeds"), feeds_path)
+        now = str2timestamp("2021-03-07")
+
+        def calculate(dt_now, incremental=True):
+            return engine.calculate_iocs_score(
+                str(feeds_path), dt_now=dt_now, incremental=incremental
+            )
+
+        # The score table is kept only if asked for
+        engine.calculate_iocs_score(str(feeds_path), dt_now=now)
+        assert not (feeds_path / rescoring.SCORES_FILE).exists()
+
+        scores = calculate(now)
+        assert (feeds_path / rescoring.SCORES_FILE).exists()
+
+        dirty_counts = []
+        get_dirty_iocs = rescoring.get_dirty_iocs
+
+        def count_dirty(*args, **kwargs):
+            dirty = get_dirty_iocs(*args, **kwargs)
+            dirty_counts.append(int(dirty.sum()))
+            return dirty
+
+        monkeypatch.setattr(rescoring, "get_dirty_iocs", count_dirty)
+        assert calculate(now) == scores
+        assert dirty_counts == [0]
+
+        # Decay moves with time, IoCs decayed completely keep their scores
+        later = now + 3 * 24 * 60 * 60
+        assert calculate(later) == calculate(later, incremental=False)
+        assert (
+            0
+            < dirty_counts[-1]
+            < len(rescoring.load_scores(str(feeds_path))["iocs.score"])
+        )
+        much_later = now + 30 * 24 * 60 * 60
+        assert calculate(much_later) == calculate(much_later, incremental=False)
+        assert calculate(much_later + 60) == calculate(
+            much_later + 60, incremental=False
+        )
+        assert dirty_counts[-1] == 0
+        # Back in time everything is re-scored
+        assert calculate(now) == scores
+
+        # One feed is modified, one removed and one added
+        feed = pd.read_csv(feeds_path / "feed_0.csv", index_col=0)
+        feed.iloc[::2].to_csv(feeds_path / "feed_0.csv")
+        (feeds_path / "feed_1.csv").unlink()
+        shutil.copy(feeds_path / "feed_2.csv", feeds_path / "feed_5.csv")
+
+        assert calculate(later) == calculate(later, incremental=False)
+
+    def test_incremental_reads_changed_feeds(self, tmp_path, monkeypatch):
+        feeds_path = tmp_path / "feeds"
+        shutil.copytree(join(DATASET_DIR, "feeds"), feeds_path)
+        now = str2timestamp("2021-03-07")
+        later = now + 3 * 24 * 60 * 60
+
+        read_feeds = []
+        load_single_feed = io.load_single_feed
+
+        def recording_load(fullpath, *args, **kwargs):
+            read_feeds.append(basename(fullpath))
+            return load_single_feed(fullpath, *args, **kwargs)
+
+        def calculate(dt_now):
+            read_feeds.clear()
+            with monkeypatch.context() as patch:
+                patch.setattr(io, "load_single_feed", recording_load)
+                return engine.calculate_iocs_score(
+                    str(feeds_path), dt_now=dt_now, incremental=True
+                )
+
+        calculate(now)
+        assert sorted(read_feeds) == [f"feed_{i}.csv" for i in range(5)]
+
+        # Nothing changed: no feed is read
+        assert calculate(later) == engine.calculate_iocs_score(
+            str(feeds_path), dt_now=later
+        )
+        assert read_feeds == []
+
+        # Only the modified and the added feeds are read
+        feed = pd.read_csv(feeds_path / "feed_0.csv", index_col=0)
+        feed.iloc[::2].to_csv(feeds_path / "feed_0.csv")
+        (feeds_path / "feed_1.csv").unlink()
+        shutil.copy(feeds_path / "feed_2.csv", feeds_path / "feed_5.csv")
+
+        assert calculate(later) == engine.calculate_iocs_score(
+            str(feeds_path), dt_now=later
+        )
+        assert sorted(read_feeds) == ["feed_0.csv", "feed_5.csv"]
+        assert calculate(later) == engine.calculate_iocs_score(
+            str(feeds_path), dt_now=later
+        )
+        assert read_feeds == []
+
+    def test_select_scores(self):
+        scores = pd.Series([5, 70, 90, 70, 10, 90, 70]).to_numpy()
+
+        assert selection.select_scores(scores, min_score=70).tolist() == [1, 2, 3, 5, 6]
+        assert selection.select_scores(scores, k=4).tolist() == [2, 5, 1, 3]
+        assert selection.select_scores(scores, min_score=80, k=5).tolist() == [2, 5]
+        assert selection.select_scores(scores, k=0).tolist() == []
+
+    def test_select_iocs_score(self, tmp_path):
+        feeds_path = tmp_path / "feeds"
+        shutil.copytree(join(DATASET_DIR, "feeds"), feeds_path)
+        now = str2timestamp("2021-03-07")
+
+        scores = engine.calculate_iocs_score(str(feeds_path), dt_now=now)
+        selected = engine.select_iocs_score(
+            str(feeds_path), min_score=1, top_k=20, dt_now=now
+        )
+
+        assert [feed["feed_name"] for feed in selected] == [
+            feed["feed_name"] for feed in scores
+        ]
+        for feed, selected_feed in zip(scores, selected):
+            expected = [row for row in feed["score_data"] if row["score"] >= 1]
+            expected.sort(key=lambda row: -row["score"])
+            assert selected_feed["score_data"] == expected[:20]
+
+    def test_iter_iocs_score_rows(self, tmp_path):
+        feeds_path = tmp_path / "feeds"
+        shutil.copytree(join(DATASET_DIR, "feeds"), feeds_path)
+        now = str2timestamp("2021-03-07")
+
+        scores = engine.calculate_iocs_score(str(feeds_path), dt_now=now)
+        expected = [
+            {"feed_name": feed["feed_name"], **row}
+            for feed in scores
+            for row in feed["score_data"]
+        ]
+
+        rows = list(
+            engine.iter_iocs_score_rows(str(feeds_path), dt_now=now, block_size=100)
+        )
+        assert json.dumps(rows) == json.dumps(expected)
+
+        ndjson_path = str(tmp_path / "scores.ndjson.gz")
+        with output.open_output(ndjson_path) as file:
+            assert output.write_rows(iter(rows), file) == len(rows)
+        with gzip.open(ndjson_path, "rt") as file:
+            assert [json.loads(line) for line in file] == json.loads(
+                json.dumps(expected)
+            )
+
+        csv_path = str(tmp_path / "scores.csv")
+        with output.open_output(csv_path) as file:
+            output.write_rows(iter(rows), file, "csv")
+        with open(csv_path, newline="") as file:
+            csv_rows = list(csv.DictReader(file))
+        assert [row["value"] for row in csv_rows] == [str(row["value"]) for row in rows]
+        assert [json.loads(row["feeds_scores"]) for row in csv_rows] == [
+            row["feeds_scores"] for row in rows
+        ]
+
+        with pytest.raises(ValueError), open(csv_path, "w") as file:
+            output.write_rows(iter(rows), file, "xml")
+
+    def test_columnar_iocs_score(self, tmp_path):
+        feeds_path = tmp_path / "feeds"
+        shutil.copytree(join(DATASET_DIR, "feeds"), feeds_path)
+        now = str2timestamp("2021-03-07")
+
+        scores = engine.calculate_iocs_score(str(feeds_path), dt_now=now)
+        scores_table = engine.calculate_iocs_score(
+            str(feeds_path), dt_now=now, columnar=True
+        )
+
+        assert json.dumps(scores_table.to_feeds()) == json.dumps(scores)
+        assert len(scores_table) == sum(len(feed["score_data"]) for feed in scores)
+
+        frame = scores_table.to_frame()
+        rows = [row for feed in scores for row in feed["score_data"]]
+        assert frame["feed_name"].tolist() == [
+            feed["feed_name"] for feed in scores for _ in feed["score_data"]
+        ]
+        assert frame["last_seen"].tolist() == [row["last_seen"] for row in rows]
+
+        # Explanation of the row is a slice of the flat arrays
+        row = rows[-1]
+        offset = int(frame["mentions_offset"].iloc[-1])
+        assert (
+            scores_table.source_confidences[offset : offset + row["ioc_mentions"]]
+        ).tolist() == row["source_confidences"]
+
+        with pytest.raises(ValueError):
+            engine.calculate_iocs_score(
+                str(feeds_path), dt_now=now, batch=False, columnar=True
+            )
+
+    def test_iter_unique_iocs_score(self, tmp_path):
+        feeds_path = tmp_path / "feeds"
+        shutil.copytree(join(DATASET_DIR, "feeds"), feeds_path)
+        now = str2timestamp("2021-03-07")
+
+        # Mention IoCs of one feed in another one as well
+        feed_1 = pd.read_csv(feeds_path / "feed_1.csv", index_col=0)
+        feed_2 = pd.read_csv(feeds_path / "feed_2.csv", index_col=0)
+        shared = feed_1.head(10).assign(last_seen="2021-03-06")
+        pd.concat([feed_2, shared], ignore_index=True).to_csv(feeds_path / "feed_2.csv")
+
+        rows = list(engine.iter_iocs_score_rows(str(feeds_path), dt_now=now))
+        unique = list(
+            engine.iter_unique_iocs_score(str(feeds_path), dt_now=now, block_size=100)
+        )
+
+        by_value: Dict[str, List[Dict]] = {}
+        for row in rows:
+            by_value.setdefault(row["value"], []).append(row)
+
+        assert [record["value"] for record in unique] == list(by_value)
+        assert len(unique) == len(rows) - 10
+        for record in unique:
+            value_rows = by_value[record["value"]]
+            assert record["score"] == value_rows[0]["score"]
+            assert record["ioc_mentions"] == value_rows[0]["ioc_mentions"]
+            assert record["feeds_scores"] == value_rows[0]["feeds_scores"]
+            assert record["feeds"] == [row["feed_name"] for row in value_rows]
+            assert record["first_seen"] == min(row["first_seen"] for row in value_rows)
+            assert record["last_seen"] == max(row["last_seen"] for row in value_rows)
+
+        top = list(engine.iter_unique_iocs_score(str(feeds_path), dt_now=now, top_k=5))
+        assert [record["score"] for record in top] == sorted(
+            (record["score"] for record in unique), reverse=True
+        )[:5]
@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+import json
+import pathlib
+import shutil
+import time
+from os.path import join
+from urllib.parse import quote
+
+import pandas as pd
+import scoring_engine as engine
+from helpers.service import ScoringService
+
+FIXTURES_DIR = join(pathlib.Path(__file__).parent.absolute(), "fixtures")
+
+DATASET_NAME = "dataset_04_mid"
+DATASET_DIR = join(FIXTURES_DIR, DATASET_NAME)
+
+
+def str2timestamp(date_iso: str) -> float:
+    dt = datetime.datetime.fromisoformat(date_iso)
+    return time.mktime(dt.timetuple())
+
+
+async def request(reader, writer, method: str, target: str, payload=None):
+    body = json.dumps(payload).encode() if payload is not None else b""
+    writer.write(
+        f"{method} {target} HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+        + body
+    )
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line == b"\r\n":
+            break
+        name, _, value = line.decode().partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    data = await reader.readexactly(int(headers["content-length"]))
+    return status, json.loads(data)
+
+
+class TestService:
+    def test_service(self, tmp_path, monkeypatch):
+        whitelist_path = tmp_path / "whitelist.txt"
+        whitelist_path.write_text("10.0.0.0/8\n")
+        monkeypatch.setattr(engine, "WHITELISTS_PATH", str(whitelist_path))
+        feeds_path = tmp_path / "feeds"
+        shutil.copytree(join(DATASET_DIR, "feeds"), feeds_path)
+        socket_path = str(tmp_path / "scoring.sock")
+        now = str2timestamp("2021-03-07")
+        value = pd.read_csv(feeds_path / "feed_0.csv")["value"][0]
+
+        async def scenario():
+            service = ScoringService(str(feeds_path), check_interval=0)
+            server = await service.start(unix_socket=socket_path)
+            scorer = service.scorer
+
+            async with server:
+                reader, writer = await asyncio.open_unix_connection(socket_path)
+
+                status, single = await request(
+                    reader, writer, "GET", f"/score?ioc={quote(value)}&dt_now={now}"
+                )
+                assert status == 200
+                assert single == scorer.query_one(value, now)
+
+                status, error = await request(
+                    reader, writer, "GET", "/score?ioc=unknown"
+                )
+                assert status == 404 and "error" in error
+
+                status, bulk = await request(
+                    reader,
+                    writer,
+                    "POST",
+                    "/score",
+                    {"iocs": [value, "unknown"], "dt_now": now},
+                )
+                assert status == 200
+                assert bulk == {"results": [single, None]}
+
+                status, _ = await request(reader, writer, "GET", "/score")
+                assert status == 400
+                for payload in (
+                    {"iocs": [value], "dt_now": "yesterday"},
+                    {"iocs": [value], "dt_now": [now]},
+                    {"iocs": [[value]], "dt_now": now},
+                    {"iocs": [{"value": value}]},
+                    {"iocs": [value, None]},
+                ):
+                    status, error = await request(
+                        reader, writer, "POST", "/score", payload
+                    )
+                    assert status == 400 and "error" in error
+
+                # Scorer failures are answered with a JSON error
+                def failing_query(*args):
+                    raise RuntimeError("scorer failed")
+
+                service.scorer.query = failing_query
+                status, error = await request(
+                    reader, writer, "POST", "/score", {"iocs": [value]}
+                )
+                assert status == 500 and "scorer failed" in error["error"]
+                del service.scorer.query
+                status, _ = await request(reader, writer, "GET", "/unknown")
+                assert status == 404
+
+                # Nothing changed, the scorer is kept
+                assert not await service.reload_if_modified()
+                assert service.scorer is scorer
+
+                # The feed is removed, the scorer is rebuilt and swapped
+                (feeds_path / "feed_0.csv").unlink()
+                assert await service.reload_if_modified()
+                assert service.scorer is not scorer
+
+                status, health = await request(reader, writer, "GET", "/health")
+                assert status == 200
+                assert health["feeds"] == 4 and health["loads_count"] == 2
+
+                # The whitelist is modified, the scorer is rebuilt
+                scorer = service.scorer
+                whitelist_path.write_text("10.0.0.0/8\n192.168.0.0/16\n")
+                assert await service.reload_if_modified()
+                assert service.scorer is not scorer
+                assert not await service.reload_if_modified()
+
+                writer.close()
+            await service.stop()
+
+        asyncio.run(scenario())
@@ -0,0 +1,92 @@
+import datetime
+import json
+import pathlib
+import shutil
+import time
+from os.path import join
+
+import numpy as np
+import pandas as pd
+
+import scoring_engine as engine
+from helpers import io, keys, snapshot
+from helpers.index import IocIndex
+
+FIXTURES_DIR = join(pathlib.Path(__file__).parent.absolute(), "fixtures")
+
+DATASET_NAME = "dataset_04_mid"
+DATASET_DIR = join(FIXTURES_DIR, DATASET_NAME)
+
+
+def str2timestamp(date_iso: str) -> float:
+    dt = datetime.datetime.fromisoformat(date_iso)
+    return time.mktime(dt.timetuple())
+
+
+class TestSnapshot:
+    def test_packed_strings(self):
+        values = np.array(["a", "bcd", np.nan, "", "жж"], dtype=object)
+        buffer, missing = io.encode_strings(values)
+        packed = snapshot.PackedStrings(
+            buffer, snapshot.string_offsets(buffer, len(values)), missing
+        )
+
+        assert len(packed) == 5
+        assert packed[1] == "bcd"
+        assert packed[4] == "жж"
+        assert packed[np.array([4, 0])].tolist() == ["жж", "a"]
+        assert pd.isna(packed[2])
+        assert str(packed[:].tolist()) == str(values.tolist())
+
+    def test_warm_start(self, tmp_path, monkeypatch):
+        feeds_path = tmp_path / "feeds"
+        shutil.copytree(join(DATASET_DIR, "feeds"), feeds_path)
+        monkeypatch.setattr(engine, "WHITELISTS_PATH", str(tmp_path / "whitelists"))
+        now = str2timestamp("2021-03-07")
+
+        built = engine.load_iocs_scorer(str(feeds_path))
+        assert (feeds_path / snapshot.SNAPSHOT_FILE).is_file()
+
+        warm = engine.load_iocs_scorer(str(feeds_path))
+        assert isinstance(warm.index.values, snapshot.PackedStrings)
+        assert not warm.index.indptr.flags.writeable
+
+        values = [*built.index.values[::3].tolist(), "unknown", None, np.nan]
+        assert json.dumps(warm.query(values, now)) == json.dumps(
+            built.query(values, now)
+        )
+        assert warm.query_one(values[0], now) == built.query_one(values[0], now)
+        assert warm.score_matrix([now]).equals(built.score_matrix([now]))
+
+        # Changed feeds make the snapshot stale, it is rebuilt
+        feed = pd.read_csv(feeds_path / "feed_0.csv", index_col=0)
+        feed.loc[len(feed)] = feed.iloc[0].copy()
+        feed.loc[len(feed) - 1, "value"] = "203.0.113.7"
+        feed.to_csv(feeds_path / "feed_0.csv")
+
+        assert snapshot.load_snapshot(
+            str(feeds_path), engine.feeds_checksums(str(feeds_path))
+        ) is None
+        assert "203.0.113.7" in engine.load_iocs_scorer(str(feeds_path))
+        assert "203.0.113.7" in engine.load_iocs_scorer(str(feeds_path))
+
+    def test_without_keys(self, tmp_path, monkeypatch):
+        cti_feeds = io.load_feeds(join(DATASET_DIR, "feeds"))
+        index = IocIndex.from_feeds(cti_feeds)
+        confidences = np.linspace(0.1, 0.9, len(index.feed_names))
+
+        ioc_keys = keys.ioc_keys
+        monkeypatch.setattr(
+            keys, "ioc_keys", lambda values: ioc_keys(values) % np.uint64(2)
+        )
+        snapshot.write_snapshot(str(tmp_path), index, confidences, {})
+        monkeypatch.setattr(keys, "ioc_keys", ioc_keys)
+
+        stored = snapshot.load_snapshot(str(tmp_path))
+        assert stored.index.keys is None
+        assert np.array_equal(
+            stored.edge_confidences, confidences[index.feed_ids]
+        )
+
+        values = [*index.values[:50].tolist(), "unknown"]
+        assert stored.index.ioc_ids(values).tolist() == index.ioc_ids(values).tolist()
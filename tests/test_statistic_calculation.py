@@ -1,11 +1,20 @@
+import calendar
+import csv
+import datetime
+import ipaddress
 import pathlib
 import random
-from os.path import join
-from typing import Tuple
+import shutil
+from glob import glob
+from io import StringIO
+from os.path import basename, join
+from typing import Dict, List, Tuple
 
+import numpy as np
+import pandas as pd
 import pytest
-from helpers import io, stats
-from helpers.howlong import HowLong, howlong_flush_stat
+import scoring_engine as engine
+from helpers import io, partials, profiler, stats
 
 FIXTURES_DIR = join(pathlib.Path(__file__).parent.absolute(), "fixtures")
 
@@ -16,22 +25,112 @@ random.seed(1337)
 
 
 def get_stat(path: str) -> Tuple[str, str]:  # (iocs, feeds)
-    with HowLong("overall"):
+    with profiler.span("overall"):
         cti_feeds = io.load_feeds(path)
         stat = stats.calculate_all_statistics(cti_feeds, use_tqdm=False)
 
     return io.write_statistics(None, **stat)
 
 
+def reference_feeds_stat(feeds_path: str, whitelist_path: str) -> pd.DataFrame:
+    """
+    Feeds statistics computed row by row with the plain formulas of
+    the paper, independently of the engine, for the IP whitelist
+    """
+    with open(whitelist_path) as file:
+        networks = [
+            ipaddress.ip_network(line.strip())
+            for line in file
+            if line.strip() and not line.startswith("#")
+        ]
+
+    def is_whitelisted(value: str) -> bool:
+        try:
+            address = ipaddress.ip_address(value)
+        except ValueError:
+            return False
+        return any(address in network for network in networks)
+
+    def timestamp(date: str) -> int:
+        return calendar.timegm(datetime.date.fromisoformat(date).timetuple())
+
+    feeds: Dict[str, List[Dict[str, str]]] = {}
+    for filename in sorted(glob(join(feeds_path, "*.csv"))):
+        with open(filename) as file:
+            feeds[basename(filename)] = list(csv.DictReader(file))
+
+    min_first_seen: Dict[str, int] = {}
+    for rows in feeds.values():
+        for row in rows:
+            first_seen = timestamp(row["first_seen"])
+            min_first_seen[row["value"]] = min(
+                min_first_seen.get(row["value"], first_seen), first_seen
+            )
+    overall = sum(len(rows) for rows in feeds.values())
+
+    records = []
+    for feed_name, rows in feeds.items():
+        size = len(rows)
+        extensiveness = round(
+            sum(
+                round(
+                    (
+                        (row["last_seen"] != "")
+                        + (int(row["relationship_count"]) > 0)
+                        + (int(row["detections_count"]) > 0)
+                    )
+                    / 3,
+                    2,
+                )
+                for row in rows
+            )
+            / size,
+            3,
+        )
+        completeness = round(size / overall, 3)
+        timeliness = round(
+            sum(
+                min_first_seen[row["value"]] / timestamp(row["first_seen"])
+                for row in rows
+            )
+            / size,
+            3,
+        )
+        whitelisted = sum(is_whitelisted(row["value"]) for row in rows)
+        wl_overlap = round(max(0, 1 - (whitelisted / (size * 0.1)) ** 2), 3)
+        source_confidence = round(
+            (0.8 * extensiveness + 0.6 * timeliness + 0.5 * completeness + wl_overlap)
+            / 2.9,
+            3,
+        )
+        records.append(
+            {
+                "feed_name": feed_name,
+                "feed_extensiveness": extensiveness,
+                "feed_completeness": completeness,
+                "feed_timeliness": timeliness,
+                "feed_wl_overlap": wl_overlap,
+                "feed_source_confidence": source_confidence,
+                "feed_size": size,
+            }
+        )
+
+    return pd.DataFrame(records).set_index("feed_name")
+
+
 @pytest.fixture(scope="class")
 def stat_fixture():
-    return get_stat(join(DATASET_DIR, "feeds"))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(
+            engine, "WHITELISTS_PATH", join(DATASET_DIR, "whitelist.txt")
+        )
+        return get_stat(join(DATASET_DIR, "feeds"))
 
 
 @pytest.fixture(scope="session", autouse=True)
-def howlong_flush():
+def profile_flush():
     yield
-    howlong_flush_stat()
+    profiler.flush_stat()
 
 
 class TestStatisticCalculation:
@@ -53,16 +152,170 @@ class TestStatisticCalculation:
                 assert line[:-1] == iocs_csv_raw_lines[count]
                 count += 1
 
-    # The test below is not valid because we have
-    # randomly-generated whitelist overlap ratio at
-    # `scoring_engine`: get_whitelist_overlap_coef()
-    #
-    # def test_feeds_stat(self, stat_fixture):
-    #     iocs_csv_raw, feeds_csv_raw = stat_fixture
-    #     feeds_csv_raw_lines = feeds_csv_raw.split("\n")
-    #
-    #     with open(join(DATASET_DIR, "stat", "feeds.csv")) as original_csv:
-    #         count = 0
-    #         for line in original_csv:
-    #             assert line[:-1] == feeds_csv_raw_lines[count]
-    #             count += 1
+    @pytest.mark.parametrize("dataset", ["dataset_03_xl", "dataset_04_mid"])
+    def test_vectorized_feeds_coefs(self, dataset):
+        cti_feeds = io.load_feeds(join(FIXTURES_DIR, dataset, "feeds"))
+        iocs_min_date = stats._get_meta_data(cti_feeds, use_tqdm=False)[
+            "min_first_seen"
+        ]
+
+        for feed in cti_feeds:
+            assert engine.get_extensiveness_coef(
+                feed["df"]
+            ) == engine.get_extensiveness_coef_vectorized(feed["df"])
+            # Sigma is rounded once, see `functions.timeliness_sigmas`
+            assert engine.get_timeliness_coef(
+                feed["df"], iocs_min_date
+            ) == pytest.approx(
+                engine.get_timeliness_coef_vectorized(feed["df"], iocs_min_date),
+                abs=1e-3,
+            )
+
+    def test_binary_statistics_roundtrip(self, tmp_path):
+        cti_feeds = io.load_feeds(join(DATASET_DIR, "feeds"))
+        stat = stats.calculate_all_statistics(cti_feeds, use_tqdm=False)
+        io.write_statistics(str(tmp_path), **stat)
+
+        loaded = io.load_statistics(str(tmp_path))
+        iocs_stats = stat["iocs"].set_index("value")
+
+        assert loaded["iocs"].index.equals(iocs_stats.index)
+        assert loaded["iocs"]["id"].tolist() == iocs_stats["id"].tolist()
+        assert np.array_equal(loaded["membership"][0], stat["index"].indptr)
+        assert np.array_equal(loaded["membership"][1], stat["index"].feed_ids)
+        assert (
+            loaded["feeds"]["feed_source_confidence"].tolist()
+            == stat["feeds"]["feed_source_confidence"].tolist()
+        )
+
+    def test_legacy_statistics_conversion(self, tmp_path):
+        iocs_csv_raw, feeds_csv_raw = get_stat(join(DATASET_DIR, "feeds"))
+        (tmp_path / ".iocs-statistics").write_text(iocs_csv_raw)
+        (tmp_path / ".feeds-statistics").write_text(feeds_csv_raw)
+
+        loaded = io.load_statistics(str(tmp_path))
+        legacy = io.load_iocs_statistics(str(tmp_path))
+
+        assert (tmp_path / io.STATISTICS_FILE).is_file()
+        assert loaded["iocs"]["mentioned_in_count"].tolist() == (
+            legacy["mentioned_in_count"].tolist()
+        )
+
+    def test_lost_statistics_store(self, tmp_path):
+        feeds_path = tmp_path / "feeds"
+        shutil.copytree(join(DATASET_DIR, "feeds"), feeds_path)
+        *_, arrays = engine.load_scoring_data(str(feeds_path))
+
+        # The aggregates are unchanged, the store is derived from them
+        (feeds_path / io.STATISTICS_FILE).unlink()
+        *_, rebuilt = engine.load_scoring_data(str(feeds_path))
+
+        assert (feeds_path / io.STATISTICS_FILE).is_file()
+        assert arrays.keys() == rebuilt.keys()
+        for key in arrays:
+            assert np.array_equal(arrays[key], rebuilt[key])
+
+    def test_partials_timeliness(self, monkeypatch):
+        monkeypatch.setattr(engine, "get_whitelist_overlap_coef", lambda df: 0.5)
+        # Ratios alternate 0.9996 and 0.9990: rounded after every row the
+        # feed timeliness would be 1.0, summed up it is 0.999
+        rows = 100
+        values = [f"10.0.0.{i}" for i in range(rows)]
+        cti_feeds = [
+            {
+                "name": name,
+                "df": pd.DataFrame(
+                    {
+                        "id": [f"{name}-{i}" for i in range(rows)],
+                        "value": values,
+                        "first_seen": first_seen,
+                        "last_seen": first_seen,
+                        "relationship_count": 1,
+                        "detections_count": 0,
+                    }
+                ),
+            }
+            for name, first_seen in [
+                ("late.csv", [10_000] * rows),
+                ("early.csv", [9_996, 9_990] * (rows // 2)),
+            ]
+        ]
+
+        full = stats.calculate_all_statistics(cti_feeds, use_tqdm=False)
+        aggregates = partials.empty_partials()
+        for feed in cti_feeds:
+            aggregates = partials.add_feed(aggregates, feed["name"], feed["df"])
+        incremental = partials.partials_to_statistics(aggregates)
+
+        full_feeds = full["feeds"].set_index("feed_name")
+        assert full_feeds.at["late.csv", "feed_timeliness"] == 0.999
+        pd.testing.assert_frame_equal(
+            incremental["feeds"].set_index("feed_name"), full_feeds
+        )
+
+    def test_incremental_statistics(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(engine, "get_whitelist_overlap_coef", lambda df: 0.5)
+        feeds_path = tmp_path / "feeds"
+        shutil.copytree(join(DATASET_DIR, "feeds"), feeds_path)
+
+        cti_feeds = io.load_feeds(str(feeds_path))
+        incremental = partials.update_statistics(str(feeds_path), cti_feeds)
+        full = stats.calculate_all_statistics(cti_feeds, use_tqdm=False)
+        assert io.write_statistics(None, **incremental) == io.write_statistics(
+            None, **full
+        )
+        assert partials.update_statistics(str(feeds_path)) is None
+
+        # One feed is modified, one removed and one added
+        feed = pd.read_csv(feeds_path / "feed_0.csv", index_col=0)
+        feed.iloc[::2].to_csv(feeds_path / "feed_0.csv")
+        (feeds_path / "feed_1.csv").unlink()
+        shutil.copy(feeds_path / "feed_2.csv", feeds_path / "feed_5.csv")
+
+        incremental = partials.update_statistics(str(feeds_path))
+        full = stats.calculate_all_statistics(
+            io.load_feeds(str(feeds_path)), use_tqdm=False
+        )
+
+        incremental_iocs = incremental["iocs"].set_index("value").sort_index()
+        full_iocs = full["iocs"].set_index("value").sort_index()
+        assert incremental_iocs["min_first_seen"].equals(full_iocs["min_first_seen"])
+        for stat, iocs in ((incremental, incremental_iocs), (full, full_iocs)):
+            iocs["feeds"] = pd.Series(
+                io.membership_lists(
+                    stat["feeds"]["feed_name"].to_numpy(), *stat["membership"]
+                ),
+                index=stat["iocs"]["value"].to_numpy(),
+            ).map(sorted)
+        assert incremental_iocs["feeds"].equals(full_iocs["feeds"])
+        assert (
+            incremental["feeds"]
+            .set_index("feed_name")
+            .sort_index()
+            .equals(full["feeds"].set_index("feed_name").sort_index())
+        )
+
+    def test_feeds_stat(self, stat_fixture):
+        iocs_csv_raw, feeds_csv_raw = stat_fixture
+
+        # Feeds come in the order of the files listing, compare them by name
+        def read_feeds(csv) -> pd.DataFrame:
+            return pd.read_csv(csv, index_col=0).set_index("feed_name").sort_index()
+
+        expected = read_feeds(join(DATASET_DIR, "stat", "feeds.csv"))
+        assert len(expected.index)
+        pd.testing.assert_frame_equal(read_feeds(StringIO(feeds_csv_raw)), expected)
+
+    def test_feeds_stat_reference(self):
+        # The stored expected values agree with the formulas computed
+        # without the engine, not only with the engine output
+        expected = pd.read_csv(
+            join(DATASET_DIR, "stat", "feeds.csv"), index_col=0
+        ).set_index("feed_name")
+        reference = reference_feeds_stat(
+            join(DATASET_DIR, "feeds"), join(DATASET_DIR, "whitelist.txt")
+        )
+
+        pd.testing.assert_frame_equal(
+            reference.sort_index(), expected.sort_index(), check_dtype=False
+        )
@@ -0,0 +1,136 @@
+import json
+import pathlib
+import shutil
+from os.path import join
+
+import numpy as np
+import pandas as pd
+
+import functions
+import scoring_engine as engine
+from helpers import partials
+from helpers.whitelist import Whitelist, get_whitelist, ip_keys
+
+FIXTURES_DIR = join(pathlib.Path(__file__).parent.absolute(), "fixtures")
+
+DATASET_NAME = "dataset_04_mid"
+DATASET_DIR = join(FIXTURES_DIR, DATASET_NAME)
+
+
+class TestWhitelist:
+    def test_contains(self):
+        whitelist = Whitelist.from_entries(
+            ["Example.com", "10.0.0.0/8", "10.5.0.0/16", "192.168.1.1", "2001:db8::/32"]
+        )
+        values = [
+            "example.com",
+            " EXAMPLE.COM",
+            "sub.example.com",
+            "10.0.0.0",
+            "10.255.255.255",
+            "11.0.0.0",
+            "192.168.1.1",
+            "192.168.1.2",
+            "2001:db8::1",
+            "2001:db9::",
+            "::ffff:10.1.2.3",
+            "010.1.2.3",
+            np.nan,
+            None,
+        ]
+
+        assert whitelist.contains(values).tolist() == [
+            True,
+            True,
+            False,
+            True,
+            True,
+            False,
+            True,
+            False,
+            True,
+            False,
+            True,
+            False,
+            False,
+            False,
+        ]
+        assert whitelist.overlap(values) == 7
+        assert len(whitelist.starts) == 3  # nested range merged
+        assert not Whitelist.from_entries([]).contains(values).any()
+
+    def test_ip_keys(self):
+        values = [
+            "d41d8cd98f00b204e9800998ecf8427e",
+            "deadbeef",
+            "1.2.3.4",
+            "1.2.3.400",
+            "::1",
+            "2001:db8::1",
+            "::ffff:10.1.2.3",
+            "example.com",
+            "ab:cd",
+            None,
+            "01.2.3.4",
+            "255.255.255.1",
+        ]
+        positions, keys = ip_keys(values)
+
+        assert positions.tolist() == [2, 4, 5, 6, 11]
+        assert keys[4] == keys[0][:12] + bytes([255, 255, 255, 1])
+        assert keys[0] == b"\x00" * 10 + b"\xff\xff" + bytes([1, 2, 3, 4])
+        assert keys[3] == keys[0][:12] + bytes([10, 1, 2, 3])
+
+    def test_load(self, tmp_path):
+        (tmp_path / "top-1m.csv").write_text("1,example.com\n2,example.org\n")
+        (tmp_path / "ranges.txt").write_text("# private\n10.0.0.0/8\n\n")
+        (tmp_path / "misp.json").write_text(
+            json.dumps({"type": "cidr", "list": ["192.168.0.0/16"]})
+        )
+        (tmp_path / "regex.json").write_text(
+            json.dumps({"type": "regex", "list": [".*"]})
+        )
+
+        whitelist = get_whitelist(str(tmp_path))
+        assert whitelist.contains(
+            ["example.org", "10.1.1.1", "192.168.5.5", "evil.com"]
+        ).tolist() == [True, True, True, False]
+        assert get_whitelist(str(tmp_path)) is whitelist
+
+        (tmp_path / "ranges.txt").write_text("172.16.0.0/12\n")
+        reloaded = get_whitelist(str(tmp_path))
+        assert reloaded.fingerprint != whitelist.fingerprint
+        assert reloaded.contains(["10.1.1.1", "172.16.0.1"]).tolist() == [False, True]
+
+    def test_no_whitelist_files(self, tmp_path, capsys):
+        whitelist = get_whitelist(str(tmp_path / "missing"))
+
+        assert not len(whitelist)
+        assert "No whitelist files" in capsys.readouterr().out
+
+    def test_wl_overlap(self, tmp_path, monkeypatch):
+        feeds_path = tmp_path / "feeds"
+        shutil.copytree(join(DATASET_DIR, "feeds"), feeds_path)
+        monkeypatch.setattr(engine, "WHITELISTS_PATH", str(tmp_path / "whitelist.txt"))
+
+        feed = pd.read_csv(feeds_path / "feed_0.csv")
+        assert engine.get_whitelist_overlap_coef(feed) == 1.0
+
+        (tmp_path / "whitelist.txt").write_text("\n".join(feed["value"].head(3)))
+        assert engine.get_whitelist_overlap_coef(
+            feed
+        ) == functions.whitelist_overlap_score(3, len(feed.index))
+
+        # Changed whitelist updates the overlaps from the stored aggregates
+        (tmp_path / "whitelist.txt").write_text("")
+        partials.update_statistics(str(feeds_path))
+        (tmp_path / "whitelist.txt").write_text("\n".join(feed["value"].head(3)))
+        statistics = partials.update_statistics(str(feeds_path))
+        feeds_stats = statistics["feeds"].set_index("feed_name")
+
+        assert feeds_stats.loc["feed_0.csv", "feed_wl_overlap"] == (
+            functions.whitelist_overlap_score(3, len(feed.index))
+        )
+        rebuilt = partials.update_statistics(str(feeds_path), force=True)
+        pd.testing.assert_frame_equal(rebuilt["feeds"], statistics["feeds"])
+        assert partials.update_statistics(str(feeds_path)) is None
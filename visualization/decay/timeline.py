@@ -1,4 +1,5 @@
 import sys
+import numpy as np
 import pandas as pd
 import plotly.express as px
 from typing import Any, Dict, List
@@ -16,21 +17,20 @@ EPOCH_DAY = 86000
 def decayed_score_timeline(
     ttl: int, decay_rate: float, ioc_last_seen: int, init_score: int = 100
 ):
-    days_coef: List[Dict[str, Any]] = []
-
-    for day in range(1, ttl):
-        rolling_day = time.mktime(datetime.now().timetuple()) + (EPOCH_DAY * day)
-        coefficient: float = functions.calculate_decay_coef(
-            decay_rate=decay_rate,
-            decay_ttl=ttl,
-            last_seen=ioc_last_seen,
-            date_now=rolling_day,
-        )
-        days_coef.append(
-            {"decay_ratio": coefficient, "day": day, "decay_ratio_value": decay_rate}
-        )
-
-    return days_coef
+    days = np.arange(1, ttl)
+    rolling_days = time.mktime(datetime.now().timetuple()) + (EPOCH_DAY * days)
+
+    coefficients = functions.calculate_decay_coef_array(
+        decay_rate=decay_rate,
+        decay_ttl=ttl,
+        last_seen=ioc_last_seen,
+        date_now=rolling_days,
+    )
+
+    return [
+        {"decay_ratio": coefficient, "day": day, "decay_ratio_value": decay_rate}
+        for coefficient, day in zip(coefficients.tolist(), days.tolist())
+    ]
 
 
 def plot(score_timeline_arr):